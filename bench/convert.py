@@ -0,0 +1,191 @@
+"""
+轉檔流程 microbenchmark
+
+以合成的 SINF map 分別量測以下階段的耗時, 並將結果存成 JSON baseline 以便跨版本比對:
+  - get_info_from_sinf, handle_row_data, generate_xml (每片 wafer, 加總為整批)
+  - compare_row_cnt, export_xml (整批)
+
+使用方式 (請在專案根目錄執行, 才讀得到 cfg.json):
+  $ python -m bench.convert --rows 200 --cols 200 --wafers 25 --repeat 5
+  $ python -m bench.convert --compare bench/baselines/convert_200x200x25.json
+"""
+import os, sys, json, time, argparse, platform, statistics, subprocess, tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from bench.sandbox import sandbox_cfg
+from bench.synth import DEFAULT_SYMBOL_MIX, parse_symbol_mix, write_sinf_lot
+from modules.cfg import get_sinf_dl_path
+from modules.xml import Map, compare_row_cnt, export_xml, generate_xml, get_info_from_sinf, get_wafer_letter, handle_row_data
+from lxml import etree
+
+
+STAGES = ["get_info_from_sinf", "handle_row_data", "compare_row_cnt", "generate_xml", "export_xml"]
+BASELINE_DIR = os.path.join("bench", "baselines")
+
+
+def run_once(lot_id: str, dl_path: str) -> dict:
+  """
+  執行一次完整的轉檔流程, 回傳各階段的耗時 (秒)
+  流程與 modules.xml.prepare_export() 相同, 只是把各階段拆開計時
+  """
+  timings = {stage: 0.0 for stage in STAGES}
+  files = os.listdir(dl_path)
+  numbers = sorted(f.split(".")[-1] for f in files)
+  wafer_letter = get_wafer_letter(files)
+  maps_el = etree.Element("Maps")
+  row_data_bef = {}
+  row_data_aft = {}
+
+  for number in numbers:
+    t0 = time.perf_counter()
+    sinf_info = get_info_from_sinf(dl_path, lot_id, number)
+    timings["get_info_from_sinf"] += time.perf_counter() - t0
+    if isinstance(sinf_info, str):
+      raise RuntimeError(f"{sinf_info}: {lot_id}.{number}")
+
+    t0 = time.perf_counter()
+    processed = handle_row_data(sinf_info["rowDataList"], sinf_info["waferId"])
+    timings["handle_row_data"] += time.perf_counter() - t0
+
+    map_inst = Map("ACIPC50K0AA111", 2.1, 2.1, processed["rowDataResult"], sinf_info["waferId"],
+                   sinf_info["rowCt"], sinf_info["colCt"], sinf_info["lot"], processed["binCounts"])
+    map_inst.set_lot_no(wafer_letter)
+
+    t0 = time.perf_counter()
+    maps_el.append(generate_xml(map_inst))
+    timings["generate_xml"] += time.perf_counter() - t0
+
+    row_data_bef[sinf_info["waferId"]] = sinf_info["rowDataList"]
+    row_data_aft[sinf_info["waferId"]] = processed["rowDataResult"]
+
+  t0 = time.perf_counter()
+  compare_result = compare_row_cnt(row_data_bef, row_data_aft)
+  timings["compare_row_cnt"] += time.perf_counter() - t0
+  if isinstance(compare_result, str):
+    raise RuntimeError(compare_result)
+
+  t0 = time.perf_counter()
+  export_result = export_xml(lot_id, maps_el, map_inst.lot_no)
+  timings["export_xml"] += time.perf_counter() - t0
+  if export_result == "ExportXmlError":
+    raise RuntimeError(export_result)
+
+  return timings
+
+
+def summarize(samples: list) -> dict:
+  """將多次量測結果整理為 min / median / mean / max (秒)"""
+  return {
+    "min": min(samples),
+    "median": statistics.median(samples),
+    "mean": statistics.fmean(samples),
+    "max": max(samples),
+    "samples": samples
+  }
+
+
+def get_git_rev() -> str:
+  """取得目前的 git commit, 取不到時回傳空字串"""
+  try:
+    return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+  except Exception:
+    return ""
+
+
+def run_benchmark(rows: int, cols: int, wafers: int, symbol_mix: dict, repeat: int, seed: int) -> dict:
+  """產生合成資料並重複量測, 回傳 baseline 格式的 dict"""
+  lot_id = "BENCH0000"
+  samples = {stage: [] for stage in STAGES}
+
+  with tempfile.TemporaryDirectory(prefix="mapin_bench_") as root, sandbox_cfg(root):
+    dl_path = get_sinf_dl_path(lot_id, f"APC_{lot_id}")
+    write_sinf_lot(dl_path, lot_id, wafers, rows, cols, symbol_mix, seed)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+      #先跑一次暖機, 不列入統計
+      run_once(lot_id, dl_path)
+      for _ in range(repeat):
+        timings = run_once(lot_id, dl_path)
+        for stage, sec in timings.items():
+          samples[stage].append(sec)
+
+  dies = rows * cols * wafers
+  return {
+    "schema": 1,
+    "benchmark": "convert",
+    "createdAt": datetime.now().isoformat(timespec="seconds"),
+    "gitRev": get_git_rev(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "params": {"rows": rows, "cols": cols, "wafers": wafers, "symbolMix": symbol_mix, "repeat": repeat, "seed": seed},
+    "dies": dies,
+    "stages": {stage: summarize(samples[stage]) for stage in STAGES}
+  }
+
+
+def compare_baseline(result: dict, baseline: dict, tolerance: float, stages: list = STAGES) -> list:
+  """
+  比對本次結果與 baseline 的 median, 回傳超出容許範圍的階段名稱
+
+  Arguments:
+    result (dict): 本次 run_benchmark() 的結果
+    baseline (dict): 先前存下的 baseline
+    tolerance (float): 容許變慢的比例, 例如 0.1 代表 10%
+    stages (list): 要比對的階段名稱
+  """
+  if result["params"] != baseline.get("params"):
+    print("Warning: benchmark params differ from baseline, comparison may be meaningless")
+
+  regressions = []
+  print(f"{'stage':<20}{'baseline':>12}{'current':>12}{'ratio':>8}")
+  for stage in stages:
+    base = baseline["stages"].get(stage, {}).get("median")
+    curr = result["stages"][stage]["median"]
+    if not base:
+      print(f"{stage:<20}{'-':>12}{curr:>12.4f}{'-':>8}")
+      continue
+    ratio = curr / base
+    flag = " <-- regression" if ratio > 1 + tolerance else ""
+    print(f"{stage:<20}{base:>12.4f}{curr:>12.4f}{ratio:>8.2f}{flag}")
+    if flag:
+      regressions.append(stage)
+  return regressions
+
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(description="Benchmark the SINF to XML conversion stages")
+  parser.add_argument("--rows", type=int, default=200)
+  parser.add_argument("--cols", type=int, default=200)
+  parser.add_argument("--wafers", type=int, default=25)
+  parser.add_argument("--mix", type=parse_symbol_mix, default=DEFAULT_SYMBOL_MIX, help='symbol weights, e.g. "__=0.2,00=0.7,OT=0.1"')
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--out", help="baseline output path, default bench/baselines/convert_{rows}x{cols}x{wafers}.json")
+  parser.add_argument("--compare", help="baseline file to compare against")
+  parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown ratio before flagging a regression")
+  args = parser.parse_args(argv)
+
+  result = run_benchmark(args.rows, args.cols, args.wafers, args.mix, args.repeat, args.seed)
+
+  print(f"{args.rows}x{args.cols} dies x {args.wafers} wafers, {args.repeat} runs (median seconds per lot)")
+  for stage in STAGES:
+    print(f"  {stage:<20}{result['stages'][stage]['median']:.4f}")
+
+  out_path = args.out or os.path.join(BASELINE_DIR, f"convert_{args.rows}x{args.cols}x{args.wafers}.json")
+  if args.compare:
+    with open(args.compare, encoding="utf-8") as f:
+      baseline = json.load(f)
+    regressions = compare_baseline(result, baseline, args.tolerance)
+    if not args.out:
+      return 1 if regressions else 0
+  else:
+    regressions = []
+
+  os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+  with open(out_path, "w", encoding="utf-8") as f:
+    json.dump(result, f, indent=2)
+  print(f"Saved baseline: {out_path}")
+  return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Golden output 等價性與效能回歸測試
+
+將 bench/golden 下的參考批次 (SINF map) 依序跑過 prepare_export() 與 export_xml(),
+比對輸出的 XML 是否與存下的 golden file 逐 byte 相同 (忽略 CreateDate / LastModified 時間戳記);
+分段轉檔 (modules.stream) 的輸出也需與 golden file 相同,
+並檢查各階段耗時與記憶體峰值是否超出 cases.json 中設定的 budget
+
+使用方式 (請在專案根目錄執行):
+  $ python -m bench.golden            #比對, 有任何不一致或超出 budget 會以 exit code 1 結束
+  $ python -m bench.golden --update   #確認輸出變更是預期的之後, 重新產生 golden file
+"""
+import os, re, sys, json, time, shutil, argparse, tempfile, tracemalloc
+from contextlib import redirect_stdout
+from bench.sandbox import sandbox_cfg
+from modules.cfg import get_sinf_dl_path
+from modules.sinf import get_sinf_info
+from modules.stream import StreamingExport
+from modules.xml import compare_row_cnt, export_xml, prepare_export
+
+
+GOLDEN_DIR = os.path.join("bench", "golden")
+TIMESTAMP_RE = re.compile(rb'(CreateDate|LastModified)="[^"]*"')
+
+
+def normalize_xml(xml_bytes: bytes) -> bytes:
+  """將 CreateDate 與 LastModified 的值清空, 其餘內容保持原樣"""
+  return TIMESTAMP_RE.sub(rb'\1=""', xml_bytes)
+
+
+def run_stages(lot_id: str, target_device: str) -> tuple:
+  """
+  執行 prepare_export() 與 export_xml(), 回傳 (XML 內容, 各階段耗時)
+  流程與 Worker.run() 的第 4-6 步相同
+  """
+  dl_path = get_sinf_dl_path(lot_id, f"APC_{lot_id}")
+  sinf_info = get_sinf_info(dl_path)
+  if isinstance(sinf_info, str):
+    raise RuntimeError(sinf_info)
+
+  timings = {}
+  t0 = time.perf_counter()
+  prepare_result = prepare_export(lot_id, target_device, sinf_info["dieSizeX"], sinf_info["dieSizeY"])
+  timings["prepare_export"] = time.perf_counter() - t0
+  if isinstance(prepare_result, str):
+    raise RuntimeError(prepare_result)
+
+  compare_result = compare_row_cnt(prepare_result["rowDataBef"], prepare_result["rowDataAft"])
+  if isinstance(compare_result, str):
+    raise RuntimeError(compare_result)
+  for code, wafer_ids in compare_result["mismatchedIds"].items():
+    if wafer_ids:
+      raise RuntimeError(f"Bin {code} mismatched: {wafer_ids}")
+
+  t0 = time.perf_counter()
+  xml_path = export_xml(lot_id, prepare_result["mapsEl"], prepare_result["lotNo"])
+  timings["export_xml"] = time.perf_counter() - t0
+  if xml_path == "ExportXmlError":
+    raise RuntimeError(xml_path)
+
+  with open(xml_path, "rb") as f:
+    return f.read(), timings
+
+
+def run_streaming(lot_id: str, target_device: str) -> bytes:
+  """以 StreamingExport 分段轉檔, 回傳 XML 內容; 流程與 Pipeline.run() 啟用 pipeline_queue_size 時相同"""
+  dl_path = get_sinf_dl_path(lot_id, f"APC_{lot_id}")
+  stream = StreamingExport(lot_id, dl_path, 2).start()
+  try:
+    for file in sorted(os.listdir(dl_path)):
+      stream.feed(file)
+    stream.end_feed()
+    stream.set_target_device(target_device)
+    result = stream.wait()
+    if not isinstance(result, dict):
+      raise RuntimeError(result or "StreamingExport fell back to prepare_export()")
+    xml_path = stream.commit()
+    if xml_path == "ExportXmlError":
+      raise RuntimeError(xml_path)
+    with open(xml_path, "rb") as f:
+      return f.read()
+  finally:
+    stream.close()
+
+
+def measure_peak_mb(lot_id: str, target_device: str) -> float:
+  """另外跑一次並以 tracemalloc 量測 Python heap 峰值 (MB), 避免 tracemalloc 影響耗時量測"""
+  tracemalloc.start()
+  try:
+    run_stages(lot_id, target_device)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak / 1024 / 1024
+
+
+def first_diff(expected: bytes, actual: bytes) -> str:
+  """回傳第一個不一致的行, 方便判讀"""
+  exp_lines = expected.splitlines()
+  act_lines = actual.splitlines()
+  for idx in range(max(len(exp_lines), len(act_lines))):
+    exp = exp_lines[idx] if idx < len(exp_lines) else b"<EOF>"
+    act = act_lines[idx] if idx < len(act_lines) else b"<EOF>"
+    if exp != act:
+      return f"line {idx + 1}:\n      expected: {exp[:160]!r}\n      actual:   {act[:160]!r}"
+  return "no line difference"
+
+
+def check_case(case: dict, update: bool) -> list:
+  """
+  執行單一參考批次, 回傳錯誤訊息列表 (空列表代表通過)
+
+  Arguments:
+    case (dict): cases.json 中的一筆設定, 包含 lotId, targetDevice, budget
+    update (bool): 是否以本次輸出覆寫 golden file
+  """
+  lot_id = case["lotId"]
+  case_dir = os.path.join(GOLDEN_DIR, lot_id)
+  expected_path = os.path.join(case_dir, "expected.xml")
+  errors = []
+
+  with tempfile.TemporaryDirectory(prefix="mapin_golden_") as root, sandbox_cfg(root):
+    shutil.copytree(os.path.join(case_dir, "input"), get_sinf_dl_path(lot_id, f"APC_{lot_id}"))
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+      xml_bytes, timings = run_stages(lot_id, case["targetDevice"])
+      peak_mb = measure_peak_mb(lot_id, case["targetDevice"])
+      streamed_bytes = run_streaming(lot_id, case["targetDevice"])
+
+  actual = normalize_xml(xml_bytes)
+  if update:
+    with open(expected_path, "wb") as f:
+      f.write(actual)
+  else:
+    with open(expected_path, "rb") as f:
+      expected = f.read()
+    if actual != expected:
+      errors.append(f"XML differs from golden file, {first_diff(expected, actual)}")
+  streamed = normalize_xml(streamed_bytes)
+  if streamed != actual:
+    errors.append(f"Streamed XML differs from prepare_export() output, {first_diff(actual, streamed)}")
+
+  budget = case.get("budget", {})
+  for stage, sec in timings.items():
+    limit = budget.get(stage, {}).get("seconds")
+    if limit is not None and sec > limit:
+      errors.append(f"{stage} took {sec:.3f}s, budget is {limit}s")
+  mem_limit = budget.get("peakMB")
+  if mem_limit is not None and peak_mb > mem_limit:
+    errors.append(f"peak Python heap {peak_mb:.1f}MB, budget is {mem_limit}MB")
+
+  stage_texts = ", ".join(f"{stage} {sec:.3f}s" for stage, sec in timings.items())
+  print(f"{lot_id}: {stage_texts}, peak {peak_mb:.1f}MB")
+  return errors
+
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(description="Golden XML equivalence and performance budget checks")
+  parser.add_argument("--update", action="store_true", help="rewrite the golden files from the current output")
+  parser.add_argument("--case", action="append", help="only run the given lot ID, can be repeated")
+  args = parser.parse_args(argv)
+
+  with open(os.path.join(GOLDEN_DIR, "cases.json"), encoding="utf-8") as f:
+    cases = json.load(f)
+  if args.case:
+    cases = [case for case in cases if case["lotId"] in args.case]
+
+  failed = 0
+  for case in cases:
+    try:
+      errors = check_case(case, args.update)
+    except Exception as e:
+      errors = [f"pipeline failed: {e}"]
+    for error in errors:
+      print(f"  FAIL {case['lotId']}: {error}")
+    failed += bool(errors)
+
+  if args.update:
+    print(f"Updated {len(cases)} golden files")
+  print(f"{len(cases) - failed} passed, {failed} failed")
+  return 1 if failed else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
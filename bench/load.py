@@ -0,0 +1,183 @@
+"""
+Pipeline.run (Worker.run) 端到端壓力測試
+
+在本地啟動 paramiko SFTP server (取代 attsftp01), 並以暫存資料夾取代 B2B folder、dl_basic_dir、
+XML 備份路徑與 AWMS 上傳路徑; 每位模擬的 operator 是一個獨立的 process (如同不同工作站),
+共用同一個下載、備份、上傳資料夾, 各自擁有自己的 export 資料夾
+
+使用方式 (請在專案根目錄執行):
+  $ python -m bench.load --operators 4 --lots 20 --wafers 25 --sftp-latency 0.02 --sftp-fail-rate 0.01
+"""
+import os, sys, json, time, random, shutil, argparse, tempfile
+import multiprocessing as mp
+from contextlib import redirect_stdout
+from bench.sandbox import sandbox_cfg
+from bench.sftp_stub import LocalSftpServer
+from bench.synth import DEFAULT_SYMBOL_MIX, parse_symbol_mix, write_sinf_lot, write_wo_csv
+from modules.cfg import get_sinf_target_path, get_wo_target_path
+from modules.wo import getLatestMonths
+
+
+def percentile(values: list, pct: float) -> float:
+  """nearest-rank 百分位數, values 為空時回傳 0"""
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+  return ordered[min(rank, len(ordered)) - 1]
+
+
+def delayed(func, latency: float, fail_rate: float):
+  """包裝 share 上的檔案複製函式, 加上延遲與隨機失敗"""
+  def wrapper(*args, **kwargs):
+    if latency > 0:
+      time.sleep(latency)
+    if fail_rate > 0 and random.random() < fail_rate:
+      raise OSError("Injected share failure")
+    return func(*args, **kwargs)
+  return wrapper
+
+
+def operator_main(op_idx: int, root: str, sftp_port: int, share_latency: float, share_fail_rate: float, lot_queue, result_queue,
+                  queue_size: int | None = None):
+  """
+  模擬單一 operator: 從 lot_queue 依序取出 lot, 執行 Pipeline.run(), 並將結果放入 result_queue
+  此函式在子 process 中執行
+  """
+  from modules import integrity, upload
+  from modules.pipeline import Pipeline
+
+  #模擬 share 延遲與失敗: WO 下載透過 shutil.copy2 (最終為 shutil.copyfile) 複製,
+  #XML 上傳與備份透過 modules.integrity.copy_verified 複製 (modules.upload 以 from import 取得, 需一併替換)
+  shutil.copyfile = delayed(shutil.copyfile, share_latency, share_fail_rate)
+  integrity.copy_verified = upload.copy_verified = delayed(integrity.copy_verified, share_latency, share_fail_rate)
+
+  export_dir = os.path.join(root, f"export_op{op_idx}")
+  overrides = {} if queue_size is None else {"pipeline_queue_size": queue_size}
+  with sandbox_cfg(root, xml_export_dir=export_dir, sftp_host="127.0.0.1", sftp_port=sftp_port, **overrides), \
+       open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+    while True:
+      lot_id = lot_queue.get()
+      if lot_id is None:
+        break
+      outcome = {"status": "error", "msg": ""}
+
+      def on_message(status, msg, skip_log):
+        outcome["status"] = status
+        outcome["msg"] = msg
+
+      pipeline = Pipeline(lot_id)
+      pipeline.message.connect(on_message)
+      t0 = time.perf_counter()
+      pipeline.run()
+      latency = time.perf_counter() - t0
+      result_queue.put({"operator": op_idx, "lotId": lot_id, "status": outcome["status"], "msg": outcome["msg"], "latency": latency})
+
+
+def prepare_lots(root: str, lot_cnt: int, wafers: int, rows: int, cols: int, symbol_mix: dict, seed: int) -> list:
+  """在 SFTP root 與 B2B 暫存資料夾中產生合成的 APC_{lot} 資料夾與 WO file"""
+  sftp_root = os.path.join(root, "sftp")
+  lot_ids = [f"LOAD{idx:05d}" for idx in range(lot_cnt)]
+  with sandbox_cfg(root):
+    target_parts = [p for p in get_sinf_target_path().replace("\\", "/").split("/") if p]
+    for lot_id in lot_ids:
+      write_sinf_lot(os.path.join(sftp_root, *target_parts, f"APC_{lot_id}"), lot_id, wafers, rows, cols, symbol_mix, seed)
+    #路徑組法與 modules.wo.download_wo_file() 相同
+    wo_folder = rf"{get_wo_target_path()}\{getLatestMonths(1)[0]}"
+    write_wo_csv(os.path.join(wo_folder, "WO_LOAD.csv"), [(lot_id, wafers) for lot_id in lot_ids], filler_rows=200, seed=seed)
+  return lot_ids
+
+
+def run_load(operators: int, lot_cnt: int, wafers: int, rows: int, cols: int, symbol_mix: dict, seed: int,
+             sftp_latency: float, sftp_fail_rate: float, share_latency: float, share_fail_rate: float, queue_size: int | None = None) -> dict:
+  """啟動 SFTP server 與 operator processes, 回傳統計結果"""
+  root = tempfile.mkdtemp(prefix="mapin_load_")
+  server = None
+  try:
+    lot_ids = prepare_lots(root, lot_cnt, wafers, rows, cols, symbol_mix, seed)
+    server = LocalSftpServer(os.path.join(root, "sftp"), sftp_latency, sftp_fail_rate)
+    port = server.start()
+
+    ctx = mp.get_context("spawn")
+    lot_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    for lot_id in lot_ids:
+      lot_queue.put(lot_id)
+    for _ in range(operators):
+      lot_queue.put(None)
+
+    procs = [
+      ctx.Process(target=operator_main, args=(idx, root, port, share_latency, share_fail_rate, lot_queue, result_queue, queue_size))
+      for idx in range(operators)
+    ]
+    t0 = time.perf_counter()
+    for proc in procs:
+      proc.start()
+    results = [result_queue.get() for _ in lot_ids]
+    wall = time.perf_counter() - t0
+    for proc in procs:
+      proc.join()
+  finally:
+    if server:
+      server.stop()
+    shutil.rmtree(root, ignore_errors=True)
+
+  latencies = [r["latency"] for r in results if r["status"] == "success"]
+  failures = [r for r in results if r["status"] != "success"]
+  return {
+    "params": {
+      "operators": operators, "lots": lot_cnt, "wafers": wafers, "rows": rows, "cols": cols, "symbolMix": symbol_mix,
+      "seed": seed, "sftpLatency": sftp_latency, "sftpFailRate": sftp_fail_rate,
+      "shareLatency": share_latency, "shareFailRate": share_fail_rate, "queueSize": queue_size
+    },
+    "wallSeconds": wall,
+    "succeeded": len(latencies),
+    "failed": len(failures),
+    "lotsPerMinute": len(latencies) / wall * 60 if wall else 0.0,
+    "latency": {
+      "p50": percentile(latencies, 50),
+      "p95": percentile(latencies, 95),
+      "p99": percentile(latencies, 99),
+      "max": max(latencies, default=0.0)
+    },
+    "failures": [{"lotId": r["lotId"], "status": r["status"], "msg": r["msg"]} for r in failures]
+  }
+
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(description="End-to-end load test of the Worker.run pipeline against local SFTP and share stand-ins")
+  parser.add_argument("--operators", type=int, default=4, help="number of simulated workstations")
+  parser.add_argument("--lots", type=int, default=20)
+  parser.add_argument("--wafers", type=int, default=25)
+  parser.add_argument("--rows", type=int, default=100)
+  parser.add_argument("--cols", type=int, default=100)
+  parser.add_argument("--mix", type=parse_symbol_mix, default=DEFAULT_SYMBOL_MIX)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--sftp-latency", type=float, default=0.0, help="seconds added to each SFTP list/stat/open")
+  parser.add_argument("--sftp-fail-rate", type=float, default=0.0, help="probability that an SFTP file open fails")
+  parser.add_argument("--share-latency", type=float, default=0.0, help="seconds added to each share file copy")
+  parser.add_argument("--share-fail-rate", type=float, default=0.0, help="probability that a share file copy fails")
+  parser.add_argument("--queue-size", type=int, help="override pipeline_queue_size, 0 converts after the whole lot is downloaded")
+  parser.add_argument("--out", help="write the report as JSON to this path")
+  args = parser.parse_args(argv)
+
+  report = run_load(args.operators, args.lots, args.wafers, args.rows, args.cols, args.mix, args.seed,
+                    args.sftp_latency, args.sftp_fail_rate, args.share_latency, args.share_fail_rate, args.queue_size)
+
+  lat = report["latency"]
+  print(f"{args.operators} operators, {args.lots} lots x {args.wafers} wafers ({args.rows}x{args.cols})")
+  print(f"  succeeded: {report['succeeded']}, failed: {report['failed']}, wall: {report['wallSeconds']:.2f}s")
+  print(f"  throughput: {report['lotsPerMinute']:.1f} lots/min")
+  print(f"  lot latency p50 {lat['p50']:.3f}s, p95 {lat['p95']:.3f}s, p99 {lat['p99']:.3f}s, max {lat['max']:.3f}s")
+  for failure in report["failures"]:
+    print(f"  [{failure['status']}] {failure['lotId']}: {failure['msg']}")
+
+  if args.out:
+    with open(args.out, "w", encoding="utf-8") as f:
+      json.dump(report, f, indent=2)
+    print(f"Saved report: {args.out}")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,50 @@
+import os, tempfile
+from contextlib import contextmanager
+from modules.cfg import get_cfg
+
+
+#會被導向暫存資料夾的路徑設定, 避免 benchmark 或測試寫入 QNAP / AWMS
+SANDBOX_PATH_KEYS = {
+  "dl_basic_dir": "download",
+  "xml_export_dir": "export",
+  "xml_bak_path": "backup",
+  "upload_path": "upload",
+  "wo_target_path": "b2b",
+}
+#會被導向暫存資料夾的檔案路徑設定
+SANDBOX_FILE_KEYS = {
+  "ledger_path": "ledger.db",
+}
+
+
+@contextmanager
+def sandbox_cfg(root: str | None = None, **overrides):
+  """
+  暫時將 cfg.json 的路徑設定導向本地暫存資料夾, 離開 with 區塊後還原
+
+  Arguments:
+    root (str): 暫存根目錄, 未指定時會自動建立並在結束後保留給呼叫端檢查
+    overrides: 其他要覆寫的 cfg 欄位, 例如 sftp_host="127.0.0.1"
+
+  Yields:
+    dict: 實際使用的路徑, key 與 cfg.json 欄位相同
+  """
+  root = root or tempfile.mkdtemp(prefix="mapin_bench_")
+  cfg = get_cfg()
+  saved = dict(cfg)
+  paths = {}
+  for key, name in SANDBOX_PATH_KEYS.items():
+    paths[key] = os.path.join(root, name)
+    os.makedirs(paths[key], exist_ok=True)
+  for key, name in SANDBOX_FILE_KEYS.items():
+    paths[key] = os.path.join(root, name)
+  #只指定 sftp_host 時, 不使用 cfg.json 中的 sftp_hosts, 避免連到正式的 SFTP host
+  if "sftp_host" in overrides:
+    overrides.setdefault("sftp_hosts", [])
+  try:
+    cfg.update(paths)
+    cfg.update(overrides)
+    yield paths
+  finally:
+    cfg.clear()
+    cfg.update(saved)
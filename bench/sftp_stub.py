@@ -0,0 +1,153 @@
+import os, time, random, socket, logging, threading
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, ServerInterface
+from paramiko.sftp import SFTP_FAILURE
+
+
+class _StubServer(ServerInterface):
+  """接受任何帳號密碼的 SSH server, 僅供本地測試使用"""
+
+  def check_auth_password(self, username, password):
+    return paramiko.AUTH_SUCCESSFUL
+
+  def get_allowed_auths(self, username):
+    return "password"
+
+  def check_channel_request(self, kind, chanid):
+    if kind == "session":
+      return paramiko.OPEN_SUCCEEDED
+    return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _StubHandle(SFTPHandle):
+  def stat(self):
+    try:
+      return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+
+class _StubSftp(SFTPServerInterface):
+  """
+  唯讀的 SFTP 檔案系統, 將遠端路徑對應到本地 root 資料夾
+  遠端路徑中的 "\\" 會被視為 "/", 例如 "\\1stDM(eMap)\\APC_X" 對應 {root}/1stDM(eMap)/APC_X
+  """
+
+  def __init__(self, server, root: str, latency: float, fail_rate: float, *args, **kwargs):
+    super().__init__(server, *args, **kwargs)
+    self.root = root
+    self.latency = latency
+    self.fail_rate = fail_rate
+
+  def _delay(self):
+    if self.latency > 0:
+      time.sleep(self.latency)
+
+  def _local_path(self, path: str) -> str:
+    parts = [p for p in path.replace("\\", "/").split("/") if p not in ("", ".")]
+    return os.path.join(self.root, *parts)
+
+  def canonicalize(self, path):
+    return "/" + "/".join(p for p in path.replace("\\", "/").split("/") if p not in ("", "."))
+
+  def list_folder(self, path):
+    self._delay()
+    local = self._local_path(path)
+    try:
+      out = []
+      for fname in os.listdir(local):
+        attr = SFTPAttributes.from_stat(os.stat(os.path.join(local, fname)))
+        attr.filename = fname
+        out.append(attr)
+      return out
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+  def stat(self, path):
+    self._delay()
+    try:
+      return SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+
+  def lstat(self, path):
+    return self.stat(path)
+
+  def open(self, path, flags, attr):
+    self._delay()
+    if self.fail_rate > 0 and random.random() < self.fail_rate:
+      return SFTP_FAILURE
+    try:
+      f = open(self._local_path(path), "rb")
+    except OSError as e:
+      return SFTPServer.convert_errno(e.errno)
+    handle = _StubHandle(flags)
+    handle.filename = self._local_path(path)
+    handle.readfile = f
+    return handle
+
+
+class LocalSftpServer:
+  """
+  在 127.0.0.1 啟動的 paramiko SFTP server, 用來取代 attsftp01 做壓力測試
+
+  Arguments:
+    root (str): 對應遠端根目錄的本地資料夾
+    latency (float): 每次 list / stat / open 請求額外延遲的秒數
+    fail_rate (float): 開啟檔案失敗的機率, 0-1
+  """
+
+  def __init__(self, root: str, latency: float = 0.0, fail_rate: float = 0.0):
+    self.root = root
+    self.latency = latency
+    self.fail_rate = fail_rate
+    self.host_key = paramiko.RSAKey.generate(2048)
+    self.sock = None
+    self.port = None
+    self.transports = []
+    self._stop = threading.Event()
+
+
+  def start(self) -> int:
+    """啟動 server, 回傳實際監聽的 port"""
+    #client 結束時直接斷線屬於正常情況, 不需要印出 paramiko 的 socket exception
+    logging.getLogger("paramiko.transport").setLevel(logging.CRITICAL)
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.sock.bind(("127.0.0.1", 0))
+    self.sock.listen(64)
+    self.sock.settimeout(0.2)
+    self.port = self.sock.getsockname()[1]
+    threading.Thread(target=self._accept_loop, daemon=True).start()
+    return self.port
+
+
+  def _accept_loop(self):
+    while not self._stop.is_set():
+      try:
+        conn, _ = self.sock.accept()
+      except socket.timeout:
+        continue
+      except OSError:
+        break
+      transport = paramiko.Transport(conn)
+      transport.add_server_key(self.host_key)
+      #與 OpenSSH 相同, client 要求時才啟用壓縮
+      transport.use_compression(True)
+      transport.set_subsystem_handler("sftp", SFTPServer, _StubSftp, self.root, self.latency, self.fail_rate)
+      #只建立 TCP 連線就關閉的 client (例如量測連線延遲) 不影響後續連線
+      try:
+        transport.start_server(server=_StubServer())
+      except (paramiko.SSHException, EOFError, OSError):
+        transport.close()
+        continue
+      self.transports.append(transport)
+
+
+  def stop(self):
+    """停止 server 並關閉所有連線"""
+    self._stop.set()
+    if self.sock:
+      self.sock.close()
+    for transport in self.transports:
+      transport.close()
@@ -0,0 +1,137 @@
+"""
+啟動時間 benchmark
+
+每次量測都會啟動一個新的 Python process, 記錄:
+  - timeToWindow: 從啟動 process 到主視窗顯示完成的秒數
+  - timeToFirstLot: 從啟動 process 到第一批 lot 處理完成 (對本地 SFTP server 與暫存資料夾) 的秒數
+  - heavyAtWindow: 主視窗顯示時已被載入的重量級套件 (pandas, paramiko, lxml 應延遲到第一次使用才載入)
+
+使用方式 (請在專案根目錄執行):
+  $ python -m bench.startup --repeat 5
+  $ python -m bench.startup --compare bench/baselines/startup.json
+"""
+import os, sys, json, time, shutil, argparse, platform, tempfile, subprocess
+from datetime import datetime
+
+
+STAGES = ["timeToWindow", "timeToFirstLot"]
+HEAVY_MODULES = ["pandas", "paramiko", "lxml", "numpy"]
+BASELINE_PATH = os.path.join("bench", "baselines", "startup.json")
+
+
+def child_main(t_spawn: float, root: str, sftp_port: int, lot_id: str):
+  """在子 process 中執行: 開啟主視窗, 再處理一批 lot, 將量測結果以 JSON 印在最後一行"""
+  import main
+  app = main.create_app([])
+  widget = main.MainWidget()
+  widget.show()
+  app.processEvents()
+  time_to_window = time.time() - t_spawn
+  heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+
+  from bench.sandbox import sandbox_cfg
+  outcome = {}
+  with sandbox_cfg(root, sftp_host="127.0.0.1", sftp_port=sftp_port):
+    worker = main.Worker(lot_id)
+    worker.message.connect(lambda status, msg, skip_log: outcome.update(status=status, msg=msg))
+    worker.run()
+  time_to_first_lot = time.time() - t_spawn
+
+  print(json.dumps({
+    "timeToWindow": time_to_window,
+    "timeToFirstLot": time_to_first_lot,
+    "heavyAtWindow": heavy,
+    "status": outcome.get("status"),
+    "msg": outcome.get("msg")
+  }))
+
+
+def measure_once(root: str, sftp_port: int, lot_id: str) -> dict:
+  """啟動一個子 process 並取得量測結果"""
+  t_spawn = time.time()
+  proc = subprocess.run(
+    [sys.executable, "-m", "bench.startup", "--child", str(t_spawn), root, str(sftp_port), lot_id],
+    capture_output=True, text=True, encoding="utf-8", errors="replace"
+  )
+  lines = proc.stdout.strip().splitlines()
+  if proc.returncode != 0 or not lines:
+    raise RuntimeError(f"startup child failed: {proc.stderr.strip()[-500:]}")
+  return json.loads(lines[-1])
+
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(description="Measure time-to-window and time-to-first-lot")
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--wafers", type=int, default=25)
+  parser.add_argument("--rows", type=int, default=100)
+  parser.add_argument("--cols", type=int, default=100)
+  parser.add_argument("--out", help=f"baseline output path, default {BASELINE_PATH}")
+  parser.add_argument("--compare", help="baseline file to compare against")
+  parser.add_argument("--tolerance", type=float, default=0.1)
+  parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  if args.child:
+    t_spawn, root, sftp_port, lot_id = args.child
+    child_main(float(t_spawn), root, int(sftp_port), lot_id)
+    return 0
+
+  from bench.convert import compare_baseline, get_git_rev, summarize
+  from bench.load import prepare_lots
+  from bench.sftp_stub import LocalSftpServer
+
+  root = tempfile.mkdtemp(prefix="mapin_startup_")
+  server = None
+  samples = {stage: [] for stage in STAGES}
+  heavy = set()
+  try:
+    lot_ids = prepare_lots(root, args.repeat, args.wafers, args.rows, args.cols, None, 0)
+    server = LocalSftpServer(os.path.join(root, "sftp"))
+    port = server.start()
+    #每次量測使用不同的 lot, 避免沿用上一次的下載結果
+    for lot_id in lot_ids:
+      result = measure_once(root, port, lot_id)
+      if result["status"] != "success":
+        raise RuntimeError(f"lot {lot_id} failed: {result['msg']}")
+      for stage in STAGES:
+        samples[stage].append(result[stage])
+      heavy.update(result["heavyAtWindow"])
+  finally:
+    if server:
+      server.stop()
+    shutil.rmtree(root, ignore_errors=True)
+
+  result = {
+    "schema": 1,
+    "benchmark": "startup",
+    "createdAt": datetime.now().isoformat(timespec="seconds"),
+    "gitRev": get_git_rev(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "params": {"repeat": args.repeat, "wafers": args.wafers, "rows": args.rows, "cols": args.cols},
+    "heavyAtWindow": sorted(heavy),
+    "stages": {stage: summarize(samples[stage]) for stage in STAGES}
+  }
+
+  print(f"{args.repeat} runs (median seconds)")
+  for stage in STAGES:
+    print(f"  {stage:<16}{result['stages'][stage]['median']:.3f}")
+  print(f"  heavy modules loaded before window: {', '.join(result['heavyAtWindow']) or 'none'}")
+
+  regressions = []
+  if args.compare:
+    with open(args.compare, encoding="utf-8") as f:
+      regressions = compare_baseline(result, json.load(f), args.tolerance, STAGES)
+    if not args.out:
+      return 1 if regressions else 0
+
+  out_path = args.out or BASELINE_PATH
+  os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+  with open(out_path, "w", encoding="utf-8") as f:
+    json.dump(result, f, indent=2)
+  print(f"Saved baseline: {out_path}")
+  return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,118 @@
+import os, random
+
+
+#預設的 symbol 比例: "__" 為 Null die, "00" 為 Pass, 其他 (例如 "OT", "DF") 轉置後皆為 "X"
+DEFAULT_SYMBOL_MIX = {"__": 0.2, "00": 0.7, "OT": 0.05, "DF": 0.05}
+
+
+def parse_symbol_mix(text: str) -> dict:
+  """
+  解析命令列輸入的 symbol 比例字串
+
+  Arguments:
+    text (str): 例如 "__=0.2,00=0.7,OT=0.1"
+
+  Returns:
+    dict: key 為 symbol, value 為權重, 例如 {"__": 0.2, "00": 0.7, "OT": 0.1}
+  """
+  mix = {}
+  for pair in text.split(","):
+    sym, weight = pair.split("=", 1)
+    sym = sym.strip()
+    if len(sym) != 2:
+      raise ValueError(f"Symbol must be 2 characters: '{sym}'")
+    mix[sym] = float(weight)
+  return mix
+
+
+def make_sinf_text(lot_id: str, wafer_no: int, rows: int, cols: int, symbol_mix: dict | None = None, seed: int = 0) -> str:
+  """
+  產生單片 wafer 的 SINF map 文字內容
+
+  Arguments:
+    lot_id (str): 貨批號碼, 例如 "AADZHS000"
+    wafer_no (int): wafer 編號, 例如 1
+    rows (int): map 行數 (ROWCT)
+    cols (int): map 欄數 (COLCT)
+    symbol_mix (dict): symbol 比例, 預設為 DEFAULT_SYMBOL_MIX
+    seed (int): 亂數種子, 相同參數會產生相同內容
+
+  Returns:
+    str: SINF map 文字內容
+  """
+  mix = symbol_mix or DEFAULT_SYMBOL_MIX
+  rnd = random.Random(f"{seed}-{lot_id}-{wafer_no}")
+  symbols = list(mix.keys())
+  weights = list(mix.values())
+
+  lines = [
+    f"DEVICE:{lot_id[:6]}",
+    f"LOT:{lot_id}",
+    f"WAFER:{wafer_no:02d}",
+    "FNLOC:180",
+    f"ROWCT:{rows}",
+    f"COLCT:{cols}",
+    "BCEQU:00",
+    "REFPX:1",
+    "REFPY:1",
+    "DUTMS:mm",
+    "XDIES:2.1",
+    "YDIES:2.1",
+  ]
+  for _ in range(rows):
+    lines.append("RowData:" + " ".join(rnd.choices(symbols, weights, k=cols)))
+  return "\n".join(lines) + "\n"
+
+
+def write_sinf_lot(dst_dir: str, lot_id: str, wafer_cnt: int, rows: int, cols: int, symbol_mix: dict | None = None, seed: int = 0, first_wafer: int = 1) -> list:
+  """
+  產生整批 SINF map 檔案, 檔名格式為 {lot_id}.nn
+
+  Arguments:
+    dst_dir (str): 輸出資料夾, 對應下載後的 APC_{lot_id} 資料夾
+    lot_id (str): 貨批號碼
+    wafer_cnt (int): wafer 片數
+    rows (int): map 行數
+    cols (int): map 欄數
+    symbol_mix (dict): symbol 比例
+    seed (int): 亂數種子
+    first_wafer (int): 第一片 wafer 的編號, 會影響 XML 中的 lot_no 字母
+
+  Returns:
+    list: 產生的檔案完整路徑
+  """
+  os.makedirs(dst_dir, exist_ok=True)
+  paths = []
+  for wafer_no in range(first_wafer, first_wafer + wafer_cnt):
+    path = os.path.join(dst_dir, f"{lot_id}.{wafer_no:02d}")
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+      f.write(make_sinf_text(lot_id, wafer_no, rows, cols, symbol_mix, seed))
+    paths.append(path)
+  return paths
+
+
+def write_wo_csv(path: str, lots: list, filler_rows: int = 0, seed: int = 0) -> str:
+  """
+  產生工單 (WO file), 格式與 B2B folder 上的 .csv 相同 (tab 分隔)
+
+  Arguments:
+    path (str): 輸出的 .csv 路徑
+    lots (list): (lot_id, quantity) 的列表, 每一筆會成為一列
+    filler_rows (int): 額外產生的無關 lot 列數, 用來模擬大型 WO 檔案
+    seed (int): 亂數種子
+
+  Returns:
+    str: 輸出的 .csv 路徑
+  """
+  rnd = random.Random(seed)
+  header = ["LOT NO", "OUTPUT P/N", "MASK", "SUFFIX", "QUANTITY"]
+  rows = [[lot_id, "ACIPC50K0", "AA", "111", str(quantity)] for lot_id, quantity in lots]
+  for idx in range(filler_rows):
+    rows.append([f"ZZ{idx:05d}00", "ACIPC50K0", "AA", "111", str(rnd.randint(1, 25))])
+
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  with open(path, "w", encoding="utf-8", newline="\n") as f:
+    f.write("\t".join(header) + "\n")
+    for row in rows:
+      f.write("\t".join(row) + "\n")
+  return path
@@ -1,8 +1,15 @@
 import sys, os, subprocess
+import multiprocessing as mp
 from datetime import datetime
+from modules.ledger import find_uploads
 from modules.log import write_log
-from modules.cfg import get_app_title
-from modules.worker import Worker
+from modules.cfg import get_app_title, get_pipeline_process_enabled, get_prefetch_cfg, get_retention_cfg, get_service_cfg, get_ui_cfg
+from modules.prefetch import PrefetchWatcher
+from modules.retention import RetentionWatcher
+from modules.service import serve
+from modules.probe import split_lot_ids
+from modules.worker import ProbeWorker, ProcessWorker, ServiceWorker, SignalBatcher, Worker
+from modules.xml import get_bin_table, load_bin_table
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QApplication, QWidget, QSizePolicy, QVBoxLayout, QHBoxLayout, QGroupBox, QLabel, QLineEdit, QTextEdit, QPushButton, QMessageBox, QProgressBar
 from PyQt5.QtGui import QFont, QIcon
@@ -21,7 +28,7 @@ def get_src_path(relative_path):
 class MainWidget(QWidget):
   """
   主視窗, 包含以下元件:
-    - Lot ID 標籤, 單行輸入框, Execute 按鈕
+    - Lot ID 標籤, 單行輸入框, Check 按鈕, Execute 按鈕, Cancel 按鈕
     - 進度條
     - Log 資訊
     - Info 按鈕, Open Directory 按鈕, Exit 按鈕
@@ -34,6 +41,26 @@ class MainWidget(QWidget):
     self.resize(800, 450)
     self.ui_setup()
 
+    #合併 Worker 的進度與 log 後再更新畫面, 避免大量 signal 拖慢 GUI
+    self.batcher = SignalBatcher(self)
+    self.batcher.progress.connect(self.set_progress)
+    self.batcher.message.connect(self.show_msg_box)
+    self.batcher.log_lines.connect(self.show_log_lines)
+    self.batcher.finished.connect(self.on_finished)
+
+    #如果有啟用 prefetch, 在背景預先下載並轉檔新到的 SINF map
+    #有啟用常駐服務時, 由服務負責 prefetch
+    self.use_service = get_service_cfg()["enabled"]
+    self.prefetcher = None
+    if get_prefetch_cfg()["enabled"] and not self.use_service:
+      self.prefetcher = PrefetchWatcher()
+      self.prefetcher.start()
+    #如果有啟用保留期限, 在背景定期清理 dl_basic_dir; 有啟用常駐服務時由服務負責
+    self.retention = None
+    if get_retention_cfg()["enabled"] and not self.use_service:
+      self.retention = RetentionWatcher()
+      self.retention.start()
+
 
   def ui_setup(self):
     #main layout, 垂直置中
@@ -42,7 +69,7 @@ class MainWidget(QWidget):
     main_layout.addStretch(1)
 
     ################################################################################
-    #1. 第一列: Main Operation 群組, 包含 Lot ID label & 單行輸入框 & Execute 按鈕
+    #1. 第一列: Main Operation 群組, 包含 Lot ID label & 單行輸入框 & Check 按鈕 & Execute 按鈕 & Cancel 按鈕
     self.grp_box_1 = QGroupBox("Main Operation")
     v_layout_1 = QVBoxLayout()
     h_layout_1 = QHBoxLayout()
@@ -53,12 +80,25 @@ class MainWidget(QWidget):
     self.lot_id = QLineEdit(self)
     self.lot_id.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
     h_layout_1.addWidget(self.lot_id)
+    #Check 按鈕, 不下載檔案, 只檢查一或多批 lot 是否可以處理
+    self.check_btn = QPushButton("Check", self)
+    self.check_btn.setIcon(QIcon(get_src_path("icons/info.png")))
+    self.check_btn.clicked.connect(self.on_check)
+    self.check_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+    h_layout_1.addWidget(self.check_btn)
     #Execute 按鈕
     self.exec_btn = QPushButton("Execute", self)
     self.exec_btn.setIcon(QIcon(get_src_path("icons/exec.png")))
     self.exec_btn.clicked.connect(self.on_execute)
     self.exec_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
     h_layout_1.addWidget(self.exec_btn)
+    #Cancel 按鈕, 僅在處理中可以點擊
+    self.cancel_btn = QPushButton("Cancel", self)
+    self.cancel_btn.setIcon(QIcon(get_src_path("icons/exit.png")))
+    self.cancel_btn.clicked.connect(self.on_cancel)
+    self.cancel_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+    self.cancel_btn.setEnabled(False)
+    h_layout_1.addWidget(self.cancel_btn)
     v_layout_1.addLayout(h_layout_1)
     self.grp_box_1.setLayout(v_layout_1)
     main_layout.addWidget(self.grp_box_1)
@@ -82,6 +122,7 @@ class MainWidget(QWidget):
     v_layout_3 = QVBoxLayout()
     self.log_text = QTextEdit(self)
     self.log_text.setReadOnly(True)
+    self.log_text.document().setMaximumBlockCount(get_ui_cfg()["logMaxLines"])  #超過上限時移除最舊的行
     v_layout_3.addWidget(self.log_text)
     self.grp_box_3.setLayout(v_layout_3)
     main_layout.addWidget(self.grp_box_3)
@@ -130,8 +171,30 @@ class MainWidget(QWidget):
 
   def show_log_text(self, text: str="Default message"):
     """更新 log_text 要顯示的文字內容"""
-    curr_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    self.log_text.append(f"{curr_time} | {text}")
+    self.show_log_lines([(datetime.now(), text)])
+
+
+  def show_log_lines(self, lines: list):
+    """
+    一次加入多行 log 文字
+
+    Arguments:
+      lines (list): [(datetime, str), ...], 收到 log 的時間與文字內容
+    """
+    self.log_text.append("\n".join(f"{t.strftime('%Y-%m-%d %H:%M:%S')} | {text}" for t, text in lines))
+
+
+  def closeEvent(self, event):
+    """
+    關閉視窗前停止背景 prefetch 與 retention
+    Warning: 覆寫類別 virtual method, 請不要修改此函式名稱
+    """
+    if self.prefetcher:
+      self.prefetcher.stop()
+      self.prefetcher.join()
+    if self.retention:
+      self.retention.stop()
+    super().closeEvent(event)
 
 
   def keyPressEvent(self, event):
@@ -187,12 +250,14 @@ class MainWidget(QWidget):
     Arguments:
       num (int): 進度值, 0-100
     """
+    #Worker 在背景執行, signal 會排入主執行緒的 event loop, 不需要再強制呼叫 processEvents()
     self.prog_bar.setValue(num)   #設置進度值
-    QApplication.processEvents()  #更新 UI
 
 
   def on_finished(self):
     self.exec_btn.setEnabled(True)
+    self.check_btn.setEnabled(True)
+    self.cancel_btn.setEnabled(False)
     self.exit_btn.setEnabled(True)
     # self.prog_bar.setVisible(True)  #在此手動設定是否隱藏進度條
 
@@ -206,24 +271,93 @@ class MainWidget(QWidget):
     if not lot_id:
       self.show_msg_box("warning", "Please enter Lot ID", True)
       return
+    #已經上傳過的 lot, 先確認是否要重新上傳
+    if not self.confirm_reupload(lot_id):
+      return
 
     # self.prog_bar.setVisible(True)  #在此手動設定是否隱藏進度條
     self.set_progress(0)              #重置進度條進度為 0
     self.log_text.clear()             #清空 log_text 的內容
     self.exec_btn.setEnabled(False)
+    self.check_btn.setEnabled(False)
+    self.cancel_btn.setEnabled(True)
     self.exit_btn.setEnabled(False)
 
-    self.worker = Worker(lot_id)
-    self.worker.progress.connect(self.set_progress)
-    self.worker.message.connect(self.show_msg_box)
-    self.worker.log_text.connect(self.show_log_text)
-    self.worker.finished.connect(self.on_finished)
+    #有啟用常駐服務時, 交由服務執行; 有啟用子 process 模式時, 在獨立的 process 執行; GUI 只負責顯示進度
+    if self.use_service:
+      self.worker = ServiceWorker(lot_id)
+    elif get_pipeline_process_enabled():
+      self.worker = ProcessWorker(lot_id)
+    else:
+      self.worker = Worker(lot_id)
+    self.batcher.attach(self.worker)
     self.worker.start()
 
 
-if __name__ == "__main__":
-  #建立 QApplication instance
-  app = QApplication(sys.argv)
+  def confirm_reupload(self, lot_id: str) -> bool:
+    """
+    查詢執行紀錄 (modules.ledger), lot 已經成功上傳過時, 顯示上次上傳的資訊並詢問是否要重新上傳
+
+    Returns:
+      bool: 沒有上傳紀錄, 或 user 選擇重新上傳時回傳 True
+    """
+    uploads = find_uploads(lot_id)
+    if not uploads:
+      return True
+    last = uploads[0]
+    #依 cfg.json bins 的順序顯示各 Bin code 的數量, 紀錄中有但目前設定沒有的 code 排在後面
+    bin_totals = last["binTotals"]
+    codes = list(get_bin_table().codes)
+    codes += [code for code in bin_totals if code not in codes]
+    bin_label = " / ".join(codes)
+    bin_counts = " / ".join(str(bin_totals.get(code, "-")) for code in codes)
+    msg = "\n".join([
+      f"Lot ID '{lot_id}' has already been uploaded {len(uploads)} time(s).",
+      f"Last upload: {last['finishedAt']} on {last['host']}",
+      f"Lot No: {last['lotNo']}, wafers: {last['waferCnt']}, {bin_label}: {bin_counts}",
+      f"XML SHA-256: {(last['xmlSha256'] or '')[:16]}",
+      "",
+      "Upload again?"
+    ])
+    reply = QMessageBox.question(self, "Already Uploaded", msg, QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+    if reply != QMessageBox.Yes:
+      return False
+    write_log(f"Re-uploading lot {lot_id}, previously uploaded at {last['finishedAt']}", "warning")
+    return True
+
+
+  def on_check(self):
+    """
+    按下 Check 按鈕後的處理函式, 檢查輸入的一或多批 lot (以空白或逗號分隔) 的 SINF map 檔案數量是否與 WO QUANTITY 一致
+    """
+    lot_ids = split_lot_ids(self.lot_id.text())
+    if not lot_ids:
+      self.show_msg_box("warning", "Please enter Lot ID", True)
+      return
+
+    self.log_text.clear()
+    self.exec_btn.setEnabled(False)
+    self.check_btn.setEnabled(False)
+    self.exit_btn.setEnabled(False)
+
+    self.worker = ProbeWorker(lot_ids)
+    self.batcher.attach(self.worker)
+    self.worker.start()
+
+
+  def on_cancel(self):
+    """
+    按下 Cancel 按鈕後的處理函式, 要求 Worker 停止目前的處理流程
+    流程會在下一個檢查點停止, 並清除未完成的暫存檔案, 之後同樣透過 message 與 finished 通知
+    """
+    self.cancel_btn.setEnabled(False)
+    self.show_log_text("Cancelling...")
+    self.worker.cancel()
+
+
+def create_app(argv: list) -> QApplication:
+  """建立 QApplication instance, 並套用全域字型、按鈕樣式與 icon"""
+  app = QApplication(argv)
 
   #全域設定字型為 微軟正黑體, 12pt
   app.setFont(QFont("Microsoft JhengHei", 10))
@@ -238,6 +372,43 @@ if __name__ == "__main__":
 
   #為 app 設置 icon
   app.setWindowIcon(QIcon(get_src_path("icons/app.png")))
+  return app
+
+
+if __name__ == "__main__":
+  #打包成 exe 後, 子 process 會以相同的 exe 啟動, 需要先交給 multiprocessing 處理
+  mp.freeze_support()
+
+  #以常駐服務模式啟動, 不開啟視窗
+  if "--service" in sys.argv:
+    serve()
+    sys.exit(0)
+
+  #量測各 SFTP 傳輸設定的下載速度, 不開啟視窗, 例如 main.exe --bench-sftp AADZHS000
+  if "--bench-sftp" in sys.argv:
+    from modules.sftp_bench import main as bench_sftp
+    sys.exit(bench_sftp(sys.argv[sys.argv.index("--bench-sftp") + 1:]))
+
+  #離線批次轉檔已下載的 SINF map, 不開啟視窗, 例如 main.exe --offline AADZHS000 MWD053000 --upload
+  if "--offline" in sys.argv:
+    from modules.offline import main as offline
+    sys.exit(offline(sys.argv[sys.argv.index("--offline") + 1:]))
+
+  #依保留期限清理 dl_basic_dir 一次, 不開啟視窗, 例如 main.exe --retention --dry-run
+  if "--retention" in sys.argv:
+    from modules.retention import main as retention
+    sys.exit(retention(sys.argv[sys.argv.index("--retention") + 1:]))
+
+  #建立 QApplication instance
+  app = create_app(sys.argv)
+
+  #檢查並編譯 bin 設定, 有誤時顯示設定錯誤並結束, 不開啟主視窗
+  try:
+    load_bin_table()
+  except ValueError as e:
+    write_log(f"Invalid bin config in cfg.json: {e}", "error")
+    QMessageBox.critical(None, get_app_title(), f"Invalid bin config in cfg.json:\n{e}")
+    sys.exit(1)
 
   main = MainWidget()
   main.show()
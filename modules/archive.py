@@ -0,0 +1,180 @@
+import os, bz2, gzip, lzma, shutil, tarfile
+from modules.cfg import get_archive_cfg, get_sinf_dl_path, get_wo_dl_path
+from modules.integrity import DigestWriter, check_written
+from modules.lease import DownloadLease
+from modules.log import write_log
+
+
+#壓縮格式對應的單一檔案壓縮函式, XML 備份使用
+OPENERS = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+
+def get_lot_archive(lot_id: str) -> str | None:
+  """
+  取得 lot 的封存檔路徑 ({lot 資料夾}.tar.gz 等, lot 資料夾見 get_wo_dl_path()), 不論目前設定的壓縮格式
+
+  Returns:
+    str: 封存檔路徑
+    None: 沒有封存檔
+  """
+  for compression in OPENERS:
+    path = f"{get_wo_dl_path(lot_id)}.tar.{compression}"
+    if os.path.isfile(path):
+      return path
+  return None
+
+
+def archive_lot(lot_id: str) -> str | None:
+  """
+  將 dl_basic_dir 中 lot 的資料夾 (SINF map 與 WO file) 壓縮為 {dl_basic_dir}\\{lot_id}.tar.{compression} 後移除資料夾
+  只在 cfg.json 的 archive_enabled 為 true 時執行; 其他工作站正在下載此 lot 時略過.
+  失敗只記錄 log, 資料夾會保留, 下次上傳成功時再封存
+
+  Arguments:
+    lot_id (str): 貨批號碼
+
+  Returns:
+    str: 封存檔路徑
+    None: 未啟用、略過或失敗
+  """
+  archive_cfg = get_archive_cfg()
+  lot_dir = get_wo_dl_path(lot_id)
+  if not archive_cfg["enabled"] or not os.path.isdir(lot_dir):
+    return None
+  lease = DownloadLease(lot_id)
+  if not lease.try_acquire():
+    write_log(f"Archive of lot {lot_id} skipped, it is being downloaded by another workstation", "info")
+    return None
+
+  compression = archive_cfg["compression"]
+  archive_path = f"{lot_dir}.tar.{compression}"
+  part_path = f"{archive_path}.part"
+  try:
+    raw_size = 0
+    file_cnt = 0
+    with tarfile.open(part_path, f"w:{compression}") as tar:
+      for root, dirs, files in os.walk(lot_dir):
+        dirs.sort()
+        for name in sorted(files):
+          #租約與中斷下載留下的暫存檔不封存
+          if name.startswith(".lease") or name.endswith(".part"):
+            continue
+          path = os.path.join(root, name)
+          #保留修改時間, 還原後 modules.sinf.is_same_file() 仍可判斷是否需要重新下載
+          tar.add(path, arcname=os.path.relpath(path, lot_dir).replace(os.sep, "/"))
+          raw_size += os.path.getsize(path)
+          file_cnt += 1
+    os.replace(part_path, archive_path)
+    #改變壓縮格式後, 移除舊格式的封存檔
+    for other in OPENERS:
+      if other != compression and os.path.isfile(f"{lot_dir}.tar.{other}"):
+        os.remove(f"{lot_dir}.tar.{other}")
+    shutil.rmtree(lot_dir)
+    packed_size = os.path.getsize(archive_path)
+    write_log(
+      f"Archived lot {lot_id}: {file_cnt} files, {raw_size / 1024 / 1024:.2f} MB -> {packed_size / 1024 / 1024:.2f} MB "
+      f"({packed_size / raw_size if raw_size else 0:.0%}) at {archive_path}",
+      "info"
+    )
+    return archive_path
+  except Exception as e:
+    write_log(f"Archive lot {lot_id} failed: {e}", "error")
+    try:
+      os.remove(part_path)
+    except OSError:
+      pass
+    return None
+  finally:
+    #資料夾移除後租約檔案也已不存在, 在此只停止 heartbeat
+    lease.release()
+
+
+def extract_archive(archive_path: str, dst_dir: str) -> int:
+  """
+  將 archive_lot() 建立的封存檔解壓縮到 dst_dir, 保留修改時間; 已存在的檔案不會被覆寫
+
+  Arguments:
+    archive_path (str): 封存檔路徑
+    dst_dir (str): 解壓縮的目的資料夾, 對應封存前的 lot 資料夾
+
+  Returns:
+    int: 解壓縮的檔案數量; 封存檔損毀時拋出例外, 已解壓縮的檔案會保留
+  """
+  file_cnt = 0
+  with tarfile.open(archive_path, "r:*") as tar:
+    for member in tar:
+      parts = member.name.split("/")
+      #只還原一般檔案, 且不可寫到目的資料夾之外
+      if not member.isfile() or member.name.startswith("/") or ".." in parts:
+        continue
+      dst_path = os.path.join(dst_dir, *parts)
+      if os.path.exists(dst_path):
+        continue
+      os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+      part_path = f"{dst_path}.part"
+      with tar.extractfile(member) as src, open(part_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+      os.utime(part_path, (member.mtime, member.mtime))
+      os.replace(part_path, dst_path)
+      file_cnt += 1
+  return file_cnt
+
+
+def restore_lot(lot_id: str) -> bool:
+  """
+  SINF map 資料夾 (APC_{lot_id}) 不存在但有封存檔時, 將封存檔解壓縮回 dl_basic_dir, 讓下載與轉檔可以沿用先前的檔案
+  已存在的檔案不會被覆寫; 封存檔保留, 下次上傳成功時會重新封存. 需在持有下載租約 (modules.lease) 時呼叫
+
+  Arguments:
+    lot_id (str): 貨批號碼
+
+  Returns:
+    bool: 是否有解壓縮
+  """
+  archive_path = get_lot_archive(lot_id)
+  if not archive_path or os.path.isdir(get_sinf_dl_path(lot_id, f"APC_{lot_id}")):
+    return False
+  try:
+    file_cnt = extract_archive(archive_path, get_wo_dl_path(lot_id))
+  except Exception as e:
+    #封存檔損毀時不影響處理, 缺少的檔案會重新下載
+    write_log(f"Restore lot {lot_id} from {archive_path} failed: {e}", "warning")
+    return False
+  write_log(f"Restored {file_cnt} files of lot {lot_id} from {archive_path}", "info")
+  return True
+
+
+def compress_file(src_path: str, dst_path: str, compression: str) -> dict:
+  """
+  將單一檔案壓縮為 dst_path, 壓縮時同時計算來源與壓縮檔的 SHA-256
+
+  Arguments:
+    src_path (str): 來源檔案路徑
+    dst_path (str): 壓縮檔路徑
+    compression (str): "gz", "bz2" 或 "xz"
+
+  Returns:
+    dict: 包含 source 與 packed, 分別為來源檔案與壓縮檔的 bytes 與 sha256
+  """
+  with open(src_path, "rb") as src, open(dst_path, "wb") as raw:
+    packed = DigestWriter(raw)
+    with OPENERS[compression](packed, "wb") as dst:
+      source = DigestWriter(dst)
+      for chunk in iter(lambda: src.read(1024 * 1024), b""):
+        source.write(chunk)
+  check_written(dst_path, packed.digest())
+  return {"source": source.digest(), "packed": packed.digest()}
+
+
+def open_backup(path: str):
+  """
+  開啟 XML 備份, 依副檔名 (.gz, .bz2, .xz) 自動解壓縮, 其他副檔名視為未壓縮
+
+  Arguments:
+    path (str): 備份檔案路徑, 例如 {xml_bak_path}\\AADZHS000A.xml.gz
+
+  Returns:
+    file: 以 binary 模式開啟的檔案
+  """
+  compression = path.rsplit(".", 1)[-1].lower()
+  return OPENERS[compression](path, "rb") if compression in OPENERS else open(path, "rb")
@@ -1,4 +1,5 @@
-import os, json
+import os, json, time
+from datetime import date
 
 
 def load_cfg():
@@ -9,17 +10,25 @@ def load_cfg():
   else:
     print(f"Oops! {cfg_filename} not found")
 
-cfg = load_cfg()
+_cfg = None
+
+
+def get_cfg() -> dict:
+  """取得 cfg.json 的內容, 第一次呼叫時才讀取檔案 (import 時不會有讀檔的副作用)"""
+  global _cfg
+  if _cfg is None:
+    _cfg = load_cfg()
+  return _cfg
 
 
 def get_app_title() -> str:
   """取得 GUI 程式標題"""
-  return cfg["app_title"].strip()
+  return get_cfg()["app_title"].strip()
 
 
 def get_log_path() -> str:
   """取得 log directory path"""
-  return rf"{cfg['log_path']}".strip()
+  return rf"{get_cfg()['log_path']}".strip()
 
 
 def get_sftp_cfg() -> dict:
@@ -32,24 +41,93 @@ def get_sftp_cfg() -> dict:
       - port (int): SFTP 伺服器連接埠, 預設為 22
       - user (str): SFTP 使用者名稱
       - pwd (str): SFTP 使用者密碼
+      - timeout (float): 連線與每次讀取的逾時秒數, 避免 SFTP 停止回應時無限等待, 預設為 30
+      - hosts (list): 內容相同的 SFTP host 列表, 每筆為 (host, port); 由 sftp_hosts 設定 ("host" 或 "host:port"),
+        未設定時只有 (sftp_host, sftp_port)
+      - transport (dict): 傳輸設定, 見 get_sftp_transport_cfg()
   """
+  cfg = get_cfg()
+  port = cfg["sftp_port"]
+  hosts = []
+  for item in cfg.get("sftp_hosts") or [cfg["sftp_host"]]:
+    host, _, host_port = str(item).strip().partition(":")
+    hosts.append((host, int(host_port) if host_port else port))
   return {
     "host": cfg["sftp_host"].strip(),
-    "port": cfg["sftp_port"],
+    "port": port,
     "user": cfg["sftp_user"].strip(),
-    "pwd": cfg["sftp_pwd"].strip()
+    "pwd": cfg["sftp_pwd"].strip(),
+    "timeout": float(cfg.get("sftp_timeout_sec", 30)),
+    "hosts": hosts,
+    "transport": get_sftp_transport_cfg()
+  }
+
+
+def get_sftp_profile_names() -> list:
+  """取得所有 SFTP 傳輸設定 (sftp_profiles) 的名稱, 一律包含 "default" (paramiko 預設值)"""
+  names = list(get_cfg().get("sftp_profiles", {}))
+  return names if "default" in names else ["default"] + names
+
+
+def get_sftp_transport_cfg(profile: str | None = None) -> dict:
+  """
+  取得 SFTP 傳輸設定, 未設定的欄位使用 paramiko 的預設值
+
+  Arguments:
+    profile (str): sftp_profiles 中的名稱, 未指定時使用 sftp_profile; "default" 未設定時代表全部使用預設值
+
+  Returns:
+    dict: 包含以下內容:
+      - name (str): profile 名稱
+      - compression (bool): 是否啟用 SSH 壓縮 (SINF map 為文字檔, 透過 WAN 傳輸時可以大幅減少傳輸量), 預設為 False
+      - windowSize (int | None): SSH channel window 大小 (bytes), None 為 paramiko 預設值 (2 MB)
+      - maxPacketSize (int | None): SSH 封包大小上限 (bytes), None 為 paramiko 預設值 (32 KB)
+      - ciphers (list): 優先使用的加密演算法, 依序嘗試, 伺服器不支援時改用其餘的演算法; 空白時使用 paramiko 預設順序
+      - prefetch (bool): 下載時是否預先送出多個讀取要求, 預設為 True
+      - maxPrefetchRequests (int | None): 預先送出的讀取要求數量上限, None 為不限制
+  """
+  cfg = get_cfg()
+  name = profile or str(cfg.get("sftp_profile", "default")).strip()
+  item = cfg.get("sftp_profiles", {}).get(name)
+  if item is None and name != "default":
+    raise KeyError(f"SFTP profile not found: {name}")
+  item = item or {}
+  return {
+    "name": name,
+    "compression": bool(item.get("compression", False)),
+    "windowSize": int(item["window_size"]) if item.get("window_size") else None,
+    "maxPacketSize": int(item["max_packet_size"]) if item.get("max_packet_size") else None,
+    "ciphers": [str(c).strip() for c in item.get("ciphers", [])],
+    "prefetch": bool(item.get("prefetch", True)),
+    "maxPrefetchRequests": int(item["max_prefetch_requests"]) if item.get("max_prefetch_requests") else None
+  }
+
+
+def get_sftp_failover_cfg() -> dict:
+  """
+  取得多個 SFTP host 之間選擇與切換 (modules.sftp_hosts) 的設定, 未設定的欄位會使用預設值
+
+  Returns:
+    dict: 包含以下內容:
+      - probeTimeout (float): 量測各 host 連線延遲的逾時秒數, 預設為 3
+      - cooldown (float): host 連線失敗或傳輸停滯後, 多少秒內排在其他 host 之後, 預設為 300
+  """
+  cfg = get_cfg()
+  return {
+    "probeTimeout": float(cfg.get("sftp_probe_timeout_sec", 3)),
+    "cooldown": float(cfg.get("sftp_host_cooldown_sec", 300))
   }
 
 
 def get_sinf_dl_path(lot_id: str, folder_name: str) -> str:
   """
-  取得 SINF map 下載檔案的存放路徑
+  取得 SINF map 下載檔案的存放路徑, 位於 lot 資料夾 (見 get_wo_dl_path()) 之下
 
   Arguments:
     lot_id (str): 貨批號碼, 例如 "AADZHS000"
     folder_name (str): 資料夾名稱, 由 lot_id 組成, 例如 f"APC_AADZHS000"
   """
-  return rf"{cfg['dl_basic_dir']}\{lot_id}\{folder_name}".strip()
+  return rf"{get_wo_dl_path(lot_id)}\{folder_name}".strip()
 
 
 def get_wo_month_cnt() -> int:
@@ -57,39 +135,337 @@ def get_wo_month_cnt() -> int:
   取得下載 WO 時要遍歷幾個月份的資料夾
   詳細可以見 modules.wo 的 getLatestMonths() 與 download_wo_file()
   """
-  return int(cfg["wo_month_cnt"])
+  return int(get_cfg()["wo_month_cnt"])
+
+
+def get_wo_cache_mb() -> float:
+  """
+  取得 WO file 快取 (modules.wo.read_wo_table()) 的記憶體上限 (MB)
+  同一張工單通常包含多批, 已讀過且沒有變動的 WO file 不需要重新讀取; 0 代表停用快取, 預設為 64
+  """
+  return max(float(get_cfg().get("wo_cache_mb", 64)), 0)
+
+
+def get_dl_layout_cfg() -> dict:
+  """
+  取得 dl_basic_dir 的分層設定, 未設定的欄位會使用預設值
+
+  Returns:
+    dict: 包含以下內容:
+      - shard (str): 新下載的 lot 資料夾放在哪一層, "month" 為 {dl_basic_dir}\\{下載年月 YYYYMM}\\{lot_id},
+        "prefix" 為 {dl_basic_dir}\\{lot_id 前 prefixLen 碼}\\{lot_id}, "none" 為 {dl_basic_dir}\\{lot_id} (舊格式), 預設為 "none"
+      - prefixLen (int): shard 為 "prefix" 時取 lot_id 的前幾碼, 預設為 4
+      - lookupMonths (int): 尋找已下載的 lot 時, 往前檢查幾個月份的資料夾 (含本月), 預設為 6
+  """
+  cfg = get_cfg()
+  shard = str(cfg.get("dl_shard", "none")).strip().lower()
+  if shard not in ("none", "month", "prefix"):
+    raise ValueError(f"Unknown dl_shard: {shard}")
+  return {
+    "shard": shard,
+    "prefixLen": max(int(cfg.get("dl_shard_prefix_len", 4)), 1),
+    "lookupMonths": max(int(cfg.get("dl_shard_lookup_months", 6)), 1)
+  }
+
+
+def get_lot_dir_candidates(root: str, lot_id: str) -> list:
+  """
+  依序列出 lot 資料夾在 root 中可能的位置: 第一個為目前的 dl_shard 設定下新下載時使用的位置, 其後為其他格式的位置
+
+  Arguments:
+    root (str): dl_basic_dir 或相同格式的資料夾
+    lot_id (str): 貨批號碼, 例如 "AADZHS000"
+  """
+  layout = get_dl_layout_cfg()
+  today = date.today()
+  months = []
+  for offset in range(layout["lookupMonths"]):
+    year, month = divmod(today.year * 12 + today.month - 1 - offset, 12)
+    months.append(f"{year}{month + 1:02d}")
+  by_month = [rf"{root}\{month}\{lot_id}" for month in months]
+  by_prefix = rf"{root}\{lot_id[:layout['prefixLen']]}\{lot_id}"
+  flat = rf"{root}\{lot_id}"
+  if layout["shard"] == "month":
+    return [*by_month, by_prefix, flat]
+  if layout["shard"] == "prefix":
+    return [by_prefix, flat, *by_month]
+  return [flat, by_prefix, *by_month]
+
+
+#lot 資料夾位置的快取, key 為 (dl_basic_dir, lot_id), value 為 (路徑, 到期的 time.monotonic())
+_lot_dirs = {}
+LOT_DIR_CACHE_SEC = 300
+
+
+def forget_lot_dir(lot_id: str | None = None):
+  """清除 get_wo_dl_path() 的快取, 例如 lot 資料夾被 modules.retention 移除後; 未指定 lot_id 時全部清除"""
+  for key in [key for key in _lot_dirs if lot_id is None or key[1] == lot_id]:
+    _lot_dirs.pop(key, None)
 
 
 def get_wo_dl_path(lot_id: str) -> str:
   """
-  取得 WO file 下載檔案的存放路徑
+  取得 lot 資料夾 (WO file 下載檔案的存放路徑, SINF map 在其中的 APC_{lot_id})
+  已下載過的 lot (資料夾或封存檔 {lot 資料夾}.tar.*) 不論是哪一種 dl_shard 格式都沿用原本的位置, 否則依目前的 dl_shard 設定;
+  結果會快取 LOT_DIR_CACHE_SEC 秒, 避免每次都對 QNAP 檢查多個位置
 
   Arguments:
     lot_id (str): 貨批號碼, 例如 "AADZHS000"
   """
-  return rf"{cfg['dl_basic_dir']}\{lot_id}".strip()
+  root = get_cfg()["dl_basic_dir"].strip()
+  key = (root, lot_id)
+  cached = _lot_dirs.get(key)
+  if cached and cached[1] > time.monotonic():
+    return cached[0]
+  candidates = get_lot_dir_candidates(root, lot_id)
+  path = next((
+    path for path in candidates
+    if os.path.isdir(path) or any(os.path.isfile(f"{path}.tar.{compression}") for compression in ARCHIVE_COMPRESSIONS)
+  ), candidates[0])
+  _lot_dirs[key] = (path, time.monotonic() + LOT_DIR_CACHE_SEC)
+  return path
 
 
 def get_sinf_target_path() -> str:
   """取得下載 SINF map file 的遠端目標路徑"""
-  return rf"{cfg['sinf_target_path']}".strip()
+  return rf"{get_cfg()['sinf_target_path']}".strip()
 
 
 def get_wo_target_path() -> str:
   """取得下載 WO file 的遠端目標路徑"""
-  return rf"{cfg['wo_target_path']}".strip()
+  return rf"{get_cfg()['wo_target_path']}".strip()
 
 
 def get_export_path() -> str:
   """取得 XML 匯出的路徑"""
-  return rf"{cfg['xml_export_dir']}".strip()
+  return rf"{get_cfg()['xml_export_dir']}".strip()
 
 
 def get_xml_bak_path() -> str:
   """取得 XML 的備份路徑"""
-  return rf"{cfg['xml_bak_path']}".strip()
+  return rf"{get_cfg()['xml_bak_path']}".strip()
 
 
 def get_upload_path() -> str:
   """取得上傳檔案的路徑 (AWMS)"""
-  return rf"{cfg['upload_path']}".strip()
\ No newline at end of file
+  return rf"{get_cfg()['upload_path']}".strip()
+
+def get_prefetch_cfg() -> dict:
+  """
+  取得背景預先下載 (prefetch) 的設定, 未設定的欄位會使用預設值
+
+  Returns:
+    dict: prefetch 設定, 包含以下內容:
+      - enabled (bool): 是否啟用, 預設為 False
+      - interval (int): 輪詢 SFTP 的間隔秒數, 預設為 60
+      - maxAgeHours (float): 只預先下載多少小時內有變動的 APC_ 資料夾, 預設為 24
+      - diskBudgetMb (int): 預先下載 (尚未被 Execute 使用) 的檔案總量上限, 單位 MB, 預設為 2048
+      - maxWarmLots (int): 保留在記憶體中的預先轉檔結果 (XML 元素與 row data) 的批數上限, 預設為 8
+  """
+  cfg = get_cfg()
+  return {
+    "enabled": bool(cfg.get("prefetch_enabled", False)),
+    "interval": int(cfg.get("prefetch_interval_sec", 60)),
+    "maxAgeHours": float(cfg.get("prefetch_max_age_hours", 24)),
+    "diskBudgetMb": int(cfg.get("prefetch_disk_budget_mb", 2048)),
+    "maxWarmLots": max(int(cfg.get("prefetch_max_warm_lots", 8)), 1)
+  }
+
+
+def get_service_cfg() -> dict:
+  """
+  取得常駐服務 (modules.service) 的設定, 未設定的欄位會使用預設值
+
+  Returns:
+    dict: 常駐服務設定, 包含以下內容:
+      - enabled (bool): GUI 是否透過常駐服務執行, 預設為 False
+      - address (str): 服務位址, "host:port" 或 Windows named pipe (例如 "\\\\.\\pipe\\mapin"), 預設為 "127.0.0.1:50866"
+      - authkey (str): 連線驗證用的金鑰
+  """
+  cfg = get_cfg()
+  return {
+    "enabled": bool(cfg.get("service_enabled", False)),
+    "address": str(cfg.get("service_address", "127.0.0.1:50866")).strip(),
+    "authkey": str(cfg.get("service_authkey", "mapin")).strip()
+  }
+
+
+def get_pipeline_process_enabled() -> bool:
+  """
+  取得是否在獨立的子 process 中執行處理流程
+  啟用後轉檔等 CPU 密集的工作不會與 GUI 搶 GIL, 視窗在處理大批 lot 時也能保持回應, 預設為 False
+  """
+  return bool(get_cfg().get("pipeline_process_enabled", False))
+
+
+def get_pipeline_queue_size() -> int:
+  """
+  取得分段轉檔 (modules.stream) 各階段之間 queue 的大小 (wafer 片數)
+  下載 SINF map 的同時即開始轉置與比對, 轉檔中的 wafer 最多約為此數值的 2 倍; 0 代表停用, 下載完整批後才開始轉檔, 預設為 4
+  """
+  return max(int(get_cfg().get("pipeline_queue_size", 4)), 0)
+
+
+def get_ui_cfg() -> dict:
+  """
+  取得 GUI 更新頻率相關的設定, 未設定的欄位會使用預設值
+
+  Returns:
+    dict: GUI 設定, 包含以下內容:
+      - flushIntervalMs (int): 合併進度與 log 後更新畫面的間隔毫秒數, 預設為 100
+      - logMaxLines (int): Log 區塊最多保留的行數, 超過時移除最舊的行, 預設為 2000
+  """
+  cfg = get_cfg()
+  return {
+    "flushIntervalMs": int(cfg.get("ui_flush_interval_ms", 100)),
+    "logMaxLines": int(cfg.get("ui_log_max_lines", 2000))
+  }
+
+
+def get_stage_timeouts() -> dict:
+  """
+  取得處理流程各階段的期限秒數, 超過期限會中止該批處理; 0 代表不限制
+
+  Returns:
+    dict: 包含以下內容:
+      - sinf (float): 從 SFTP 下載 SINF map, 預設為 300
+      - wo (float): 從 B2B folder 尋找並下載 WO file, 預設為 120
+      - convert (float): 轉檔與比對 row data, 預設為 300
+      - upload (float): 上傳 XML 到 AWMS 並備份, 預設為 120
+  """
+  timeouts = {"sinf": 300.0, "wo": 120.0, "convert": 300.0, "upload": 120.0}
+  for stage, seconds in get_cfg().get("stage_timeout_sec", {}).items():
+    timeouts[stage] = float(seconds)
+  return timeouts
+
+
+def get_lease_stale_sec() -> float:
+  """
+  取得下載租約 (modules.lease) 的過期秒數
+  持有租約的工作站超過此秒數沒有更新租約時, 其他工作站會視為已當機並收回租約, 預設為 120
+  """
+  return float(get_cfg().get("lease_stale_sec", 120))
+
+
+def get_ledger_path() -> str:
+  """取得執行紀錄 (SQLite) 的檔案路徑, 預設為 "ledger.db" """
+  return get_cfg().get("ledger_path", "ledger.db").strip()
+
+
+def get_concurrency_cfg(name: str) -> dict:
+  """
+  取得自動調整並行數量 (modules.concurrency) 的設定, 未設定的欄位會使用預設值
+
+  Arguments:
+    name (str): "sftp" (SFTP 下載的 channel 數), "wo" (遍歷 WO file 的 thread 數) 或 "upload" (寫入 share 的 thread 數)
+
+  Returns:
+    dict: 包含以下內容:
+      - min (int): 並行數量下限, 預設為 1
+      - max (int): 並行數量上限, 預設 sftp 為 8, wo 為 4, upload 為 2
+      - initial (int): 程式啟動時的並行數量, 預設 sftp 為 4, wo 為 2, upload 為 1
+      - sampleSize (int): 每完成幾次操作重新決定一次並行數量, 預設為 8
+      - maxErrorRate (float): 錯誤率超過此值時並行數量減半, 預設為 0.1
+  """
+  defaults = {
+    "sftp": {"min": 1, "max": 8, "initial": 4},
+    "wo": {"min": 1, "max": 4, "initial": 2},
+    "upload": {"min": 1, "max": 2, "initial": 1}
+  }
+  cfg = get_cfg()
+  limits = {**defaults.get(name, {"min": 1, "max": 1, "initial": 1}), **cfg.get("concurrency", {}).get(name, {})}
+  return {
+    "min": max(int(limits["min"]), 1),
+    "max": max(int(limits["max"]), int(limits["min"]), 1),
+    "initial": int(limits["initial"]),
+    "sampleSize": max(int(cfg.get("concurrency_sample_size", 8)), 1),
+    "maxErrorRate": float(cfg.get("concurrency_max_error_rate", 0.1))
+  }
+
+
+#modules.archive 支援的壓縮格式
+ARCHIVE_COMPRESSIONS = ("gz", "bz2", "xz")
+
+
+def get_archive_cfg() -> dict:
+  """
+  取得壓縮封存 (modules.archive) 的設定, 未設定的欄位會使用預設值
+
+  Returns:
+    dict: 包含以下內容:
+      - enabled (bool): 上傳成功後是否將 dl_basic_dir 中該 lot 的 SINF map 與 WO file 壓縮為一個檔案, 並以壓縮檔備份 XML, 預設為 False
+      - compression (str): 壓縮格式, "gz", "bz2" 或 "xz", 預設為 "gz"
+  """
+  cfg = get_cfg()
+  compression = str(cfg.get("archive_compression", "gz")).strip().lower()
+  if compression not in ARCHIVE_COMPRESSIONS:
+    raise ValueError(f"Unknown archive_compression: {compression}")
+  return {
+    "enabled": bool(cfg.get("archive_enabled", False)),
+    "compression": compression
+  }
+
+
+def get_retention_cfg() -> dict:
+  """
+  取得 dl_basic_dir 保留期限 (modules.retention) 的設定, 未設定的欄位會使用預設值
+
+  Returns:
+    dict: 包含以下內容:
+      - enabled (bool): 是否在背景定期清理 dl_basic_dir, 預設為 False
+      - maxAgeDays (float): lot 資料夾 (或封存檔) 超過幾天沒有變動即清理, 0 代表不限制, 預設為 30
+      - maxSizeGb (float): dl_basic_dir 的總量上限 (GB), 超過時由最舊的 lot 開始清理, 0 代表不限制, 預設為 0
+      - moveDir (str): 清理時移到此資料夾 (保留原本的分層), 空字串代表直接刪除, 預設為 ""
+      - interval (int): 背景清理的間隔秒數, 預設為 3600
+  """
+  cfg = get_cfg()
+  return {
+    "enabled": bool(cfg.get("retention_enabled", False)),
+    "maxAgeDays": float(cfg.get("retention_max_age_days", 30)),
+    "maxSizeGb": float(cfg.get("retention_max_size_gb", 0)),
+    "moveDir": str(cfg.get("retention_move_dir", "")).strip(),
+    "interval": int(cfg.get("retention_interval_sec", 3600))
+  }
+
+
+#未設定 bins 時的 Bin 定義, 依 XML 中 Bin 元素的順序
+DEFAULT_BINS = [
+  {"code": "1", "quality": "Pass", "description": "Normal Pass"},
+  {"code": "X", "quality": "Fail", "description": "Normal Fail"},
+  {"code": "F", "quality": "NULL", "description": "NULL"}
+]
+
+
+def get_bin_map_cfg() -> dict:
+  """
+  取得 SINF RowData 符號轉置為 XML Bin code 的設定, 未設定的欄位會使用預設值 ("__" → "F", "00" → "1", 其他 → "X")
+
+  Returns:
+    dict: 包含以下內容:
+      - symbols (dict): key 為 SINF 符號, value 為 Bin code, 預設為 {"__": "F", "00": "1"}
+      - default (str): symbols 以外的符號轉置的 Bin code, 預設為 "X"
+      - nullBin (str): XML Device 元素的 NullBin, 預設為 "F"
+      - bins (list): XML 中的 Bin 元素, 依序輸出; 每個為包含 code, quality, description 的 dict
+  """
+  cfg = get_cfg()
+  symbols = {str(symbol): str(code) for symbol, code in cfg.get("bin_symbols", {"__": "F", "00": "1"}).items()}
+  default = str(cfg.get("bin_default", "X"))
+  null_bin = str(cfg.get("bin_null", "F"))
+  bins = []
+  for item in cfg.get("bins", DEFAULT_BINS):
+    if not isinstance(item, dict) or "code" not in item:
+      raise ValueError(f"Each entry in bins needs a code: {item!r}")
+    bins.append({"code": str(item["code"]), "quality": str(item.get("quality", "")), "description": str(item.get("description", ""))})
+  codes = [item["code"] for item in bins]
+  #每個 die 在 XML 的 Row 中以一個字元表示
+  for code in codes:
+    if len(code) != 1 or not code.isascii() or not code.isprintable() or code.isspace():
+      raise ValueError(f"Bin code must be a single printable ASCII character: {code!r}")
+  if len(set(codes)) != len(codes):
+    raise ValueError(f"Duplicate bin code in bins: {codes}")
+  for symbol, code in [*symbols.items(), ("bin_default", default), ("bin_null", null_bin)]:
+    if code not in codes:
+      raise ValueError(f"Bin code {code!r} of {symbol!r} is not defined in bins")
+    if not symbol or any(char.isspace() for char in symbol):
+      raise ValueError(f"Invalid SINF symbol in bin_symbols: {symbol!r}")
+  return {"symbols": symbols, "default": default, "nullBin": null_bin, "bins": bins}
@@ -0,0 +1,150 @@
+import time, threading
+from contextlib import contextmanager
+from modules.cfg import get_concurrency_cfg
+from modules.log import write_log
+
+
+class AdaptiveLimit:
+  """
+  依照實際吞吐量與錯誤率自動調整的並行數量上限, 用於 SFTP 下載、WO file 遍歷與上傳 share 等 I/O
+  每完成 sampleSize 次操作會檢討一次 (一個 window):
+    - 錯誤率超過 maxErrorRate 時, 並行數量減半
+    - 吞吐量比上一個 window 好, 繼續往同方向調整 (增加或減少 1)
+    - 吞吐量比上一個 window 差, 撤回上一次的調整
+    - 差異在 TOLERANCE 以內時維持不變, 連續 PROBE_AFTER_HOLDS 次維持不變後會試著增加 1, 以便在對方負載變輕時 (例如夜間) 提高並行數量
+  每次決定都會寫入 log, 並行數量一律介於 cfg.json 設定的 min 與 max 之間
+
+  Arguments:
+    name (str): 名稱, 用於 log, 例如 "sftp", "wo", "upload"
+    cfg (dict): get_concurrency_cfg() 的結果
+  """
+  TOLERANCE = 0.1
+  PROBE_AFTER_HOLDS = 3
+
+
+  def __init__(self, name: str, cfg: dict):
+    self.name = name
+    self.min = cfg["min"]
+    self.max = cfg["max"]
+    self.sample_size = cfg["sampleSize"]
+    self.max_error_rate = cfg["maxErrorRate"]
+    self.limit = min(max(cfg["initial"], self.min), self.max)
+    self.holds = 0
+    self.last = None  #上一個 window 的 (並行數量, 吞吐量 bytes/s)
+    self.active = 0
+    self.busy_since = None  #目前這段有操作在執行的期間的開始時間
+    self.cond = threading.Condition()
+    self._reset_window()
+
+
+  def _reset_window(self):
+    #吞吐量以有操作在執行的時間計算, 兩批 lot 之間的閒置時間不列入
+    self.window_seconds = 0.0
+    self.window_bytes = 0
+    self.window_cnt = 0
+    self.window_errors = 0
+
+
+  @contextmanager
+  def slot(self):
+    """
+    取得一個並行名額, 目前執行中的數量達到上限時等待; 離開時歸還名額
+    只歸還名額, 不記錄結果, 結果需另外呼叫 record()
+    """
+    with self.cond:
+      while self.active >= self.limit:
+        self.cond.wait()
+      self.active += 1
+      if self.busy_since is None:
+        self.busy_since = time.perf_counter()
+    try:
+      yield
+    finally:
+      with self.cond:
+        self.active -= 1
+        if self.active == 0:
+          self.window_seconds += time.perf_counter() - self.busy_since
+          self.busy_since = None
+        self.cond.notify_all()
+
+
+  def record(self, nbytes: int, ok: bool = True):
+    """
+    記錄一次操作的結果, 累計滿 sampleSize 次時重新決定並行數量; 需在 slot() 之內呼叫
+
+    Arguments:
+      nbytes (int): 此次操作傳輸 (或讀取) 的 bytes
+      ok (bool): 此次操作是否成功
+    """
+    with self.cond:
+      self.window_cnt += 1
+      if ok:
+        self.window_bytes += nbytes
+      else:
+        self.window_errors += 1
+      if self.window_cnt >= self.sample_size:
+        now = time.perf_counter()
+        if self.busy_since is not None:
+          self.window_seconds += now - self.busy_since
+          self.busy_since = now
+        self._adjust(self.window_seconds)
+        self._reset_window()
+        self.cond.notify_all()
+
+
+  def _adjust(self, seconds: float):
+    error_rate = self.window_errors / self.window_cnt
+    throughput = self.window_bytes / seconds if seconds > 0 else 0.0
+    prev = self.last
+    old = self.limit
+    #與上一個 window 相比, 並行數量是增加 (1)、減少 (-1) 還是不變 (0)
+    step = (old > prev[0]) - (old < prev[0]) if prev else 0
+    if error_rate > self.max_error_rate:
+      new = old // 2
+      reason = f"error rate {error_rate:.0%} exceeds {self.max_error_rate:.0%}"
+    elif prev is None:
+      new = old
+      reason = "first sample"
+    elif throughput > prev[1] * (1 + self.TOLERANCE):
+      #調整有幫助, 繼續往同方向; 並行數量沒變 (對方變快) 則試著增加
+      new = old + (step or 1)
+      reason = "throughput improved"
+    elif throughput < prev[1] * (1 - self.TOLERANCE):
+      #調整反而變慢, 改回去; 並行數量沒變 (對方變慢) 則減少以減輕負擔
+      new = old - (step or 1)
+      reason = "throughput dropped"
+    elif self.holds + 1 >= self.PROBE_AFTER_HOLDS:
+      new = old + 1
+      reason = "throughput flat, probing"
+    else:
+      new = old
+      reason = "throughput flat"
+    self.limit = min(max(new, self.min), self.max)
+    self.holds = self.holds + 1 if reason == "throughput flat" else 0
+    #錯誤率過高時的吞吐量不具參考價值, 下一個 window 重新比較
+    self.last = None if error_rate > self.max_error_rate else (old, throughput)
+
+    prev_text = f", prev {prev[1] / 1024 / 1024:.2f} MB/s at {prev[0]}" if prev else ""
+    write_log(
+      f"Concurrency {self.name}: {old} -> {self.limit} ({reason}; {throughput / 1024 / 1024:.2f} MB/s{prev_text}, "
+      f"errors {self.window_errors}/{self.window_cnt}, range {self.min}-{self.max})",
+      "info"
+    )
+
+
+#各階段的 AdaptiveLimit, 同一個 process 中的多批 lot 共用, 讓調整結果可以延續
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def get_limit(name: str) -> AdaptiveLimit:
+  """
+  取得指定階段的 AdaptiveLimit, 第一次呼叫時依 cfg.json 建立
+
+  Arguments:
+    name (str): "sftp" (SFTP 下載的 channel 數), "wo" (遍歷 WO file 的 thread 數) 或 "upload" (寫入 share 的 thread 數)
+  """
+  with _limits_lock:
+    if name not in _limits:
+      _limits[name] = AdaptiveLimit(name, get_concurrency_cfg(name))
+    return _limits[name]
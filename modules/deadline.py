@@ -0,0 +1,138 @@
+import time, threading
+from modules.cfg import get_stage_timeouts
+
+
+class PipelineCancelled(Exception):
+  """
+  處理流程被使用者取消, 某個階段超過期限, 或以 RunControl.fail() 中止時拋出
+
+  Attributes:
+    reason (str): "Cancelled" (使用者取消)、"StageTimeout" (超過階段期限) 或 fail() 指定的 error key
+    stage (str): 發生時所在的階段, 例如 "sinf", "wo", "convert", "upload"
+    seconds (float): 該階段的期限秒數
+    info (dict): fail() 指定的詳細資訊, 例如有問題的 wafer 與原因
+  """
+
+  def __init__(self, reason: str, stage: str, seconds: float = 0.0, info: dict | None = None):
+    super().__init__(f"{reason} at stage {stage}")
+    self.reason = reason
+    self.stage = stage
+    self.seconds = seconds
+    self.info = info
+
+
+class RunControl:
+  """
+  單次處理流程的取消旗標與階段期限
+
+  Arguments:
+    cancel_event (threading.Event | multiprocessing.Event): 取消旗標, 未指定時自行建立;
+      在子 process 執行時, 由父 process 傳入 multiprocessing.Event 以便從 GUI 取消
+  """
+
+  def __init__(self, cancel_event=None):
+    self.cancel_event = cancel_event or threading.Event()
+    self.timeouts = get_stage_timeouts()
+    self.stage = None
+    self.deadline = None
+    self.timings = {}  #各階段累計花費的秒數, key 為 stage
+    self.failure = None  #fail() 指定的 (error key, 詳細資訊)
+    self.abandoned = []  #call() 因取消或逾時而不再等待, 但仍在執行的執行緒
+
+
+  def cancel(self):
+    """要求取消, 各階段會在下一個檢查點停止"""
+    self.cancel_event.set()
+
+
+  def is_cancelled(self) -> bool:
+    return self.cancel_event.is_set()
+
+
+  def fail(self, reason: str, info: dict | None = None):
+    """
+    以確定無法完成的錯誤中止處理流程 (例如 SINF map 格式錯誤), 各階段會在下一個檢查點停止, 不需等待其餘的下載與轉檔
+    與 cancel() 不同, 不會設定 cancel_event, 只影響這次的處理流程; 只有第一次呼叫有效
+
+    Arguments:
+      reason (str): error key, 例如 "SinfInvalidError"
+      info (dict): 詳細資訊, 會放在 PipelineCancelled.info
+    """
+    if self.failure is None:
+      self.failure = (reason, info)
+
+
+  def begin(self, stage: str):
+    """進入新的階段, 並依照 cfg.json 的 stage_timeout_sec 重新計算期限"""
+    self.stage = stage
+    seconds = self.timeouts.get(stage, 0)
+    self.deadline = time.monotonic() + seconds if seconds > 0 else None
+
+
+  def check(self):
+    """檢查點: 已取消、已 fail() 或超過目前階段的期限時, 拋出 PipelineCancelled"""
+    if self.cancel_event.is_set():
+      raise PipelineCancelled("Cancelled", self.stage)
+    if self.failure is not None:
+      raise PipelineCancelled(self.failure[0], self.stage, info=self.failure[1])
+    if self.deadline is not None and time.monotonic() > self.deadline:
+      raise PipelineCancelled("StageTimeout", self.stage, self.timeouts.get(self.stage, 0))
+
+
+  def call(self, stage: str, func, *args, **kwargs):
+    """
+    進入 stage 階段, 並在背景執行緒中執行 func(*args, **kwargs), 等待期間持續檢查取消與期限
+    卡在網路路徑 (UNC) 或 socket 的系統呼叫無法從外部中斷, 超過期限時不再等待該執行緒,
+    由它在背景自行結束 (記錄在 abandoned, 可用 wait_abandoned() 等待); 會修改共用檔案的函式應在完成前自行呼叫 check(), 避免逾時後才寫入
+
+    Returns:
+      func 的回傳值, func 拋出的例外會原樣拋出
+    """
+    #同一階段的多次呼叫共用同一個期限
+    if stage != self.stage:
+      self.begin(stage)
+    self.check()
+    box = {}
+    done = threading.Event()
+
+    def target():
+      try:
+        box["value"] = func(*args, **kwargs)
+      except BaseException as e:
+        box["error"] = e
+      finally:
+        done.set()
+
+    t0 = time.perf_counter()
+    thread = threading.Thread(target=target, name=f"stage-{stage}", daemon=True)
+    thread.start()
+    try:
+      while not done.wait(0.1):
+        self.check()
+      #func 可能因為取消而提早結束 (例如傳輸回呼中的檢查點), 此時以取消為準
+      self.check()
+    except PipelineCancelled:
+      if not done.is_set():
+        self.abandoned.append(thread)
+      raise
+    finally:
+      self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - t0
+    if "error" in box:
+      raise box["error"]
+    return box["value"]
+
+
+  def wait_abandoned(self, timeout: float | None = None) -> bool:
+    """
+    等待 call() 不再等待的執行緒結束; 呼叫端應在其結束後才釋放它可能使用中的共用資源 (例如 lot 資料夾的下載租約)
+
+    Arguments:
+      timeout (float): 最多等待的秒數, None 代表等到結束為止
+
+    Returns:
+      bool: 是否都已結束
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for thread in self.abandoned:
+      thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+    return not any(thread.is_alive() for thread in self.abandoned)
@@ -0,0 +1,188 @@
+"""
+傳輸過程中的完整性檢查: 在 bytes 經過時計算 SHA-256 與大小, 不需要再讀取一次檔案 (例如透過網路讀回 share 上的檔案) 來驗證
+
+  - SFTP 下載 (modules.sinf) 以 DigestWriter 寫入本地檔案, 各檔案的 SHA-256 記錄在 lot 資料夾的 SHA256SUMS
+  - XML 匯出 (modules.xml, modules.stream) 寫入時即記錄 SHA-256 (remember()), 上傳與備份 (modules.upload) 以 copy_verified() 複製,
+    複製時計算的 SHA-256 與大小需與匯出時相同, 不一致時重新複製
+"""
+import os, time, hashlib, threading
+from modules.log import write_log
+
+
+#SHA-256 不一致時, 最多重新傳輸的次數 (含第一次)
+VERIFY_ATTEMPTS = 3
+#lot 資料夾中記錄 SINF map SHA-256 的檔案, 格式與 sha256sum 相同
+MANIFEST_NAME = "SHA256SUMS"
+
+
+class IntegrityError(IOError):
+  """傳輸或複製後的大小或 SHA-256 與預期不一致"""
+
+
+class DigestWriter:
+  """
+  包裝以 binary 模式開啟的檔案物件, write() 時同時計算 SHA-256 與大小, 並累計寫入所花的秒數
+
+  Arguments:
+    f (file): 寫入的檔案物件
+  """
+
+  def __init__(self, f):
+    self.f = f
+    self.sha = hashlib.sha256()
+    self.size = 0
+    self.seconds = 0.0
+
+  def write(self, data):
+    self.sha.update(data)
+    self.size += len(data)
+    t0 = time.perf_counter()
+    self.f.write(data)
+    self.seconds += time.perf_counter() - t0
+    return len(data)
+
+  def flush(self):
+    self.f.flush()
+
+  @property
+  def name(self):
+    #gzip 會將檔名寫入壓縮檔的 header, 與直接開啟檔案時相同
+    return self.f.name
+
+  def digest(self) -> dict:
+    """
+    Returns:
+      dict: 包含 bytes (int) 與 sha256 (str, hex)
+    """
+    return {"bytes": self.size, "sha256": self.sha.hexdigest()}
+
+
+def check_written(path: str, digest: dict):
+  """
+  以檔案大小 (只讀取 metadata) 確認寫入的內容完整, 不一致時拋出 IntegrityError
+
+  Arguments:
+    path (str): 已寫入並關閉的檔案路徑
+    digest (dict): 寫入時 DigestWriter.digest() 的結果
+  """
+  size = os.path.getsize(path)
+  if size != digest["bytes"]:
+    raise IntegrityError(f"{path} has {size} bytes on disk, {digest['bytes']} bytes were written")
+
+
+#匯出時記錄的 SHA-256, key 為檔案路徑, value 為 ((大小, 修改時間), digest); 最多保留 _DIGESTS_MAX 筆, 超過時移除最舊的
+_digests = {}
+_digests_lock = threading.Lock()
+_DIGESTS_MAX = 256
+
+
+def remember(path: str, digest: dict):
+  """記錄剛寫入的檔案的 SHA-256, 供之後複製時比對; 檔案被修改 (大小或修改時間改變) 後記錄即失效"""
+  st = os.stat(path)
+  with _digests_lock:
+    _digests.pop(path, None)
+    _digests[path] = ((st.st_size, st.st_mtime_ns), digest)
+    while len(_digests) > _DIGESTS_MAX:
+      del _digests[next(iter(_digests))]
+
+
+def file_digest(path: str) -> dict:
+  """
+  取得檔案的 SHA-256 與大小, 有 remember() 的記錄時不會讀取檔案; 讀取檔案計算後也會記錄, 同一個檔案只讀取一次
+
+  Returns:
+    dict: 包含 bytes (int) 與 sha256 (str, hex)
+  """
+  st = os.stat(path)
+  with _digests_lock:
+    entry = _digests.get(path)
+  if entry and entry[0] == (st.st_size, st.st_mtime_ns):
+    return entry[1]
+  sha = hashlib.sha256()
+  size = 0
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+      sha.update(chunk)
+      size += len(chunk)
+  digest = {"bytes": size, "sha256": sha.hexdigest()}
+  with _digests_lock:
+    _digests[path] = ((st.st_size, st.st_mtime_ns), digest)
+  return digest
+
+
+def copy_verified(src_path: str, dst_path: str, expected: dict | None = None, cancel_check=None) -> dict:
+  """
+  先複製為 {dst_path}.part, 複製時計算 SHA-256 與大小, 檢查通過後才改名為 dst_path
+  讀取的內容與 expected 不一致 (來源在複製期間被修改或讀取錯誤), 或寫入的大小不一致時, 移除暫存檔並重新複製, 最多 VERIFY_ATTEMPTS 次
+  改名前會呼叫 cancel_check(), 已取消時會拋出例外並移除暫存檔, 不會寫入目的地
+
+  Arguments:
+    src_path (str): 來源檔案路徑
+    dst_path (str): 目的檔案路徑
+    expected (dict): 來源檔案的 bytes 與 sha256, 例如 file_digest() 的結果; 未指定時只檢查大小
+    cancel_check (function): 改名前呼叫的檢查函式
+
+  Returns:
+    dict: 複製的 bytes 與 sha256; 重試後仍不一致時拋出 IntegrityError
+  """
+  part_path = f"{dst_path}.part"
+  for attempt in range(1, VERIFY_ATTEMPTS + 1):
+    try:
+      with open(src_path, "rb") as src, open(part_path, "wb") as dst:
+        writer = DigestWriter(dst)
+        for chunk in iter(lambda: src.read(1024 * 1024), b""):
+          writer.write(chunk)
+      digest = writer.digest()
+      check_written(part_path, digest)
+      if expected and (digest["bytes"] != expected["bytes"] or digest["sha256"] != expected["sha256"]):
+        raise IntegrityError(
+          f"{src_path} read as {digest['bytes']} bytes sha256 {digest['sha256'][:16]}, "
+          f"expected {expected['bytes']} bytes sha256 {expected['sha256'][:16]}"
+        )
+      if cancel_check:
+        cancel_check()
+      os.replace(part_path, dst_path)
+      return digest
+    except BaseException as e:
+      try:
+        os.remove(part_path)
+      except OSError:
+        pass
+      if not isinstance(e, IntegrityError) or attempt == VERIFY_ATTEMPTS:
+        raise
+      write_log(f"Copy to {dst_path} failed verification, retrying ({attempt}/{VERIFY_ATTEMPTS}): {e}", "warning")
+
+
+def read_manifest(folder: str) -> dict:
+  """
+  讀取資料夾中的 SHA256SUMS
+
+  Returns:
+    dict: key 為檔案名稱, value 為 sha256 (hex); 檔案不存在或無法讀取時回傳空 dict
+  """
+  digests = {}
+  try:
+    with open(os.path.join(folder, MANIFEST_NAME), "r", encoding="utf-8") as f:
+      for line in f:
+        sha256, sep, name = line.rstrip("\n").partition("  ")
+        if sep:
+          digests[name] = sha256
+  except OSError:
+    pass
+  return digests
+
+
+def update_manifest(folder: str, digests: dict):
+  """
+  將檔案的 SHA-256 寫入資料夾中的 SHA256SUMS, 保留其他檔案原本的記錄
+
+  Arguments:
+    folder (str): 資料夾路徑
+    digests (dict): key 為檔案名稱, value 為 sha256 (hex)
+  """
+  merged = {**read_manifest(folder), **digests}
+  path = os.path.join(folder, MANIFEST_NAME)
+  with open(f"{path}.part", "w", encoding="utf-8", newline="\n") as f:
+    for name in sorted(merged):
+      f.write(f"{merged[name]}  {name}\n")
+  os.replace(f"{path}.part", path)
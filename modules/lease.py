@@ -0,0 +1,144 @@
+import os, json, time, uuid, socket, threading
+from datetime import datetime
+from modules.cfg import get_lease_stale_sec, get_wo_dl_path
+from modules.log import write_log
+
+
+class DownloadLease:
+  """
+  跨工作站的下載租約, 以 {dl_basic_dir}\\{lot_id}\\.lease 檔案表示
+  多台電腦的 dl_basic_dir 指向同一個 QNAP 資料夾時, 同一時間只有一台可以下載同一批 lot 的 SINF map 與 WO file,
+  其他工作站會等待租約釋放, 之後下載時因為檔案大小與修改時間相同而直接沿用 (見 modules.sinf.is_same_file)
+
+  持有者每隔 stale_sec / 4 秒更新租約的修改時間 (heartbeat);
+  等待者觀察到租約內容與修改時間超過 stale_sec 秒都沒有變動時, 視為持有者已當機, 會收回租約.
+  判斷是否過期只使用本機的經過時間, 不比較不同電腦之間的時鐘
+
+  Arguments:
+    lot_id (str): 貨批號碼
+    lot_dir (str): lot 資料夾, 未指定時為 get_wo_dl_path(lot_id); 同一批 lot 在 dl_basic_dir 中有多個位置時 (例如改變 dl_shard 前後) 用來指定其中一個
+  """
+
+  def __init__(self, lot_id: str, lot_dir: str | None = None):
+    self.lot_id = lot_id
+    self.path = os.path.join(lot_dir or get_wo_dl_path(lot_id), ".lease")
+    self.token = uuid.uuid4().hex
+    self.stale_sec = get_lease_stale_sec()
+    self.held = False
+    self._stop_heartbeat = threading.Event()
+
+
+  def read(self) -> dict | None:
+    """讀取目前的租約內容, 不存在或無法讀取時回傳 None"""
+    try:
+      with open(self.path, "r", encoding="utf-8") as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+
+  def try_acquire(self) -> bool:
+    """嘗試取得租約, 不等待; 以 O_EXCL 建立檔案, 確保同一時間只有一個持有者"""
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    try:
+      fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      return False
+    info = {"token": self.token, "host": socket.gethostname(), "pid": os.getpid(), "acquiredAt": datetime.now().isoformat(timespec="seconds")}
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+      json.dump(info, f)
+    self.held = True
+    self._stop_heartbeat.clear()
+    threading.Thread(target=self._heartbeat, name=f"lease-{self.lot_id}", daemon=True).start()
+    return True
+
+
+  def acquire(self, check=None, on_wait=None):
+    """
+    取得租約, 其他工作站持有時持續等待, 並收回過期的租約
+
+    Arguments:
+      check (function): 每次等待時呼叫, 例如 RunControl.check, 已取消或超過期限時拋出例外以停止等待
+      on_wait (function): 開始等待時呼叫一次, 參數為目前持有者的租約內容 (dict)
+    """
+    observed = None
+    observed_since = time.monotonic()
+    waiting = False
+    while not self.try_acquire():
+      info = self.read()
+      try:
+        snapshot = (info or {}).get("token"), os.path.getmtime(self.path)
+      except OSError:
+        continue  #租約剛被釋放, 立即重試
+      #租約內容或修改時間有變動, 代表持有者仍在運作
+      if snapshot != observed:
+        observed = snapshot
+        observed_since = time.monotonic()
+      elif time.monotonic() - observed_since > self.stale_sec:
+        self.reclaim(observed[0])
+      if not waiting:
+        waiting = True
+        write_log(f"Lot {self.lot_id} is being downloaded by {(info or {}).get('host', 'another workstation')}, waiting", "info")
+        if on_wait:
+          on_wait(info or {})
+      if check:
+        check()
+      time.sleep(1)
+
+
+  def reclaim(self, stale_token: str | None):
+    """
+    收回過期的租約: 先以 {lease}.reclaim 檔案確保同一時間只有一個工作站在收回,
+    再次確認租約仍是同一個過期的 token 後才刪除, 避免誤刪其他工作站剛取得的新租約
+    """
+    mutex_path = f"{self.path}.reclaim"
+    try:
+      fd = os.open(mutex_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+      os.close(fd)
+    except FileExistsError:
+      #收回者本身當機時, 留下的 .reclaim 檔案在兩倍過期時間後移除
+      try:
+        if time.time() - os.path.getmtime(mutex_path) > self.stale_sec * 2:
+          os.remove(mutex_path)
+      except OSError:
+        pass
+      return
+    try:
+      info = self.read()
+      if info is not None and info.get("token") == stale_token:
+        os.remove(self.path)
+        write_log(f"Reclaimed stale download lease of lot {self.lot_id} held by {info.get('host')} (pid {info.get('pid')})", "warning")
+    except OSError:
+      pass
+    finally:
+      try:
+        os.remove(mutex_path)
+      except OSError:
+        pass
+
+
+  def release(self):
+    """釋放租約, 只刪除自己持有的租約"""
+    if not self.held:
+      return
+    self.held = False
+    self._stop_heartbeat.set()
+    try:
+      info = self.read()
+      if info is not None and info.get("token") == self.token:
+        os.remove(self.path)
+    except OSError as e:
+      write_log(f"Release download lease of lot {self.lot_id} failed: {e}", "warning")
+
+
+  def _heartbeat(self):
+    """定期更新租約的修改時間, 讓其他工作站知道持有者仍在運作"""
+    while not self._stop_heartbeat.wait(self.stale_sec / 4):
+      try:
+        info = self.read()
+        if info is None or info.get("token") != self.token:
+          write_log(f"Download lease of lot {self.lot_id} was taken over by another workstation", "warning")
+          return
+        os.utime(self.path)
+      except OSError as e:
+        write_log(f"Download lease heartbeat of lot {self.lot_id} failed: {e}", "warning")
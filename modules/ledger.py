@@ -0,0 +1,158 @@
+import json, socket, sqlite3
+from modules.cfg import get_ledger_path
+from modules.log import write_log
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  lot_id TEXT NOT NULL,
+  lot_no TEXT,
+  host TEXT,
+  started_at TEXT,
+  finished_at TEXT,
+  status TEXT,
+  msg TEXT,
+  wafer_cnt INTEGER,
+  bin_totals TEXT,
+  xml_sha256 TEXT,
+  upload_path TEXT,
+  timings TEXT,
+  sftp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_lot_id ON runs (lot_id, finished_at);
+CREATE INDEX IF NOT EXISTS idx_runs_xml_sha256 ON runs (xml_sha256);
+CREATE TABLE IF NOT EXISTS sftp_hosts (
+  endpoint TEXT PRIMARY KEY,
+  latency_ms REAL,
+  failures INTEGER NOT NULL DEFAULT 0,
+  last_ok REAL,
+  last_failure REAL,
+  last_error TEXT
+);
+"""
+
+
+def connect_ledger() -> sqlite3.Connection:
+  """開啟執行紀錄資料庫, 不存在時自動建立資料表與索引"""
+  conn = sqlite3.connect(get_ledger_path(), timeout=10)
+  conn.row_factory = sqlite3.Row
+  conn.executescript(_SCHEMA)
+  return conn
+
+
+def record_run(metrics: dict):
+  """
+  將單次執行的 metrics 紀錄 (modules.pipeline.Pipeline.metrics) 寫入執行紀錄
+  各 Bin code 的數量以 JSON 寫入 bin_totals 欄位, key 為 cfg.json bins 中的 code
+  寫入失敗只記錄 log, 不影響處理流程
+
+  Arguments:
+    metrics (dict): 包含 lotId, lotNo, startedAt, finishedAt, status, msg, waferCnt, binTotals, xmlSha256, uploadPath, timings, sftp
+  """
+  bin_totals = metrics.get("binTotals")
+  sftp = {k: v for k, v in (metrics.get("sftp") or {}).items() if k != "files"}
+  try:
+    conn = connect_ledger()
+    try:
+      with conn:
+        conn.execute(
+          """
+          INSERT INTO runs (lot_id, lot_no, host, started_at, finished_at, status, msg, wafer_cnt,
+                            bin_totals, xml_sha256, upload_path, timings, sftp)
+          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+          """,
+          (
+            metrics["lotId"], metrics.get("lotNo"), socket.gethostname(), metrics.get("startedAt"), metrics.get("finishedAt"),
+            metrics.get("status"), metrics.get("msg"), metrics.get("waferCnt"),
+            json.dumps(bin_totals) if bin_totals is not None else None,
+            metrics.get("xmlSha256"), metrics.get("uploadPath"),
+            json.dumps(metrics.get("timings") or {}), json.dumps(sftp)
+          )
+        )
+    finally:
+      conn.close()
+  except sqlite3.Error as e:
+    write_log(f"Write run ledger failed: {e}", "error")
+
+
+def find_uploads(lot_id: str) -> list:
+  """
+  查詢 lot 已成功上傳的紀錄, 由新到舊排列
+
+  Arguments:
+    lot_id (str): 貨批號碼
+
+  Returns:
+    list: 每筆為一個 dict, 包含 lotNo, host, finishedAt, waferCnt, binTotals, xmlSha256, uploadPath; 查詢失敗時回傳空列表
+      binTotals 為各 Bin code 的數量 (dict), 沒有紀錄時為空 dict
+  """
+  try:
+    conn = connect_ledger()
+    try:
+      rows = conn.execute(
+        """
+        SELECT lot_no, host, finished_at, wafer_cnt, bin_totals, xml_sha256, upload_path
+        FROM runs WHERE lot_id = ? AND status = 'success' ORDER BY finished_at DESC
+        """,
+        (lot_id,)
+      ).fetchall()
+    finally:
+      conn.close()
+  except sqlite3.Error as e:
+    write_log(f"Read run ledger failed: {e}", "error")
+    return []
+  return [
+    {
+      "lotNo": row["lot_no"], "host": row["host"], "finishedAt": row["finished_at"], "waferCnt": row["wafer_cnt"],
+      "binTotals": json.loads(row["bin_totals"] or "{}"), "xmlSha256": row["xml_sha256"], "uploadPath": row["upload_path"]
+    }
+    for row in rows
+  ]
+
+
+def load_host_health() -> dict:
+  """
+  讀取各 SFTP host 的健康狀態 (modules.sftp_hosts)
+
+  Returns:
+    dict: key 為 "host:port", value 為包含 latencyMs, failures, lastOk, lastFailure, lastError 的 dict; 讀取失敗時回傳空 dict
+  """
+  try:
+    conn = connect_ledger()
+    try:
+      rows = conn.execute("SELECT * FROM sftp_hosts").fetchall()
+    finally:
+      conn.close()
+  except sqlite3.Error as e:
+    write_log(f"Read SFTP host health failed: {e}", "error")
+    return {}
+  return {
+    row["endpoint"]: {
+      "latencyMs": row["latency_ms"], "failures": row["failures"], "lastOk": row["last_ok"],
+      "lastFailure": row["last_failure"], "lastError": row["last_error"]
+    }
+    for row in rows
+  }
+
+
+def save_host_health(endpoint: str, health: dict):
+  """
+  寫入單一 SFTP host 的健康狀態, 寫入失敗只記錄 log
+
+  Arguments:
+    endpoint (str): "host:port"
+    health (dict): 包含 latencyMs, failures, lastOk, lastFailure, lastError
+  """
+  try:
+    conn = connect_ledger()
+    try:
+      with conn:
+        conn.execute(
+          "INSERT OR REPLACE INTO sftp_hosts (endpoint, latency_ms, failures, last_ok, last_failure, last_error) VALUES (?, ?, ?, ?, ?, ?)",
+          (endpoint, health["latencyMs"], health["failures"], health["lastOk"], health["lastFailure"], health["lastError"])
+        )
+    finally:
+      conn.close()
+  except sqlite3.Error as e:
+    write_log(f"Write SFTP host health failed: {e}", "error")
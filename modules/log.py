@@ -3,21 +3,32 @@ from datetime import datetime
 from modules.cfg import get_log_path
 
 
-#日誌配置內容
-log_dir = get_log_path()
-os.makedirs(log_dir, exist_ok=True)
-curr_date = datetime.now().strftime("%Y%m%d")
-LOG_FILE = os.path.join(log_dir, f"exec_log_{curr_date}.log")
-logging.basicConfig(
-  filename=LOG_FILE,    #日誌檔案名稱
-  level=logging.INFO,   #設定日誌等級
-  filemode="a",         #追加模式
-  encoding="utf-8",     #指定編碼為 UTF-8
-  format="%(asctime)s - %(message)s"  #日誌格式
-)
+LOG_FILE = None
+
+
+def init_log():
+  """
+  日誌配置內容, 第一次寫 log 時才建立 log 資料夾與檔案 (import 時不會有建立資料夾的副作用)
+  """
+  global LOG_FILE
+  if LOG_FILE is not None:
+    return
+  log_dir = get_log_path()
+  os.makedirs(log_dir, exist_ok=True)
+  curr_date = datetime.now().strftime("%Y%m%d")
+  LOG_FILE = os.path.join(log_dir, f"exec_log_{curr_date}.log")
+  logging.basicConfig(
+    filename=LOG_FILE,    #日誌檔案名稱
+    level=logging.INFO,   #設定日誌等級
+    filemode="a",         #追加模式
+    encoding="utf-8",     #指定編碼為 UTF-8
+    format="%(asctime)s - %(message)s"  #日誌格式
+  )
+
 
 def write_log(msg: str, status="info"):
   """二次包裝 logging.info()"""
+  init_log()
   title = "Information"
   match status:
     case "success":
@@ -0,0 +1,326 @@
+"""
+離線批次轉檔: 直接使用本機 (或 QNAP) 上已下載的 SINF map 與 WO file, 不連線 SFTP、不遍歷 B2B folder
+
+每批 lot 在獨立的子 process 中執行 prepare_export / compare_row_cnt / export_xml, 預設使用全部的 CPU 核心;
+XML 匯出到 {out}\\{lot_id}\\{LotId}.xml, 加上 --upload 時會在轉檔完成後依序上傳到 AWMS 並寫入執行紀錄
+
+SINF map 的來源資料夾 (--source, 預設為 dl_basic_dir) 可以是以下任一種格式:
+  - {source}\\{lot_id}\\APC_{lot_id}\\{lot_id}.nn (dl_basic_dir 的格式, WO file 在 {source}\\{lot_id} 中)
+  - {source}\\{lot_id}.tar.gz (modules.archive 封存的 lot, 會解壓縮到暫存資料夾)
+  - 以上兩種格式放在分層資料夾中, 例如 {source}\\{YYYYMM}\\{lot_id} (見 cfg.json 的 dl_shard)
+  - {source}\\APC_{lot_id}\\{lot_id}.nn (與 SFTP 相同的格式, 需以 --wo-dir 指定 WO file 所在的資料夾)
+
+使用方式 (請在專案根目錄執行, 或使用打包後的 main.exe):
+  $ python main.py --offline
+  $ python main.py --offline AADZHS000 MWD053000 --source D:\\maps --wo-dir D:\\wo --out D:\\xml --jobs 4
+  $ python main.py --offline AADZHS000 --upload --report offline.json
+"""
+import os, sys, json, time, shutil, argparse, tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+from datetime import datetime
+import multiprocessing as mp
+from modules.archive import OPENERS, extract_archive
+from modules.cfg import get_cfg, get_lot_dir_candidates
+from modules.integrity import file_digest
+from modules.log import write_log
+from modules.retention import ARCHIVE_RE, is_lot_dir
+
+
+def find_lots(source: str) -> list:
+  """
+  列出來源資料夾中所有可轉檔的 lot
+
+  Arguments:
+    source (str): SINF map 的來源資料夾
+
+  Returns:
+    list: 排序後的貨批號碼列表
+  """
+  lot_ids = set()
+  for entry in os.scandir(source):
+    if entry.is_dir():
+      if entry.name.startswith("APC_"):
+        lot_ids.add(entry.name[len("APC_"):])
+      elif os.path.isdir(os.path.join(entry.path, f"APC_{entry.name}")):
+        lot_ids.add(entry.name)
+      elif not is_lot_dir(entry.path):
+        #分層資料夾 (dl_shard), 其中為 lot 資料夾與封存檔
+        for sub_entry in os.scandir(entry.path):
+          if sub_entry.is_dir() and os.path.isdir(os.path.join(sub_entry.path, f"APC_{sub_entry.name}")):
+            lot_ids.add(sub_entry.name)
+          elif ARCHIVE_RE.match(sub_entry.name):
+            lot_ids.add(ARCHIVE_RE.match(sub_entry.name).group(1))
+    elif ARCHIVE_RE.match(entry.name):
+      lot_ids.add(ARCHIVE_RE.match(entry.name).group(1))
+  return sorted(lot_ids)
+
+
+def locate_lot(source: str, lot_id: str) -> dict | None:
+  """
+  取得 lot 在來源資料夾中的位置
+
+  Returns:
+    dict: 包含 sinfDir (SINF map 資料夾) 與 lotDir (WO file 所在資料夾, 可能為 None), 或 archive (封存檔路徑)
+    None: 找不到此 lot
+  """
+  if os.path.isdir(os.path.join(source, f"APC_{lot_id}")):
+    return {"sinfDir": os.path.join(source, f"APC_{lot_id}"), "lotDir": None}
+  #與 dl_basic_dir 相同的格式, 可能在分層資料夾中
+  for lot_dir in get_lot_dir_candidates(source, lot_id):
+    if os.path.isdir(os.path.join(lot_dir, f"APC_{lot_id}")):
+      return {"sinfDir": os.path.join(lot_dir, f"APC_{lot_id}"), "lotDir": lot_dir}
+    for compression in OPENERS:
+      archive_path = f"{lot_dir}.tar.{compression}"
+      if os.path.isfile(archive_path):
+        return {"archive": archive_path}
+  return None
+
+
+def index_wo_files(csv_paths: list) -> dict:
+  """
+  讀取 WO file 的 LOT NO 欄位, 建立 LOT NO 與檔案的對照
+
+  Arguments:
+    csv_paths (list): WO file 路徑列表
+
+  Returns:
+    dict: key 為 LOT NO, value 為第一個包含此 LOT NO 的 WO file 路徑; 無法讀取的檔案會記錄 log 後略過
+  """
+  import pandas as pd
+  from modules.wo import read_csvs
+
+  index = {}
+  read_lot_nos = lambda path: pd.read_csv(path, sep="\t", on_bad_lines="skip", usecols=lambda c: c == "LOT NO")
+  with closing(read_csvs(csv_paths, read_lot_nos)) as results:
+    for csv_path, df in results:
+      if isinstance(df, Exception):
+        write_log(f"Read CSV file {csv_path} failed: {df}", "warning")
+        continue
+      if "LOT NO" not in df.columns:
+        continue
+      for lot_no in df["LOT NO"].astype(str).str.strip().unique():
+        index.setdefault(lot_no, csv_path)
+  return index
+
+
+def list_csvs(folder: str | None) -> list:
+  """列出資料夾中的 .csv 檔案, 資料夾不存在時回傳空列表"""
+  if not folder or not os.path.isdir(folder):
+    return []
+  return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(".csv")]
+
+
+def init_worker(cfg_overrides: dict):
+  """子 process 的初始化: 使用與父 process 相同的設定; 轉檔的逐行 debug log 只寫入 log 檔, 不印在命令列上"""
+  get_cfg().update(cfg_overrides)
+  sys.stdout = open(os.devnull, "w")
+
+
+def convert_lot(job: dict) -> dict:
+  """
+  在子 process 中轉檔單一 lot, 流程與 modules.pipeline.Pipeline 的第 1-6 步相同, 但只讀取本機檔案
+
+  Arguments:
+    job (dict): 包含 lotId, location (locate_lot() 的結果), woPath (可能為 None) 與 outDir
+
+  Returns:
+    dict: 包含 lotId, status ("success" 或 "error"), error (error key), lotNo, xmlPath, exportDir, waferCnt, binTotals, seconds
+  """
+  from modules.sinf import get_sinf_info
+  from modules.wo import get_wo_info
+  from modules.xml import compare_row_cnt, export_xml, prepare_export
+
+  lot_id = job["lotId"]
+  result = {
+    "lotId": lot_id, "status": "error", "error": None, "lotNo": None, "xmlPath": None,
+    "exportDir": None, "waferCnt": None, "binTotals": None, "seconds": 0.0
+  }
+  t0 = time.perf_counter()
+  staging = None
+  try:
+    location = job["location"]
+    #封存的 lot 解壓縮到暫存資料夾, 不修改來源
+    if "archive" in location:
+      staging = tempfile.mkdtemp(prefix=f"mapin_offline_{lot_id}_")
+      extract_archive(location["archive"], staging)
+      location = {"sinfDir": os.path.join(staging, f"APC_{lot_id}"), "lotDir": staging}
+    sinf_dir = location["sinfDir"]
+
+    #1. 取得 die size
+    sinf_info = get_sinf_info(sinf_dir)
+    if isinstance(sinf_info, str):
+      result["error"] = sinf_info
+      return result
+
+    #2. 取得 target device 與 quantity; 未指定 WO file 時使用 lot 資料夾中的 WO file
+    wo_path = job["woPath"] or index_wo_files(list_csvs(location["lotDir"])).get(lot_id)
+    if not wo_path:
+      result["error"] = "WoNotFoundError"
+      return result
+    wo_info = get_wo_info(wo_path, lot_id)
+    if isinstance(wo_info, str):
+      result["error"] = wo_info
+      return result
+
+    #3. 比對 SINF map 的檔案數量與 WO 所記錄的 quantity 是否一致
+    result["waferCnt"] = len(os.listdir(sinf_dir))
+    if result["waferCnt"] != wo_info["quantity"]:
+      result["error"] = "NumberMismatchError"
+      return result
+
+    #4. 生成 XML 元素並比對轉置前後的 row data 數量
+    prepare_result = prepare_export(lot_id, wo_info["targetDevice"], sinf_info["dieSizeX"], sinf_info["dieSizeY"], dl_path=sinf_dir)
+    if isinstance(prepare_result, str):
+      result["error"] = prepare_result
+      return result
+    compare_result = compare_row_cnt(prepare_result["rowDataBef"], prepare_result["rowDataAft"])
+    if isinstance(compare_result, str):
+      result["error"] = compare_result
+      return result
+    if any(compare_result["mismatchedIds"].values()):
+      result["error"] = "RowDataMismatchError"
+      return result
+    result["binTotals"] = dict(compare_result["totalAft"])
+
+    #5. 輸出 XML 到 {out}\{lot_id}; 上傳後 upload_xml() 會移除整個匯出資料夾, 因此每批使用各自的資料夾
+    result["exportDir"] = os.path.join(job["outDir"], lot_id)
+    get_cfg()["xml_export_dir"] = result["exportDir"]
+    xml_path = export_xml(lot_id, prepare_result["mapsEl"], prepare_result["lotNo"])
+    if xml_path == "ExportXmlError":
+      result["error"] = xml_path
+      return result
+    result.update({"status": "success", "lotNo": prepare_result["lotNo"], "xmlPath": xml_path})
+    return result
+
+  except Exception as e:
+    write_log(f"Offline conversion of lot {lot_id} failed: {e}", "error")
+    result["error"] = str(e)
+    return result
+  finally:
+    if staging:
+      shutil.rmtree(staging, ignore_errors=True)
+    result["seconds"] = time.perf_counter() - t0
+
+
+def upload_lot(result: dict, reupload: bool) -> dict:
+  """
+  上傳離線轉檔的結果並寫入執行紀錄, 在父 process 中依序執行
+
+  Arguments:
+    result (dict): convert_lot() 的結果, 會加入 uploadPath 與上傳結果
+    reupload (bool): 執行紀錄中已有成功上傳的紀錄時是否仍上傳
+  """
+  from modules.ledger import find_uploads, record_run
+  from modules.upload import upload_xml
+
+  lot_id = result["lotId"]
+  previous = find_uploads(lot_id)
+  if previous and not reupload:
+    write_log(f"Lot {lot_id} was uploaded at {previous[0]['finishedAt']} by {previous[0]['host']}, skipped (use --reupload to upload again)", "warning")
+    result.update({"status": "skipped", "error": "AlreadyUploaded"})
+    return result
+
+  started_at = datetime.now().isoformat(timespec="seconds")
+  #在父 process 中只讀取一次, 上傳與備份時以此比對
+  xml_sha256 = file_digest(result["xmlPath"])["sha256"]
+  cfg = get_cfg()
+  export_dir = cfg["xml_export_dir"]
+  cfg["xml_export_dir"] = result["exportDir"]
+  t0 = time.perf_counter()
+  try:
+    upload_result = upload_xml(result["xmlPath"])
+  finally:
+    cfg["xml_export_dir"] = export_dir
+  upload_seconds = time.perf_counter() - t0
+  if upload_result in ("XmlNotFoundError", "UploadError"):
+    result.update({"status": "error", "error": upload_result})
+  else:
+    result["uploadPath"] = upload_result
+
+  record_run({
+    "lotId": lot_id, "lotNo": result["lotNo"], "startedAt": started_at, "finishedAt": datetime.now().isoformat(timespec="seconds"),
+    "status": result["status"], "msg": f"Offline conversion: {result['error'] or 'uploaded'}", "waferCnt": result["waferCnt"],
+    "binTotals": result["binTotals"], "xmlSha256": xml_sha256, "uploadPath": result.get("uploadPath"),
+    "timings": {"convert": result["seconds"], "upload": upload_seconds}, "sftp": None
+  })
+  return result
+
+
+def run_offline(lot_ids: list, source: str, out_dir: str, wo_dir: str | None = None, jobs: int | None = None,
+                upload: bool = False, reupload: bool = False) -> list:
+  """
+  以多個子 process 批次轉檔, 可選擇在每批轉檔完成後上傳
+
+  Arguments:
+    lot_ids (list): 貨批號碼列表, 空白時轉檔來源資料夾中的全部 lot
+    source (str): SINF map 的來源資料夾, 格式見本模組說明
+    out_dir (str): XML 輸出資料夾
+    wo_dir (str): WO file 所在的資料夾, 未指定時使用各 lot 資料夾中的 WO file
+    jobs (int): 子 process 數量, 預設為 CPU 核心數
+    upload (bool): 是否上傳轉檔成功的 XML
+    reupload (bool): 已上傳過的 lot 是否仍上傳
+
+  Returns:
+    list: 每批 lot 一筆 convert_lot() 的結果, 依 lot_ids 的順序排列
+  """
+  lot_ids = lot_ids or find_lots(source)
+  wo_index = index_wo_files(list_csvs(wo_dir)) if wo_dir else {}
+  results = {}
+  work = []
+  for lot_id in lot_ids:
+    location = locate_lot(source, lot_id)
+    if location is None:
+      results[lot_id] = {"lotId": lot_id, "status": "error", "error": "SinfNotFoundError", "seconds": 0.0}
+      continue
+    work.append({"lotId": lot_id, "location": location, "woPath": wo_index.get(lot_id), "outDir": out_dir})
+
+  jobs = max(1, min(jobs or os.cpu_count() or 1, len(work) or 1))
+  write_log(f"Offline conversion: {len(work)} lots from {source} with {jobs} processes", "info")
+  t0 = time.perf_counter()
+  #與 pipeline_process_enabled 相同使用 spawn, Windows 與打包後的 exe 行為一致
+  with ProcessPoolExecutor(max_workers=jobs, mp_context=mp.get_context("spawn"), initializer=init_worker, initargs=(dict(get_cfg()),)) as pool:
+    futures = [pool.submit(convert_lot, job) for job in work]
+    #轉檔完成的 lot 先上傳, 其他 lot 在子 process 中繼續轉檔
+    for future in as_completed(futures):
+      result = future.result()
+      if upload and result["status"] == "success":
+        result = upload_lot(result, reupload)
+      results[result["lotId"]] = result
+      write_log(f"Offline lot {result['lotId']}: {result['status']}{' (' + result['error'] + ')' if result['error'] else ''} in {result['seconds']:.2f}s", "info")
+  elapsed = time.perf_counter() - t0
+  ok_cnt = sum(1 for r in results.values() if r["status"] == "success")
+  write_log(f"Offline conversion finished: {ok_cnt}/{len(lot_ids)} succeeded in {elapsed:.1f}s", "info")
+  return [results[lot_id] for lot_id in lot_ids]
+
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(prog="main.py --offline", description="Convert already downloaded SINF maps to XML in bulk without network access")
+  parser.add_argument("lot_ids", nargs="*", help="lots to convert, default: every lot found in --source")
+  parser.add_argument("--source", help="folder of SINF sets, default: dl_basic_dir")
+  parser.add_argument("--wo-dir", help="folder of WO files (.csv), default: the WO file copied into each lot folder")
+  parser.add_argument("--out", default="offline_export", help="XML output folder, one sub folder per lot")
+  parser.add_argument("--jobs", type=int, help="worker processes, default: CPU count")
+  parser.add_argument("--upload", action="store_true", help="upload each converted XML to AWMS and record it in the run ledger")
+  parser.add_argument("--reupload", action="store_true", help="with --upload, also upload lots that were uploaded before")
+  parser.add_argument("--report", help="write the results as JSON to this path")
+  args = parser.parse_args(argv)
+
+  #先檢查 bin 設定, 有誤時不啟動轉檔的子 process
+  from modules.xml import load_bin_table
+  try:
+    load_bin_table()
+  except ValueError as e:
+    parser.error(f"invalid bin config in cfg.json: {e}")
+
+  source = args.source or get_cfg()["dl_basic_dir"]
+  if not os.path.isdir(source):
+    parser.error(f"source folder not found: {source}")
+  results = run_offline(args.lot_ids, source, os.path.abspath(args.out), args.wo_dir, args.jobs, args.upload, args.reupload)
+
+  if args.report:
+    with open(args.report, "w", encoding="utf-8") as f:
+      json.dump(results, f, indent=2)
+    print(f"Saved report: {args.report}")
+  #已上傳過而略過的 lot 不視為失敗
+  return 0 if results and all(r["status"] in ("success", "skipped") for r in results) else 1
@@ -0,0 +1,485 @@
+import os, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from modules.log import write_log
+from modules.archive import archive_lot
+from modules.prefetch import get_warm_result, get_warm_wo_path, has_warm_result, lot_lock, mark_consumed
+from modules.cfg import get_cfg, get_pipeline_queue_size, get_sinf_dl_path, get_xml_bak_path
+from modules.deadline import PipelineCancelled, RunControl
+from modules.integrity import file_digest
+from modules.lease import DownloadLease
+from modules.ledger import record_run
+from modules.sinf import download_sinf_map, format_transfer_stats, get_sinf_info, new_transfer_stats
+from modules.stream import StreamingExport
+from modules.upload import upload_xml
+from modules.wo import download_wo_file, get_wo_info
+from modules.xml import compare_row_cnt, export_xml, get_wafer_letter, mark_validated, prepare_export, rm_export_folder, validate_sinf
+
+
+#各階段在訊息中顯示的名稱
+STAGE_LABELS = {
+  "sinf": "SINF map download",
+  "wo": "WO file lookup",
+  "convert": "XML conversion",
+  "upload": "XML upload"
+}
+
+
+class Signal:
+  """
+  與 pyqtSignal 相同用法 (connect / emit) 的簡易 signal, 讓核心流程不需要依賴 PyQt5
+  slot 會在呼叫 emit() 的執行緒中直接執行
+  """
+
+  def __init__(self):
+    self.slots = []
+
+  def connect(self, slot):
+    self.slots.append(slot)
+
+  def emit(self, *args):
+    for slot in list(self.slots):
+      slot(*args)
+
+
+class Pipeline:
+  """
+  單一 lot 的完整處理流程 (下載 → 轉檔 → 比對 → 匯出 → 上傳), 不依賴 PyQt5
+  GUI 透過 modules.worker.Worker 在 QThread 中執行, 常駐服務與 bench 則直接呼叫 run()
+  每個階段 (sinf, wo, convert, upload) 都透過 RunControl 執行, 可被取消, 超過 cfg.json 的 stage_timeout_sec 也會中止
+
+  Arguments:
+    lot_id (str): 貨批號碼
+    control (RunControl): 取消旗標與階段期限, 未指定時自行建立
+  """
+
+  def __init__(self, lot_id, control: RunControl | None = None):
+    self.lot_id = lot_id
+    self.control = control or RunControl()
+    self.progress = Signal()  #int
+    self.message = Signal()   #status, msg, skip_log
+    self.log_text = Signal()  #str
+    self.finished = Signal()
+    self.result = Signal()    #dict, 執行結束時發出的 metrics 紀錄
+    #本次執行的 metrics 紀錄, 結束時寫入執行紀錄 (modules.ledger), 包含以下內容:
+    #lotId, lotNo, startedAt, finishedAt, status, msg, waferCnt, binTotals (各 Bin code 的數量, 預設為 F / 1 / X),
+    #xmlSha256, uploadPath, timings (各階段秒數) 與 SFTP 傳輸統計 (sftp)
+    self.metrics = {
+      "lotId": lot_id, "lotNo": None, "startedAt": None, "finishedAt": None, "status": None, "msg": None,
+      "waferCnt": None, "binTotals": None, "xmlSha256": None, "uploadPath": None, "timings": {}, "sftp": new_transfer_stats()
+    }
+    self.message.connect(self.record_message)
+
+
+  def record_message(self, status: str, msg: str, skip_log: bool):
+    """將最後一則訊息記錄為本次執行的結果"""
+    self.metrics["status"] = status
+    self.metrics["msg"] = msg
+
+
+  def on_download_progress(self, done_bytes: int, total_bytes: int):
+    """將 SINF map 下載進度換算為整體進度 10-23%, 只有數值改變時才發出"""
+    #已取消或超過期限時在此拋出例外, 中斷 paramiko 的傳輸
+    self.control.check()
+    num = 10 + (13 * done_bytes // total_bytes if total_bytes else 13)
+    if num != self.last_progress:
+      self.last_progress = num
+      self.progress.emit(num)
+
+
+  def on_sinf_file(self, dl_path: str, stream: StreamingExport | None, filename: str, sha256: str | None):
+    """
+    每個 SINF map 檔案下載完成時 (依檔名順序) 檢查表頭與 RowData 的行列數, 通過後才交給分段轉檔;
+    第一片有問題的 wafer 即中止整個流程, 不再等待其餘的下載與轉檔; 通過的檔案以 sha256 記錄, 整批轉檔時不需要再檢查
+    """
+    invalid = validate_sinf(dl_path, filename)
+    if invalid:
+      self.control.fail("SinfInvalidError", invalid)
+      #在下載的 thread 中拋出, 停止尚未開始的下載
+      self.control.check()
+    mark_validated(os.path.join(dl_path, filename), sha256)
+    if stream:
+      stream.feed(filename)
+
+
+  def find_wo(self, lot_id: str, warm_wo_path: str | None, stream: StreamingExport | None) -> str:
+    """
+    在背景尋找 WO file, 與 SINF map 下載同時進行; 分段轉檔時取得 target device 後即交給 serialize 開始生成 XML
+
+    Returns:
+      str: 與 download_wo_file() 相同
+    """
+    #如果 prefetch 已下載過 WO file, 略過遍歷 B2B folder
+    wo_result = warm_wo_path or download_wo_file(lot_id)
+    if stream and wo_result and wo_result not in ("WoReadError", "WoNotFoundError"):
+      wo_info = get_wo_info(wo_result, lot_id)
+      if isinstance(wo_info, dict):
+        stream.set_target_device(wo_info["targetDevice"])
+    return wo_result
+
+
+  def get_error_msg(self, key: str, custom_info=None) -> str:
+    """
+    根據 error 的 key 取得對應的 message 內容
+
+    Arguments:
+      key (str): error key, 例如 "ConnectionError", "SinfNotFoundError" 等
+      custom_info (str | dict, optional): 自訂訊息內容, 例如 Lot ID 或 SINF map 檔案名稱
+
+    Returns:
+      str: 對應的 error message 內容, 如果沒有對應的 key, 則回傳 "Unknown error occurred"
+    """
+    if key == "NumberMismatchError":
+      if isinstance(custom_info, dict):
+        return f"SINF map file count {custom_info['sinf']} does not match WO QUANTITY value {custom_info['wo']}"
+      else:
+        return f"SINF map file count does not match WO QUANTITY value"
+    elif key == "SinfInvalidError":
+      info = getattr(custom_info, "info", custom_info)
+      if isinstance(info, dict):
+        return f"SINF map file {info['file']} (wafer ID {info['waferId']}) is invalid: {info['reason']}"
+      else:
+        return f"SINF map file of lot ID '{custom_info}' is invalid, see log for the wafer and reason"
+    elif key == "RowDataMismatchError":
+      if isinstance(custom_info, dict):
+        return f"Row data wafer ID {custom_info['waferId']} mismatched, '{custom_info['symBef']}' count is: {custom_info['cntBef']}, and '{custom_info['symAft']}' count is {custom_info['cntAft']}"
+    else:
+      error_messages = {
+        "ConnectionError": "Failed to connect to SFTP server",
+        "SinfNotFoundError": f"Lot ID '{custom_info}' SINF map not found from FTP",
+        "DownloadTooManyTimes": f"Failed to download {custom_info} file after 3 attempts",
+        "SinfDownloadError": "Failed to download SINF map file",
+        "SinfReadError": "Failed to read SINF map file",
+        "WoReadError": "Failed to read .csv (WO file)",
+        "WoNotFoundError": f"Lot ID '{custom_info}' WO file not found from B2B folder",
+        "RemoveExportError": f"Failed to remove existed export folder",
+        "CompareRowDataError": f"Failed to compare row data for lot ID '{custom_info}'",
+        "ExportXmlError": f"Failed to export XML file for lot ID '{custom_info}'",
+        "XmlNotFoundError": f"XML file for lot ID '{custom_info}' not found in export folder",
+        "UploadError": f"Error uploading XML to AWMS for lot '{custom_info}'",
+        "Cancelled": f"Cancelled by user during {STAGE_LABELS.get(getattr(custom_info, 'stage', None), 'processing')}",
+        "StageTimeout": f"{STAGE_LABELS.get(getattr(custom_info, 'stage', None), 'Processing')} did not finish within {getattr(custom_info, 'seconds', 0):.0f} seconds"
+      }
+      return error_messages.get(key, f"Unknown error occurred: {key}")
+
+
+  def run(self):
+    """
+    1. 取得 Lot ID, 並檢查 Lot ID 是否為空
+    2. 如果 Lot ID 不為空, 開始處理
+    3. 下載 SINF map 檔案, 取得 dieSizeX 與 dieSizeY
+    4. 下載工單 (WO file), 取得 targetDevice 與 quantity
+    5. 比對 SINF map 的檔案數量與 WO 所記錄的 quantity 是否一致
+    6. 將 map 輸出成 XML 格式
+    7. 將 XML 檔案上傳到 AWMS MapIN 路徑
+    8. 如果有任何錯誤, 使用 QMessageBox 顯示警告訊息
+    9. 如果成功, 印出相關資訊, 並使用 QMessageBox 顯示成功訊息
+    """
+    #如果背景 prefetch 正在處理同一批, 等待其完成後即可直接使用預先轉檔的結果
+    lock = lot_lock(self.lot_id)
+    locked = False
+    lease = DownloadLease(self.lot_id)
+    stream = None
+    wo_lookup = None
+    try:
+      #等待期間仍可被取消
+      while not lock.acquire(timeout=0.1):
+        self.control.check()
+      locked = True
+      self.metrics["startedAt"] = datetime.now().isoformat(timespec="seconds")
+      write_log("=" * 60, "info")
+
+      lot_id = self.lot_id
+      self.progress.emit(0)
+      self.log_text.emit(f"Processing lot ID: {lot_id}")
+
+      #Lot ID 不為空, 開始處理
+      if lot_id and len(lot_id) != 0:
+        write_log(f"Processing Lot ID: {lot_id}")
+        self.progress.emit(10)
+
+      ################################################################################
+      #1. 下載 SINF map 檔案, 取得 die_size_x 與 die_size_y
+      #其他工作站正在下載同一批 lot 到共用的 dl_basic_dir 時, 等待其完成後沿用已下載的檔案
+      self.control.call("sinf", lease.acquire, self.control.check,
+                        lambda info: self.log_text.emit(f"Waiting for {info.get('host', 'another workstation')} to finish downloading"))
+      self.last_progress = 10
+      #下載 SINF map 的同時即開始轉置與比對 (modules.stream); prefetch 已轉檔過的 lot 直接使用其結果
+      queue_size = get_pipeline_queue_size()
+      sinf_dl_path = get_sinf_dl_path(lot_id, f"APC_{lot_id}")
+      if queue_size and not has_warm_result(lot_id):
+        stream = StreamingExport(lot_id, sinf_dl_path, queue_size).start()
+      #同時在背景尋找 WO file (需持有租約), 結果在第 2 步才使用
+      wo_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wo-lookup")
+      wo_lookup = wo_executor.submit(self.find_wo, lot_id, get_warm_wo_path(lot_id), stream)
+      wo_executor.shutdown(wait=False)
+      #每個檔案下載完成時即檢查格式, 有問題時不會下載與轉檔其餘的檔案
+      sinf_result = self.control.call("sinf", download_sinf_map, lot_id, self.on_download_progress, self.metrics["sftp"],
+                                      lambda filename, sha256: self.on_sinf_file(sinf_dl_path, stream, filename, sha256),
+                                      self.control.check)
+      self.progress.emit(23)
+
+      #如果在 SFTP server 沒有找到 lot_id 所對應的 SINF map 檔案
+      if sinf_result == "SinfNotFoundError":
+        self.message.emit("warning", self.get_error_msg(sinf_result, lot_id), False)
+        return
+      #如果在 SFTP server 下載 SINF map 檔案失敗超過 3 次
+      elif sinf_result == "DownloadTooManyTimes":
+        self.message.emit("warning", self.get_error_msg(sinf_result, "SINF map"), False)
+        return
+      #如果在 SFTP server 下載 SINF map 檔案遇到其他失敗
+      elif sinf_result == "SinfDownloadError":
+        self.message.emit("warning", self.get_error_msg(sinf_result), False)
+        return
+
+      #如果成功下載 SINF map 檔案, sinf_result 會是其下載路徑
+      if sinf_result != None and sinf_result.strip() != "":
+        if stream:
+          stream.end_feed()
+        self.log_text.emit(f"SINF map download path: {sinf_result}")
+        self.log_text.emit(f"SFTP transfer: {format_transfer_stats(self.metrics['sftp'])}")
+        sinf_info = self.control.call("sinf", get_sinf_info, sinf_result)
+        #如果是字串, 代表讀取 SINF map 檔案失敗
+        if isinstance(sinf_info, str):
+          self.message.emit("warning", self.get_error_msg(sinf_info), False)
+          return
+        #如果是 dict, 代表成功讀取 SINF map, 取得 dieSizeX 與 dieSizeY
+        elif isinstance(sinf_info, dict):
+          die_size_x = sinf_info.get("dieSizeX")
+          die_size_y = sinf_info.get("dieSizeY")
+          die_size_msg = f"Die Size X: {die_size_x}, Die Size Y: {die_size_y}"
+          self.log_text.emit(die_size_msg)
+          write_log(die_size_msg)
+          self.progress.emit(37)
+
+      ################################################################################
+      #2. 下載工單 (WO file), 取得 target_device 與 quantity
+      #等待第 1 步開始的背景尋找完成, stage_timeout_sec 的 wo 期限由此開始計算
+      wo_result = self.control.call("wo", wo_lookup.result)
+
+      #如果讀取 WO 檔案 (.csv) 失敗
+      if wo_result == "WoReadError":
+        self.message.emit("warning", self.get_error_msg(wo_result), False)
+        return
+      #如果在 B2B folder 沒有找到符合的 WO 檔案
+      elif wo_result == "WoNotFoundError":
+        self.message.emit("warning", self.get_error_msg(wo_result, lot_id), False)
+        return
+      #如果成功下載 WO 檔案, wo_result 會是其下載路徑
+      elif wo_result and wo_result.strip() != "":
+        self.log_text.emit(f"WO file download path: {wo_result}")
+        wo_info = self.control.call("wo", get_wo_info, wo_result, lot_id)
+        #如果是字串, 代表讀取 WO file 失敗
+        if isinstance(wo_info, str):
+          self.message.emit("warning", self.get_error_msg(wo_info), False)
+          return
+        #如果是 dict, 代表成功讀取 WO file, 取得 targetDevice 與 quantity
+        elif isinstance(wo_info, dict):
+          target_device = wo_info.get("targetDevice")
+          quantity = wo_info.get("quantity")
+          wo_info_msg = f"Target device: {target_device}, Quantity: {quantity}"
+          self.log_text.emit(wo_info_msg)
+          write_log(wo_info_msg)
+          self.progress.emit(52)
+      #下載完成, 釋放租約讓其他工作站沿用
+      self.control.call("wo", lease.release)
+
+      ################################################################################
+      #3. 比對 SINF map 的檔案數量與 WO 所記錄的 quantity 是否一致
+      sinf_file_cnt = len(self.control.call("convert", os.listdir, sinf_dl_path))
+      if sinf_file_cnt != quantity:
+        self.message.emit("warning", self.get_error_msg("NumberMismatchError", {"sinf": sinf_file_cnt, "wo": quantity}), False)
+        return
+      self.metrics["waferCnt"] = sinf_file_cnt
+      self.log_text.emit(f"SINF map file count: {sinf_file_cnt}, WO QUANTITY: {quantity}")
+      self.progress.emit(65)
+
+      ################################################################################
+      #4. 如果數量一致, 開始生成 XML 元素
+      #如果 prefetch 已轉檔過且 SINF map 沒有變動, 直接使用預先轉檔的結果
+      warm_result = get_warm_result(lot_id, target_device, die_size_x, die_size_y)
+      prepare_result = None
+      if warm_result:
+        self.log_text.emit(f"Using prefetched conversion result")
+        prepare_result = warm_result["prepareResult"]
+      elif stream and stream.names == sorted(self.control.call("convert", os.listdir, sinf_dl_path)):
+        #下載期間已開始轉置、比對與寫入 XML; die size 與最小刻號需與整批轉檔時相同才使用
+        stream.set_target_device(target_device)
+        prepare_result = self.control.call("convert", stream.wait)
+        if stream.context != (target_device, die_size_x, die_size_y, get_wafer_letter(stream.names)) and isinstance(prepare_result, dict):
+          prepare_result = None
+      if stream and (warm_result or prepare_result is None):
+        #資料夾中有此次沒有下載的舊檔案、重複的 wafer ID 等無法分段轉檔的情況, 改為整批轉檔
+        stream.close()
+        stream = None
+      invalid_info = {}
+      if prepare_result is None:
+        prepare_result = self.control.call("convert", prepare_export, lot_id, target_device, die_size_x, die_size_y, self.control.check,
+                                           on_invalid=invalid_info.update)
+      if isinstance(prepare_result, str):
+        #SINF map 有問題時顯示有問題的 wafer 與原因
+        self.message.emit("warning", self.get_error_msg(prepare_result, invalid_info or lot_id), False)
+        return
+      if isinstance(prepare_result, dict):
+        maps_el = prepare_result.get("mapsEl")
+        lot_no = prepare_result["lotNo"]
+        row_data_bef = prepare_result.get("rowDataBef")
+        row_data_aft = prepare_result.get("rowDataAft")
+      self.progress.emit(75)
+
+      ################################################################################
+      #5. 比對轉置前後的 row data 數量
+      if warm_result:
+        compare_result = warm_result["compareResult"]
+      elif stream:
+        #分段轉檔時已逐片比對
+        compare_result = prepare_result["compareResult"]
+      else:
+        compare_result = self.control.call("convert", compare_row_cnt, row_data_bef, row_data_aft)
+      if isinstance(compare_result, str):
+        self.message.emit("warning", self.get_error_msg(compare_result, lot_id), False)
+        return
+      if isinstance(compare_result, dict):
+        total_bef = compare_result["totalBef"]
+        total_aft = compare_result["totalAft"]
+        sym_bef = compare_result["symBef"]
+        self.metrics["binTotals"] = dict(total_aft)
+        #依 cfg.json 的 bins 順序列出轉置前的符號與轉置後的 Bin code 數量, 沒有出現的 Bin 不列出
+        compare_logs = [f"Comparing row data:"]
+        for code in total_aft:
+          if total_bef[code] != 0 or total_aft[code] != 0:
+            compare_logs.append(f"'{sym_bef[code]}' count is: {total_bef[code]}, '{code}' count is {total_aft[code]};")
+        self.log_text.emit(" ".join(compare_logs))
+
+        err_infos = None
+        for code, wafer_ids in compare_result["mismatchedIds"].items():
+          if wafer_ids:
+            err_infos = { "waferId": wafer_ids, "cntBef": total_bef[code], "cntAft": total_aft[code], "symBef": sym_bef[code], "symAft": code }
+            break
+        if isinstance(err_infos, dict) and err_infos:
+          self.message.emit("warning", self.get_error_msg("RowDataMismatchError", err_infos), False)
+          return
+        self.log_text.emit(f"Compare row data successfully")
+        self.progress.emit(85)
+
+      ################################################################################
+      #6. 開始輸出 XML 檔案
+      if stream:
+        #分段轉檔時 XML 已寫入暫存檔, 比對通過後才改為正式檔名
+        export_result = self.control.call("convert", stream.commit)
+      else:
+        export_result = self.control.call("convert", export_xml, lot_id, maps_el, lot_no)
+      if export_result == "ExportXmlError":
+        self.message.emit("warning", self.get_error_msg(export_result, lot_id), False)
+        return
+      else:
+        xml_path = export_result
+        self.metrics["lotNo"] = lot_no
+        #匯出時已計算 SHA-256, 不需要再讀取一次
+        self.metrics["xmlSha256"] = file_digest(xml_path)["sha256"]
+        self.log_text.emit(f"Generated map XML file path: {xml_path}")
+        self.progress.emit(93)
+
+      ################################################################################
+      #7. 將 XML 檔案上傳到 AWMS MapIN 路徑
+      upload_result = self.control.call("upload", upload_xml, xml_path, self.control.check)
+
+      #如果找不到匯出的 XML 檔案, 或者上傳至 AWMS 時發生錯誤
+      if upload_result == "XmlNotFoundError" or upload_result == "UploadError":
+        self.message.emit("warning", self.get_error_msg(upload_result, lot_id), False)
+        return
+      self.progress.emit(98)
+      self.metrics["uploadPath"] = upload_result
+      mark_consumed(lot_id)
+      self.log_text.emit(f"Copied map XML file to path: {get_xml_bak_path()}")
+      self.log_text.emit(f"Uploaded map XML file path: {upload_result}")
+
+      ################################################################################
+      #8. 啟用 archive_enabled 時, 將 SINF map 與 WO file 壓縮封存; 失敗只記錄 log, 不影響上傳結果
+      archive_path = archive_lot(lot_id)
+      if archive_path:
+        self.log_text.emit(f"Archived source maps to: {archive_path}")
+
+      ################################################################################
+      #9. 顯示成功訊息
+      self.message.emit("success", f"Success! Processed lot ID: {lot_id}", False)
+      self.progress.emit(100)
+      self.log_text.emit(f"Success! 🎉")
+      self.finished.emit()
+
+    except PipelineCancelled as e:
+      write_log(f"Lot {self.lot_id} stopped: {e}", "warning")
+      #移除尚未上傳的 XML; 下載與上傳的暫存檔 (.part) 由各階段自行清除
+      if e.stage in ("convert", "upload"):
+        rm_export_folder()
+      status = "error" if e.reason == "StageTimeout" else "warning"
+      self.message.emit(status, self.get_error_msg(e.reason, e), False)
+      self.progress.emit(0)
+      self.finished.emit()
+
+    except Exception as e:
+      self.message.emit("error", self.get_error_msg(e), False)
+      self.progress.emit(0)
+      self.finished.emit()
+
+    finally:
+      #停止分段轉檔並移除未 commit 的 XML 暫存檔
+      if stream:
+        stream.close()
+
+      def release():
+        #超過期限而不再等待的下載會在下一個檢查點停止, 但結束前仍可能寫入 dl_path;
+        #等它與背景尋找 WO file 結束後才釋放租約與 lot lock, 避免下一次執行或其他工作站同時寫入同一個資料夾
+        self.control.wait_abandoned()
+        if lease.held:
+          if wo_lookup:
+            wait([wo_lookup])
+          lease.release()
+        if locked:
+          lock.release()
+      #提早結束時仍持有租約或有未結束的執行緒; 共用資料夾可能沒有回應, 在背景等待後釋放
+      if self.control.abandoned or lease.held:
+        threading.Thread(target=release, name=f"release-{self.lot_id}", daemon=True).start()
+      else:
+        release()
+      self.metrics["finishedAt"] = datetime.now().isoformat(timespec="seconds")
+      self.metrics["timings"] = dict(self.control.timings)
+      record_run(self.metrics)
+      self.result.emit(self.metrics)
+
+
+def connect_pipeline(pipeline: Pipeline, send):
+  """
+  將 Pipeline 的 signal 轉成訊息 (dict) 傳給 send(), 供跨 process 或跨連線轉發, 訊息格式如下:
+    - {"type": "progress", "value": int}
+    - {"type": "log", "text": str}
+    - {"type": "message", "status": str, "msg": str, "skipLog": bool}
+    - {"type": "finished"}
+    - {"type": "result", "record": dict}
+  """
+  pipeline.progress.connect(lambda num: send({"type": "progress", "value": num}))
+  pipeline.log_text.connect(lambda text: send({"type": "log", "text": text}))
+  pipeline.message.connect(lambda status, msg, skip_log: send({"type": "message", "status": status, "msg": msg, "skipLog": skip_log}))
+  pipeline.finished.connect(lambda: send({"type": "finished"}))
+  pipeline.result.connect(lambda record: send({"type": "result", "record": record}))
+
+
+def run_in_child(lot_id: str, queue, cfg_overrides: dict | None = None, cancel_event=None):
+  """
+  子 process 的進入點: 執行單一 lot, 並將進度、log 與結果放入 queue, 最後放入 {"type": "done"}
+
+  Arguments:
+    lot_id (str): 貨批號碼
+    queue (multiprocessing.Queue): 回傳訊息用的 queue
+    cfg_overrides (dict): 覆寫子 process 的 cfg 欄位, 一般傳入父 process 的 get_cfg(), 讓兩邊使用相同設定;
+      多個子 process 同時執行時, 可各自指定 xml_export_dir, 避免上傳後互相刪除匯出檔案
+    cancel_event (multiprocessing.Event): 由父 process 設定以取消處理流程
+  """
+  if cfg_overrides:
+    get_cfg().update(cfg_overrides)
+  pipeline = Pipeline(lot_id, RunControl(cancel_event))
+  connect_pipeline(pipeline, queue.put)
+  try:
+    pipeline.run()
+  finally:
+    queue.put({"type": "done"})
@@ -0,0 +1,299 @@
+import os, time, shutil, threading
+from stat import S_ISDIR
+from collections import OrderedDict
+from modules.archive import get_lot_archive
+from modules.cfg import get_prefetch_cfg, get_sinf_dl_path, get_sinf_target_path, get_wo_dl_path
+from modules.lease import DownloadLease
+from modules.log import write_log
+from modules.sinf import acquire_sftp, download_sinf_map, get_sinf_info, release_sftp
+from modules.wo import download_wo_file, get_wo_info
+from modules.xml import compare_row_cnt, prepare_export, restamp_create_date
+
+
+#預先轉檔的結果, key 為 lot_id, 依轉檔的順序排列; 含轉檔結果的項目超過 prefetch_max_warm_lots 時由最早的開始移除轉檔結果
+_warm_cache = OrderedDict()
+#由 prefetch 建立且尚未被 Execute 使用的 lot 資料夾大小 (bytes), 依建立順序排列, 用來控管磁碟用量
+_prefetched_sizes = OrderedDict()
+_cache_lock = threading.Lock()
+_lot_locks = {}
+#prefetch_lot() 的結果中之後可能會改變的 (例如 WO file 比 SINF map 晚到, 或其他工作站正在下載), 遠端資料夾沒有變動也要在下次輪詢時重試
+RETRY_RESULTS = {"DownloadInProgress", "WoNotFoundError", "WoReadError", "NumberMismatchError", "SinfDownloadError", "DownloadTooManyTimes"}
+
+
+def lot_lock(lot_id: str) -> threading.Lock:
+  """
+  取得 lot_id 專用的 lock, 避免 prefetch 與 Worker 同時下載或轉檔同一批
+  """
+  with _cache_lock:
+    return _lot_locks.setdefault(lot_id, threading.Lock())
+
+
+def get_folder_fingerprint(dl_path: str) -> tuple:
+  """取得資料夾內檔案的 (檔名, 大小, 修改時間) 列表, 用來判斷預先轉檔的結果是否仍有效"""
+  try:
+    return tuple(sorted(
+      (entry.name, entry.stat().st_size, int(entry.stat().st_mtime))
+      for entry in os.scandir(dl_path) if entry.is_file()
+    ))
+  except OSError:
+    return ()
+
+
+def get_warm_wo_path(lot_id: str) -> str | None:
+  """
+  取得 prefetch 已下載的 WO file 路徑, 讓 Worker 可以略過遍歷 B2B folder
+
+  Returns:
+    str: WO file 的本地路徑
+    None: 沒有預先下載, 或檔案已不存在
+  """
+  with _cache_lock:
+    entry = _warm_cache.get(lot_id)
+  if entry and entry.get("woPath") and os.path.isfile(entry["woPath"]):
+    return entry["woPath"]
+  return None
+
+
+def has_warm_result(lot_id: str) -> bool:
+  """是否有預先轉檔的結果 (尚未檢查是否仍有效), 有的話 Worker 不需要在下載期間分段轉檔"""
+  with _cache_lock:
+    return "prepareResult" in _warm_cache.get(lot_id, {})
+
+
+def get_warm_result(lot_id: str, target_device: str, die_size_x: float, die_size_y: float) -> dict | None:
+  """
+  取得預先轉檔的結果; 只有在 SINF map 檔案、target device 與 die size 都與預先轉檔時相同才會回傳
+
+  Returns:
+    dict: 包含 prepareResult (prepare_export() 的結果) 與 compareResult (compare_row_cnt() 的結果)
+    None: 沒有可用的預先轉檔結果
+  """
+  with _cache_lock:
+    entry = _warm_cache.get(lot_id)
+  if not entry or "prepareResult" not in entry:
+    return None
+  if (entry["targetDevice"], entry["dieSizeX"], entry["dieSizeY"]) != (target_device, die_size_x, die_size_y):
+    return None
+  dl_path = get_sinf_dl_path(lot_id, f"APC_{lot_id}")
+  if entry["fingerprint"] != get_folder_fingerprint(dl_path):
+    return None
+  #XML 的 CreateDate 應為 Execute 的時間, 而不是預先轉檔的時間
+  restamp_create_date(entry["prepareResult"]["mapsEl"])
+  return {"prepareResult": entry["prepareResult"], "compareResult": entry["compareResult"]}
+
+
+def mark_consumed(lot_id: str):
+  """Execute 處理完成後呼叫, 移除預先轉檔的結果, 該 lot 的下載資料夾不再列入 prefetch 的磁碟用量"""
+  with _cache_lock:
+    _warm_cache.pop(lot_id, None)
+    _prefetched_sizes.pop(lot_id, None)
+
+
+def trim_warm_results(max_lots: int):
+  """
+  限制記憶體中的預先轉檔結果, 超過 max_lots 批時由最早轉檔的開始移除 XML 元素與 row data;
+  已下載的檔案與 WO file 路徑保留, Execute 時重新轉檔即可. 呼叫端需持有 _cache_lock
+  """
+  warm_lots = [lot for lot, entry in _warm_cache.items() if "prepareResult" in entry]
+  for lot in warm_lots[:max(len(warm_lots) - max_lots, 0)]:
+    _warm_cache[lot] = {"woPath": _warm_cache[lot].get("woPath")}
+    write_log(f"Prefetch dropped conversion result of lot {lot} to stay within prefetch_max_warm_lots", "info")
+
+
+def reserve_disk(lot_id: str, size: int, budget: int) -> bool:
+  """
+  為即將預先下載的 lot 保留磁碟用量, 超出上限時依序移除最早預先下載且尚未使用的 lot
+
+  Arguments:
+    lot_id (str): 貨批號碼
+    size (int): 預計下載的檔案大小 (bytes)
+    budget (int): 磁碟用量上限 (bytes)
+
+  Returns:
+    bool: 是否有足夠的空間
+  """
+  if size > budget:
+    return False
+  while True:
+    with _cache_lock:
+      used = sum(s for lot, s in _prefetched_sizes.items() if lot != lot_id)
+      if used + size <= budget:
+        _prefetched_sizes[lot_id] = size
+        return True
+      victim = next(lot for lot in _prefetched_sizes if lot != lot_id)
+    evict_lot(victim)
+
+
+def evict_lot(lot_id: str):
+  """移除預先下載且尚未使用的 lot 資料夾與其預先轉檔結果"""
+  lock = lot_lock(lot_id)
+  #Worker 正在處理此 lot, 讓給 Worker, 不列入 prefetch 用量
+  if not lock.acquire(blocking=False):
+    mark_consumed(lot_id)
+    return
+  try:
+    mark_consumed(lot_id)
+    #其他工作站正在下載此 lot 到共用資料夾, 不可移除
+    lease = DownloadLease(lot_id)
+    if not lease.try_acquire():
+      return
+    shutil.rmtree(get_wo_dl_path(lot_id), ignore_errors=True)
+    lease.release()  #租約檔案已隨資料夾移除, 在此只停止 heartbeat
+    write_log(f"Prefetch evicted lot {lot_id} to stay within disk budget", "info")
+  finally:
+    lock.release()
+
+
+def prefetch_lot(lot_id: str) -> str | None:
+  """
+  預先下載並轉檔單一 lot, 流程與 Worker.run() 的第 1-5 步相同, 但不輸出、不上傳 XML
+
+  Arguments:
+    lot_id (str): 貨批號碼, 例如 "AADZHS000"
+
+  Returns:
+    None: 預先轉檔成功
+    str: 失敗或略過轉檔時的 error key, 例如 "WoNotFoundError", "NumberMismatchError"
+    "DownloadInProgress": 其他工作站正在下載此 lot, 等下次輪詢再處理
+  """
+  #其他工作站正在下載時不等待, 避免 prefetch 卡住
+  lease = DownloadLease(lot_id)
+  if not lease.try_acquire():
+    return "DownloadInProgress"
+  try:
+    sinf_result = download_sinf_map(lot_id)
+    if sinf_result in ("SinfNotFoundError", "DownloadTooManyTimes", "SinfDownloadError"):
+      return sinf_result
+    #WO file 可能比 SINF map 晚到, 找不到時只保留下載結果, 等下次輪詢或 Execute 再處理
+    wo_result = download_wo_file(lot_id)
+  finally:
+    lease.release()
+
+  sinf_info = get_sinf_info(sinf_result)
+  if isinstance(sinf_info, str):
+    return sinf_info
+  if not wo_result or wo_result in ("WoReadError", "WoNotFoundError"):
+    return wo_result or "WoReadError"
+  wo_info = get_wo_info(wo_result, lot_id)
+  if isinstance(wo_info, str):
+    return wo_info
+
+  fingerprint = get_folder_fingerprint(sinf_result)
+  if len(fingerprint) != wo_info["quantity"]:
+    return "NumberMismatchError"
+
+  prepare_result = prepare_export(lot_id, wo_info["targetDevice"], sinf_info["dieSizeX"], sinf_info["dieSizeY"])
+  if isinstance(prepare_result, str):
+    return prepare_result
+  compare_result = compare_row_cnt(prepare_result["rowDataBef"], prepare_result["rowDataAft"])
+  if isinstance(compare_result, str):
+    return compare_result
+
+  with _cache_lock:
+    _warm_cache.pop(lot_id, None)
+    _warm_cache[lot_id] = {
+      "fingerprint": fingerprint,
+      "woPath": wo_result,
+      "targetDevice": wo_info["targetDevice"],
+      "dieSizeX": sinf_info["dieSizeX"],
+      "dieSizeY": sinf_info["dieSizeY"],
+      "prepareResult": prepare_result,
+      "compareResult": compare_result
+    }
+    trim_warm_results(get_prefetch_cfg()["maxWarmLots"])
+  return None
+
+
+class PrefetchWatcher(threading.Thread):
+  """
+  背景輪詢 SFTP 上的 sinf_target_path, 發現新的或有變動的 APC_* 資料夾時預先下載並轉檔,
+  讓 operator 按下 Execute 時可以直接使用預先轉檔的結果
+  """
+
+  def __init__(self):
+    super().__init__(daemon=True)
+    self.prefetch_cfg = get_prefetch_cfg()
+    self.seen = {}  #key 為遠端資料夾名稱, value 為上次處理時的修改時間
+    self._stop_event = threading.Event()
+
+
+  def stop(self):
+    """要求停止輪詢, 目前正在處理的 lot 會處理完才結束"""
+    self._stop_event.set()
+
+
+  def run(self):
+    write_log("Prefetch watcher started", "info")
+    while not self._stop_event.is_set():
+      try:
+        self.poll_once()
+      except Exception as e:
+        write_log(f"Prefetch poll failed: {e}", "error")
+      self._stop_event.wait(self.prefetch_cfg["interval"])
+    write_log("Prefetch watcher stopped", "info")
+
+
+  def poll_once(self):
+    """輪詢一次遠端資料夾, 依修改時間由新到舊處理有變動的 APC_* 資料夾"""
+    #與 download_sinf_map() 相同, 設定多個 SFTP host 時使用延遲最低且正常的 host
+    sftp = acquire_sftp()
+    if sftp.sftp is None:
+      return
+    reusable = True
+    try:
+      target_path = get_sinf_target_path()
+      min_mtime = time.time() - self.prefetch_cfg["maxAgeHours"] * 3600
+      folders = [
+        attr for attr in sftp.listdir_attr(target_path)
+        if attr.filename.startswith("APC_") and S_ISDIR(attr.st_mode or 0) and (attr.st_mtime or 0) >= min_mtime
+      ]
+      folders.sort(key=lambda attr: attr.st_mtime, reverse=True)
+
+      budget = self.prefetch_cfg["diskBudgetMb"] * 1024 * 1024
+      for folder in folders:
+        if self._stop_event.is_set():
+          break
+        if self.seen.get(folder.filename) == folder.st_mtime:
+          continue
+        lot_id = folder.filename[len("APC_"):]
+        remote_folder = os.path.join(target_path, folder.filename)
+        size = sum(attr.st_size or 0 for attr in sftp.listdir_attr(remote_folder))
+        #需要重試的結果不記錄, 下次輪詢時即使遠端資料夾沒有變動也會再處理
+        if self.prefetch(lot_id, size, budget):
+          self.seen[folder.filename] = folder.st_mtime
+    except Exception:
+      reusable = False
+      raise
+    finally:
+      release_sftp(sftp, reusable)
+
+
+  def prefetch(self, lot_id: str, size: int, budget: int) -> bool:
+    """
+    在不與 Worker 衝突且不超出磁碟用量的前提下預先處理單一 lot
+
+    Returns:
+      bool: 結果是否為最終結果 (成功、不會改變的失敗或 Worker 正在處理); 超出磁碟用量或結果在 RETRY_RESULTS 中時為 False, 應在下次輪詢重試
+    """
+    lock = lot_lock(lot_id)
+    #Worker 正在處理此 lot, 不需要預先處理
+    if not lock.acquire(blocking=False):
+      return True
+    try:
+      #只有 prefetch 新建立的資料夾才列入磁碟用量, 已存在的資料夾或封存檔 (例如之前處理過的 lot) 不會被移除
+      with _cache_lock:
+        tracked = lot_id in _prefetched_sizes
+      if tracked or not (os.path.exists(get_wo_dl_path(lot_id)) or get_lot_archive(lot_id)):
+        if not reserve_disk(lot_id, size, budget):
+          write_log(f"Prefetch skipped lot {lot_id}, {size} bytes exceeds disk budget", "warning")
+          return False
+      t0 = time.perf_counter()
+      result = prefetch_lot(lot_id)
+      elapsed = time.perf_counter() - t0
+      if result is None:
+        write_log(f"Prefetched lot {lot_id} in {elapsed:.1f}s", "info")
+      else:
+        write_log(f"Prefetch lot {lot_id} incomplete: {result}", "info")
+      return result not in RETRY_RESULTS
+    finally:
+      lock.release()
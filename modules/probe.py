@@ -0,0 +1,92 @@
+import re, time
+from modules.cfg import get_sinf_target_path
+from modules.log import write_log
+from modules.sinf import acquire_sftp, release_sftp
+from modules.wo import find_wo_quantities
+
+
+def split_lot_ids(text: str) -> list:
+  """將以空白、逗號或分號分隔的多個 Lot ID 拆成列表, 並移除重複"""
+  return list(dict.fromkeys(lot_id for lot_id in re.split(r"[\s,;]+", text) if lot_id))
+
+
+def probe_lots(lot_ids: list) -> dict | str:
+  """
+  不下載任何檔案, 檢查多批 lot 是否可以開始處理:
+  只列出 SFTP 上 APC_{lot_id} 資料夾的檔案 (listdir_attr), 並從 WO file 查詢 QUANTITY,
+  比對 {lot_id}.nn 檔案數量是否與 QUANTITY 一致 (與 Pipeline 的 NumberMismatchError 檢查相同)
+
+  Arguments:
+    lot_ids (list): 貨批號碼列表
+
+  Returns:
+    dict: 檢查結果, 包含以下內容:
+      - lots (list): 每批的 {"lotId", "status", "sinfCnt", "quantity"}, status 為以下其中之一:
+        - "Ready": SINF map 檔案數量與 WO QUANTITY 一致
+        - "SinfNotFoundError": SFTP 上沒有 APC_{lot_id} 資料夾或其中沒有 SINF map 檔案
+        - "WoNotFoundError": WO file 中沒有此 LOT NO
+        - "WoReadError": WO file 的 QUANTITY 不是整數
+        - "NumberMismatchError": SINF map 檔案數量與 WO QUANTITY 不一致
+      - seconds (float): 檢查所花的秒數
+    "ConnectionError": 無法連線到 SFTP server
+    "WoReadError": 讀取 WO 檔案 (.csv) 失敗
+  """
+  t0 = time.perf_counter()
+  quantities = find_wo_quantities(lot_ids)
+  if isinstance(quantities, str):
+    return quantities
+
+  sftp = acquire_sftp()
+  if sftp.sftp is None:
+    return "ConnectionError"
+  reusable = True
+  lots = []
+  try:
+    target_path = get_sinf_target_path()
+    for lot_id in lot_ids:
+      #與 download_sinf_map() 相同, 只計算 {lot_id}.nn 的檔案
+      valid_pattern = re.compile(rf"^{re.escape(lot_id)}\.\d{{2}}$")
+      try:
+        file_attrs = sftp.listdir_attr(rf"{target_path}\APC_{lot_id}")
+        sinf_cnt = sum(1 for f in file_attrs if valid_pattern.match(f.filename))
+      except OSError:
+        sinf_cnt = 0
+      quantity = quantities.get(lot_id)
+
+      if sinf_cnt == 0:
+        status = "SinfNotFoundError"
+      elif quantity is None:
+        status = "WoNotFoundError"
+      elif isinstance(quantity, str):
+        status = quantity
+      elif sinf_cnt != quantity:
+        status = "NumberMismatchError"
+      else:
+        status = "Ready"
+      lots.append({"lotId": lot_id, "status": status, "sinfCnt": sinf_cnt, "quantity": quantity if isinstance(quantity, int) else None})
+  except Exception as e:
+    reusable = False
+    write_log(f"Probe lots failed: {e}", "error")
+    return "ConnectionError"
+  finally:
+    release_sftp(sftp, reusable)
+
+  seconds = time.perf_counter() - t0
+  ready_cnt = sum(1 for item in lots if item["status"] == "Ready")
+  write_log(f"Probed {len(lots)} lots in {seconds:.2f}s, {ready_cnt} ready", "info")
+  return {"lots": lots, "seconds": seconds}
+
+
+def describe_probe(item: dict) -> str:
+  """將單批的檢查結果轉成一行文字"""
+  match item["status"]:
+    case "Ready":
+      return f"{item['lotId']}: ready, SINF map file count {item['sinfCnt']} matches WO QUANTITY"
+    case "SinfNotFoundError":
+      return f"{item['lotId']}: SINF map not found from FTP"
+    case "WoNotFoundError":
+      return f"{item['lotId']}: WO file not found from B2B folder ({item['sinfCnt']} SINF map files)"
+    case "NumberMismatchError":
+      return f"{item['lotId']}: SINF map file count {item['sinfCnt']} does not match WO QUANTITY value {item['quantity']}"
+    case _:
+      return f"{item['lotId']}: failed to read WO QUANTITY"
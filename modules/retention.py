@@ -0,0 +1,253 @@
+"""
+dl_basic_dir 的保留期限: 定期清理太久沒有變動的 lot 資料夾與封存檔, 讓 QNAP 上的資料夾維持少量的項目
+
+lot 可能位於以下任一種格式 (見 cfg.json 的 dl_shard 與 modules.cfg.get_wo_dl_path()):
+  - {dl_basic_dir}\\{lot_id} 或 {dl_basic_dir}\\{lot_id}.tar.gz (未分層, 舊格式)
+  - {dl_basic_dir}\\{YYYYMM}\\{lot_id} (依下載年月分層)
+  - {dl_basic_dir}\\{lot_id 前幾碼}\\{lot_id} (依 lot_id 前綴分層)
+超過 retention_max_age_days 或總量超過 retention_max_size_gb 時, 由最舊的 lot 開始刪除,
+或移到 retention_move_dir (保留原本的分層); 正在下載的 lot (持有下載租約) 不會被清理
+
+使用方式 (請在專案根目錄執行, 或使用打包後的 main.exe):
+  $ python main.py --retention --dry-run
+  $ python main.py --retention --max-age-days 14
+"""
+import os, re, time, shutil, argparse, threading
+from modules.cfg import ARCHIVE_COMPRESSIONS, forget_lot_dir, get_cfg, get_retention_cfg
+from modules.lease import DownloadLease
+from modules.log import write_log
+
+
+ARCHIVE_RE = re.compile(rf"^(.+)\.tar\.({'|'.join(ARCHIVE_COMPRESSIONS)})$")
+MONTH_SHARD_RE = re.compile(r"^\d{6}$")
+
+
+def is_lot_dir(path: str) -> bool:
+  """
+  判斷資料夾是 lot 資料夾還是分層資料夾: lot 資料夾中有 APC_{lot_id} 資料夾或檔案 (WO file、下載租約),
+  分層資料夾中只有 lot 資料夾與封存檔
+  """
+  name = os.path.basename(path.rstrip("\\/"))
+  if os.path.isdir(os.path.join(path, f"APC_{name}")):
+    return True
+  for entry in os.scandir(path):
+    if entry.is_file() and not ARCHIVE_RE.match(entry.name):
+      return True
+  return False
+
+
+def _entry_info(entry: os.DirEntry) -> dict:
+  """取得 lot 資料夾或封存檔的大小與最後變動時間 (資料夾本身、APC_ 資料夾與其中檔案的最大修改時間)"""
+  if entry.is_file():
+    st = entry.stat()
+    return {"size": st.st_size, "mtime": st.st_mtime}
+  size = 0
+  mtime = entry.stat().st_mtime
+  for root, dirs, files in os.walk(entry.path):
+    mtime = max(mtime, os.path.getmtime(root))
+    for name in files:
+      try:
+        size += os.path.getsize(os.path.join(root, name))
+      except OSError:
+        pass
+  return {"size": size, "mtime": mtime}
+
+
+def scan_lots(root: str) -> list:
+  """
+  列出 root (dl_basic_dir) 中所有格式的 lot 資料夾與封存檔
+
+  Returns:
+    list: 每個資料夾或封存檔一筆, 依最後變動時間由舊到新排列, 包含以下內容:
+      - lotId (str): 貨批號碼
+      - path (str): lot 資料夾或封存檔路徑
+      - archive (bool): 是否為封存檔
+      - shard (str | None): 所在的分層資料夾名稱, 未分層時為 None
+      - size (int): bytes
+      - mtime (float): 最後變動時間
+  """
+  items = []
+
+  def add(entry: os.DirEntry, shard: str | None):
+    match = ARCHIVE_RE.match(entry.name) if entry.is_file() else None
+    if entry.is_file() and not match:
+      return
+    try:
+      info = _entry_info(entry)
+    except OSError as e:
+      #掃描期間被其他工作站移除或封存
+      write_log(f"Retention skipped {entry.path}: {e}", "debug")
+      return
+    items.append({
+      "lotId": match.group(1) if match else entry.name, "path": entry.path, "archive": bool(match), "shard": shard, **info
+    })
+
+  for entry in os.scandir(root):
+    if entry.is_dir() and not is_lot_dir(entry.path):
+      for sub_entry in os.scandir(entry.path):
+        add(sub_entry, entry.name)
+    else:
+      add(entry, None)
+  items.sort(key=lambda item: item["mtime"])
+  return items
+
+
+def select_expired(items: list, max_age_days: float, max_size_gb: float, now: float | None = None) -> list:
+  """
+  依保留期限選出要清理的 lot: 超過 max_age_days 天沒有變動的全部清理, 之後總量仍超過 max_size_gb 時再由最舊的開始清理
+
+  Arguments:
+    items (list): scan_lots() 的結果, 由舊到新排列
+    max_age_days (float): 0 代表不限制
+    max_size_gb (float): 0 代表不限制
+  """
+  now = now or time.time()
+  cutoff = now - max_age_days * 86400 if max_age_days > 0 else None
+  max_bytes = max_size_gb * 1024 ** 3 if max_size_gb > 0 else None
+  total = sum(item["size"] for item in items)
+  expired = []
+  for item in items:
+    too_old = cutoff is not None and item["mtime"] < cutoff
+    too_big = max_bytes is not None and total > max_bytes
+    if not too_old and not too_big:
+      break
+    expired.append(item)
+    total -= item["size"]
+  return expired
+
+
+def remove_lot(item: dict, root: str, move_dir: str) -> bool:
+  """
+  刪除單一 lot 資料夾或封存檔, 或移到 move_dir; 正在下載 (其他工作站持有租約) 時略過
+
+  Returns:
+    bool: 是否已清理
+  """
+  lot_dir = os.path.join(os.path.dirname(item["path"]), item["lotId"]) if item["archive"] else item["path"]
+  #封存檔的 lot 資料夾不存在時沒有人在下載; 存在時與一般資料夾相同, 需取得租約
+  lease = DownloadLease(item["lotId"], lot_dir) if os.path.isdir(lot_dir) else None
+  if lease and not lease.try_acquire():
+    write_log(f"Retention skipped lot {item['lotId']}, it is being downloaded", "info")
+    return False
+  try:
+    if move_dir:
+      dst_path = os.path.join(move_dir, os.path.relpath(item["path"], root))
+      os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+      shutil.move(item["path"], dst_path)
+      #租約檔案跟著資料夾移動, 在目的資料夾中移除
+      if lease and not item["archive"]:
+        os.remove(os.path.join(dst_path, ".lease"))
+    elif item["archive"]:
+      os.remove(item["path"])
+    else:
+      shutil.rmtree(item["path"])
+    forget_lot_dir(item["lotId"])
+    return True
+  finally:
+    #資料夾移除或移動後租約檔案已不存在, 在此只停止 heartbeat
+    if lease:
+      lease.release()
+
+
+def apply_retention(root: str | None = None, max_age_days: float | None = None, max_size_gb: float | None = None,
+                    move_dir: str | None = None, dry_run: bool = False) -> dict:
+  """
+  依 cfg.json 的 retention_* 設定清理 dl_basic_dir 一次, 參數可覆寫對應的設定
+
+  Returns:
+    dict: 包含以下內容:
+      - scanned (int): lot 資料夾與封存檔的數量
+      - totalBytes (int): 清理前的總量
+      - expired (list): 符合清理條件的項目 (內容與 scan_lots() 相同)
+      - removed (int): 實際清理的數量, dry_run 時為 0
+      - freedBytes (int): 實際清理的 bytes
+      - emptyShards (int): 移除的空分層資料夾數量
+  """
+  retention_cfg = get_retention_cfg()
+  root = root or get_cfg()["dl_basic_dir"].strip()
+  max_age_days = retention_cfg["maxAgeDays"] if max_age_days is None else max_age_days
+  max_size_gb = retention_cfg["maxSizeGb"] if max_size_gb is None else max_size_gb
+  move_dir = retention_cfg["moveDir"] if move_dir is None else move_dir
+
+  t0 = time.perf_counter()
+  items = scan_lots(root)
+  expired = select_expired(items, max_age_days, max_size_gb)
+  result = {
+    "scanned": len(items), "totalBytes": sum(item["size"] for item in items), "expired": expired,
+    "removed": 0, "freedBytes": 0, "emptyShards": 0
+  }
+  if dry_run:
+    return result
+
+  for item in expired:
+    try:
+      if remove_lot(item, root, move_dir):
+        result["removed"] += 1
+        result["freedBytes"] += item["size"]
+        write_log(f"Retention {'moved' if move_dir else 'removed'} lot {item['lotId']}: {item['path']}", "info")
+    except OSError as e:
+      write_log(f"Retention of lot {item['lotId']} failed: {e}", "warning")
+
+  #清空的年月分層資料夾一併移除; 本月與 lot_id 前綴的分層資料夾隨時可能有新的 lot, 保留
+  current_month = time.strftime("%Y%m")
+  for shard in {item["shard"] for item in expired if item["shard"]}:
+    if not MONTH_SHARD_RE.match(shard) or shard >= current_month:
+      continue
+    shard_path = os.path.join(root, shard)
+    try:
+      if not os.listdir(shard_path):
+        os.rmdir(shard_path)
+        result["emptyShards"] += 1
+    except OSError:
+      pass
+
+  write_log(
+    f"Retention of {root}: {result['removed']} of {len(items)} lots {'moved' if move_dir else 'removed'}, "
+    f"{result['freedBytes'] / 1024 / 1024:.1f} of {result['totalBytes'] / 1024 / 1024:.1f} MB freed in {time.perf_counter() - t0:.1f}s",
+    "info"
+  )
+  return result
+
+
+class RetentionWatcher(threading.Thread):
+  """依 retention_interval_sec 在背景定期執行 apply_retention()"""
+
+  def __init__(self):
+    super().__init__(daemon=True)
+    self.retention_cfg = get_retention_cfg()
+    self._stop_event = threading.Event()
+
+
+  def stop(self):
+    """要求停止, 目前正在清理的 lot 會處理完才結束"""
+    self._stop_event.set()
+
+
+  def run(self):
+    write_log("Retention watcher started", "info")
+    #啟動後先等待一段時間 (最多 5 分鐘), 不與程式啟動時的其他工作搶 QNAP
+    delay = min(self.retention_cfg["interval"], 300)
+    while not self._stop_event.wait(delay):
+      try:
+        apply_retention()
+      except Exception as e:
+        write_log(f"Retention failed: {e}", "error")
+      delay = self.retention_cfg["interval"]
+    write_log("Retention watcher stopped", "info")
+
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(prog="main.py --retention", description="Remove or move old lot folders from dl_basic_dir")
+  parser.add_argument("--max-age-days", type=float, help="override retention_max_age_days")
+  parser.add_argument("--max-size-gb", type=float, help="override retention_max_size_gb")
+  parser.add_argument("--move-dir", help="override retention_move_dir, empty string deletes")
+  parser.add_argument("--dry-run", action="store_true", help="only list the lots that would be removed")
+  args = parser.parse_args(argv)
+
+  result = apply_retention(max_age_days=args.max_age_days, max_size_gb=args.max_size_gb, move_dir=args.move_dir, dry_run=args.dry_run)
+  if args.dry_run:
+    for item in result["expired"]:
+      print(f"{time.strftime('%Y-%m-%d', time.localtime(item['mtime']))} {item['size'] / 1024 / 1024:>9.1f} MB  {item['path']}")
+    print(f"{len(result['expired'])} of {result['scanned']} lots would be removed, "
+          f"{sum(item['size'] for item in result['expired']) / 1024 / 1024:.1f} of {result['totalBytes'] / 1024 / 1024:.1f} MB")
+  return 0
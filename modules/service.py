@@ -0,0 +1,206 @@
+import sys, time, threading, subprocess
+from multiprocessing.connection import Client, Listener
+from modules.cfg import get_prefetch_cfg, get_retention_cfg, get_service_cfg
+from modules.deadline import RunControl
+from modules.log import write_log
+from modules.pipeline import Pipeline, connect_pipeline
+from modules.prefetch import PrefetchWatcher
+from modules.retention import RetentionWatcher
+from modules.sinf import set_sftp_keep_alive
+from modules.xml import load_bin_table
+
+
+def parse_address(address: str) -> str | tuple:
+  """
+  將 cfg 中的服務位址轉成 multiprocessing.connection 可用的格式
+
+  Arguments:
+    address (str): "host:port" 或 Windows named pipe, 例如 "127.0.0.1:50866", "\\\\.\\pipe\\mapin"
+
+  Returns:
+    str | tuple: named pipe 字串, 或 (host, port)
+  """
+  if address.startswith("\\\\.\\pipe\\"):
+    return address
+  host, port = address.rsplit(":", 1)
+  return (host, int(port))
+
+
+def send_msg(conn, msg: dict):
+  """傳送訊息給 client, client 已斷線時忽略, 讓進行中的 job 繼續完成"""
+  try:
+    conn.send(msg)
+  except (OSError, EOFError):
+    pass
+
+
+def watch_cancel(conn, control: RunControl, done: threading.Event):
+  """job 執行期間接收 client 的 {"type": "cancel"}, job 結束 (done) 後停止, 讓 handle_client 繼續接收下一個請求"""
+  try:
+    while not done.is_set():
+      if conn.poll(0.1):
+        if conn.recv().get("type") == "cancel":
+          control.cancel()
+  except (EOFError, OSError):
+    pass
+
+
+def run_job(conn, lot_id: str, job_lock: threading.Lock):
+  """
+  在服務中執行單一 lot, 並將進度、log 與結果即時傳回 client
+  同一時間只處理一批, 因為 export 資料夾是共用的; 排隊期間與執行期間都可以被 client 取消
+  """
+  control = RunControl()
+  done = threading.Event()
+  watcher = threading.Thread(target=watch_cancel, args=(conn, control, done), daemon=True)
+  watcher.start()
+  try:
+    send_msg(conn, {"type": "log", "text": "Job queued on service"})
+    locked = False
+    while not locked and not control.is_cancelled():
+      locked = job_lock.acquire(timeout=0.1)
+    try:
+      #排隊期間被取消時, Pipeline 會在第一個檢查點停止並回傳取消訊息
+      pipeline = Pipeline(lot_id, control)
+      connect_pipeline(pipeline, lambda msg: send_msg(conn, msg))
+      pipeline.run()
+    finally:
+      if locked:
+        job_lock.release()
+  finally:
+    done.set()
+    watcher.join()
+  send_msg(conn, {"type": "done"})
+
+
+def handle_client(conn, job_lock: threading.Lock, stop_event: threading.Event):
+  """
+  處理單一 client 的請求, 支援以下訊息:
+    - {"type": "ping"}: 回覆 {"type": "pong"}
+    - {"type": "run", "lotId": str}: 執行 lot, 過程中回傳 progress / log / message / finished, 最後回傳 done;
+      執行期間可以傳送 {"type": "cancel"} 取消
+    - {"type": "shutdown"}: 停止服務
+  """
+  try:
+    while True:
+      request = conn.recv()
+      match request.get("type"):
+        case "ping":
+          send_msg(conn, {"type": "pong"})
+        case "run":
+          run_job(conn, request["lotId"], job_lock)
+        case "shutdown":
+          stop_event.set()
+          send_msg(conn, {"type": "done"})
+          return
+  except (EOFError, OSError):
+    pass
+  finally:
+    conn.close()
+
+
+def serve():
+  """
+  啟動常駐服務: 保留 SFTP 連線、WO 查詢結果與預先轉檔的結果, 接受 GUI 送來的 lot job
+  執行方式: python main.py --service (或 main.exe --service)
+  """
+  #bin 設定有誤時不啟動服務, 避免每批 lot 都在轉檔途中失敗
+  try:
+    load_bin_table()
+  except ValueError as e:
+    write_log(f"Invalid bin config in cfg.json: {e}", "error")
+    return
+
+  service_cfg = get_service_cfg()
+  address = parse_address(service_cfg["address"])
+  try:
+    listener = Listener(address, authkey=service_cfg["authkey"].encode())
+  except OSError as e:
+    write_log(f"Service already running or address unavailable: {service_cfg['address']}, {e}", "warning")
+    return
+
+  set_sftp_keep_alive(True)
+  prefetcher = None
+  if get_prefetch_cfg()["enabled"]:
+    prefetcher = PrefetchWatcher()
+    prefetcher.start()
+  retention = None
+  if get_retention_cfg()["enabled"]:
+    retention = RetentionWatcher()
+    retention.start()
+
+  write_log(f"Service listening on {service_cfg['address']}", "info")
+  job_lock = threading.Lock()
+  stop_event = threading.Event()
+  #另開執行緒接受連線, 主執行緒只負責等待停止訊號
+  def accept_loop():
+    while not stop_event.is_set():
+      try:
+        conn = listener.accept()
+      except Exception as e:
+        if stop_event.is_set():
+          break
+        write_log(f"Service rejected a connection: {e}", "warning")
+        continue
+      threading.Thread(target=handle_client, args=(conn, job_lock, stop_event), daemon=True).start()
+
+  threading.Thread(target=accept_loop, daemon=True).start()
+  try:
+    while not stop_event.wait(1):
+      pass
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if prefetcher:
+      prefetcher.stop()
+    if retention:
+      retention.stop()
+    listener.close()
+    set_sftp_keep_alive(False)
+    write_log("Service stopped", "info")
+
+
+def connect_service(spawn=True, timeout=15.0):
+  """
+  連線到常駐服務, 服務尚未啟動時會在背景啟動一個新的服務程序
+
+  Arguments:
+    spawn (bool): 連線失敗時是否要啟動服務
+    timeout (float): 等待服務啟動的秒數
+
+  Returns:
+    Connection | None: 連線成功回傳 connection, 失敗回傳 None
+  """
+  #bin 設定有誤時不啟動服務, 避免每批 lot 都在轉檔途中失敗
+  try:
+    load_bin_table()
+  except ValueError as e:
+    write_log(f"Invalid bin config in cfg.json: {e}", "error")
+    return
+
+  service_cfg = get_service_cfg()
+  address = parse_address(service_cfg["address"])
+  authkey = service_cfg["authkey"].encode()
+  try:
+    return Client(address, authkey=authkey)
+  except OSError:
+    if not spawn:
+      return None
+
+  #打包後的 main.exe 直接以自己啟動服務, 開發環境則以 python main.py 啟動
+  if getattr(sys, "frozen", False):
+    cmd = [sys.executable, "--service"]
+  else:
+    cmd = [sys.executable, "main.py", "--service"]
+  flags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+  subprocess.Popen(cmd, creationflags=flags)
+  write_log("Started background service", "info")
+
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    time.sleep(0.3)
+    try:
+      return Client(address, authkey=authkey)
+    except OSError:
+      continue
+  return None
@@ -0,0 +1,150 @@
+"""
+SFTP 傳輸設定 (sftp_profiles) 的下載速度量測
+
+以 cfg.json 中的帳號, 依序使用每個傳輸設定連線到 SFTP host, 將指定 lot 的 SINF map 下載到暫存資料夾 (不會寫入 dl_basic_dir),
+回報連線時間、協商結果 (加密演算法、壓縮) 與 MB/s, 作為選擇 sftp_profile 的依據
+每個檔案都在同一個 channel 上依序下載, 量測的是單一 channel 的速度; 實際下載時會再依 modules.concurrency 平行下載
+
+使用方式 (請在專案根目錄執行, 或使用打包後的 main.exe):
+  $ python main.py --bench-sftp AADZHS000
+  $ python main.py --bench-sftp AADZHS000 --profiles default,wan --repeat 5 --out sftp_bench.json
+"""
+import os, re, json, time, shutil, argparse, tempfile, statistics
+from modules.cfg import get_sftp_cfg, get_sftp_profile_names, get_sftp_transport_cfg, get_sinf_target_path
+from modules.log import write_log
+from modules.sftp_hosts import endpoint, rank_hosts
+from modules.sinf import SftpConnection
+
+
+def measure_once(profile: str, lot_id: str, host: str, port: int) -> dict:
+  """
+  以單一傳輸設定連線並下載 lot 的 SINF map 一次, 下載的檔案會立即刪除
+
+  Returns:
+    dict: 包含以下內容:
+      - profile (str): 傳輸設定名稱
+      - host (str): "host:port"
+      - cipher (str): 協商後的加密演算法
+      - compression (str): 協商後的壓縮方式, "none" 代表沒有壓縮
+      - fileCnt (int): 下載的檔案數量
+      - bytes (int): 下載的總 bytes
+      - connectSeconds (float): 建立連線的秒數
+      - mbPerSec (float): 下載速度 (MB/s)
+      - error (str | None): 失敗原因
+  """
+  sftp_cfg = get_sftp_cfg()
+  result = {
+    "profile": profile, "host": endpoint(host, port), "cipher": None, "compression": None,
+    "fileCnt": 0, "bytes": 0, "connectSeconds": 0.0, "mbPerSec": 0.0, "error": None
+  }
+  remote_folder = os.path.join(get_sinf_target_path(), f"APC_{lot_id}")
+  valid_pattern = re.compile(rf"^{re.escape(lot_id)}\.\d{{2}}$")
+  sftp = SftpConnection(host, port, sftp_cfg["user"], sftp_cfg["pwd"], sftp_cfg["timeout"], get_sftp_transport_cfg(profile))
+  t0 = time.perf_counter()
+  if sftp.connect() == "ConnectionError":
+    result["error"] = "ConnectionError"
+    return result
+  result["connectSeconds"] = time.perf_counter() - t0
+  tmp_dir = tempfile.mkdtemp(prefix="mapin_sftp_bench_")
+  try:
+    result["cipher"] = sftp.transport.remote_cipher
+    result["compression"] = sftp.transport.remote_compression
+    file_attrs = [f for f in sftp.listdir_attr(remote_folder) if valid_pattern.match(f.filename)]
+    if not file_attrs:
+      result["error"] = "SinfNotFoundError"
+      return result
+    t0 = time.perf_counter()
+    for file_attr in file_attrs:
+      local_file = os.path.join(tmp_dir, file_attr.filename)
+      sftp.get(os.path.join(remote_folder, file_attr.filename), local_file)
+      os.remove(local_file)
+    seconds = time.perf_counter() - t0
+    result["fileCnt"] = len(file_attrs)
+    result["bytes"] = sum(f.st_size or 0 for f in file_attrs)
+    result["mbPerSec"] = result["bytes"] / 1024 / 1024 / seconds if seconds else 0.0
+  except Exception as e:
+    result["error"] = str(e)
+  finally:
+    sftp.close()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+  return result
+
+
+def benchmark_profiles(lot_id: str, profiles: list | None = None, repeat: int = 3, host: tuple | None = None) -> list:
+  """
+  量測多個傳輸設定的下載速度; 每一輪每個設定各下載一次, 共 repeat 輪, 避免某個設定剛好遇到網路尖峰
+
+  Arguments:
+    lot_id (str): 用來下載的貨批號碼, SFTP 上需有其 APC_{lot_id} 資料夾
+    profiles (list): 傳輸設定名稱, 未指定時量測 sftp_profiles 中的全部設定
+    repeat (int): 每個設定下載的次數
+    host (tuple): (host, port), 未指定時使用 modules.sftp_hosts 排序後最快的 host
+
+  Returns:
+    list: 每個設定一筆, 內容與 measure_once() 相同, 但 connectSeconds 與 mbPerSec 為成功各次的中位數,
+      另外包含 bestMbPerSec (最快一次的 MB/s); 依 mbPerSec 由快到慢排列, 全部失敗時 error 為最後一次的失敗原因
+  """
+  profiles = profiles or get_sftp_profile_names()
+  host, port = host or rank_hosts()[0]
+  runs = {profile: [] for profile in profiles}
+  for _ in range(repeat):
+    for profile in profiles:
+      runs[profile].append(measure_once(profile, lot_id, host, port))
+
+  results = []
+  for profile, items in runs.items():
+    ok_items = [item for item in items if not item["error"]]
+    if not ok_items:
+      results.append({**items[-1], "bestMbPerSec": 0.0})
+      continue
+    results.append({
+      **ok_items[-1],
+      "connectSeconds": statistics.median(item["connectSeconds"] for item in ok_items),
+      "mbPerSec": statistics.median(item["mbPerSec"] for item in ok_items),
+      "bestMbPerSec": max(item["mbPerSec"] for item in ok_items)
+    })
+  return sorted(results, key=lambda item: item["mbPerSec"], reverse=True)
+
+
+def format_results(results: list) -> list:
+  """將量測結果轉為文字表格的每一行"""
+  lines = [f"{'profile':<12} {'MB/s':>8} {'best':>8} {'connect':>8}  {'cipher':<24} {'compression':<18} files"]
+  for item in results:
+    if item["error"]:
+      lines.append(f"{item['profile']:<12} failed: {item['error']}")
+      continue
+    lines.append(
+      f"{item['profile']:<12} {item['mbPerSec']:>8.2f} {item['bestMbPerSec']:>8.2f} {item['connectSeconds']:>7.2f}s  "
+      f"{item['cipher'] or '':<24} {item['compression'] or '':<18} {item['fileCnt']} ({item['bytes'] / 1024 / 1024:.2f} MB)"
+    )
+  return lines
+
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(prog="main.py --bench-sftp", description="Measure SFTP download throughput for each transport profile in cfg.json")
+  parser.add_argument("lot_id", help="lot whose SINF maps are downloaded to a temporary folder")
+  parser.add_argument("--profiles", help="comma separated profile names, default: all sftp_profiles")
+  parser.add_argument("--repeat", type=int, default=3, help="downloads per profile, the median is reported")
+  parser.add_argument("--host", help="host:port to measure, default: the fastest healthy host")
+  parser.add_argument("--out", help="write the results as JSON to this path")
+  args = parser.parse_args(argv)
+
+  profiles = [p.strip() for p in args.profiles.split(",") if p.strip()] if args.profiles else None
+  unknown = [p for p in profiles or [] if p not in get_sftp_profile_names()]
+  if unknown:
+    parser.error(f"unknown profiles: {', '.join(unknown)}")
+  host = None
+  if args.host:
+    host_name, _, host_port = args.host.partition(":")
+    host = (host_name, int(host_port) if host_port else get_sftp_cfg()["port"])
+
+  results = benchmark_profiles(args.lot_id, profiles, max(args.repeat, 1), host)
+  #write_log() 同時會印在命令列上
+  header = f"SFTP benchmark: lot {args.lot_id} on {results[0]['host'] if results else '-'}, {max(args.repeat, 1)} runs per profile"
+  write_log("\n".join([header] + format_results(results)), "info")
+
+  if args.out:
+    with open(args.out, "w", encoding="utf-8") as f:
+      json.dump(results, f, indent=2)
+    print(f"Saved results: {args.out}")
+  return 0 if any(not item["error"] for item in results) else 1
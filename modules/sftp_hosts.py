@@ -0,0 +1,121 @@
+import time, socket, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from modules.cfg import get_sftp_cfg, get_sftp_failover_cfg
+from modules.ledger import load_host_health, save_host_health
+from modules.log import write_log
+
+
+#各 SFTP host 的健康狀態, key 為 "host:port"; 第一次使用時由執行紀錄 (modules.ledger) 讀取, 每次變動都會寫回
+_health = None
+_health_lock = threading.Lock()
+#連線延遲以指數移動平均計算, 避免單次網路抖動就改變選擇
+LATENCY_WEIGHT = 0.3
+
+
+def endpoint(host: str, port: int) -> str:
+  """組成 "host:port" 字串, 用於健康狀態的 key 與 log"""
+  return f"{host}:{port}"
+
+
+def get_host_health() -> dict:
+  """取得各 SFTP host 的健康狀態, 格式見 modules.ledger.load_host_health()"""
+  global _health
+  with _health_lock:
+    if _health is None:
+      _health = load_host_health()
+    return _health
+
+
+def mark_host(host: str, port: int, latency_ms: float | None = None, error: str | None = None):
+  """
+  更新單一 SFTP host 的健康狀態並寫回執行紀錄
+
+  Arguments:
+    host (str): SFTP host
+    port (int): SFTP port
+    latency_ms (float): 量測到的連線延遲 (毫秒), 沒有量測時為 None
+    error (str): 失敗原因, 例如 "connect failed", "transfer stalled"; 成功時為 None
+  """
+  key = endpoint(host, port)
+  health = get_host_health()
+  with _health_lock:
+    item = health.setdefault(key, {"latencyMs": None, "failures": 0, "lastOk": None, "lastFailure": None, "lastError": None})
+    if error:
+      item["failures"] += 1
+      item["lastFailure"] = time.time()
+      item["lastError"] = error
+    else:
+      item["failures"] = 0
+      item["lastOk"] = time.time()
+      if latency_ms is not None:
+        prev = item["latencyMs"]
+        item["latencyMs"] = latency_ms if prev is None else prev + LATENCY_WEIGHT * (latency_ms - prev)
+    snapshot = dict(item)
+  if error:
+    write_log(f"SFTP host {key} marked unhealthy ({error}, {snapshot['failures']} consecutive failures)", "warning")
+  save_host_health(key, snapshot)
+
+
+def is_healthy(host: str, port: int) -> bool:
+  """host 最近一次是否成功, 或上次失敗已超過 cooldown 秒數"""
+  item = get_host_health().get(endpoint(host, port))
+  if not item or not item["failures"]:
+    return True
+  return time.time() - (item["lastFailure"] or 0) > get_sftp_failover_cfg()["cooldown"]
+
+
+def probe_latency(host: str, port: int, timeout: float) -> float | None:
+  """
+  量測建立 TCP 連線所需的時間 (不登入)
+
+  Returns:
+    float: 連線延遲 (毫秒)
+    None: 無法連線或逾時
+  """
+  t0 = time.perf_counter()
+  try:
+    with socket.create_connection((host, port), timeout=timeout):
+      return (time.perf_counter() - t0) * 1000
+  except OSError:
+    return None
+
+
+def rank_hosts(exclude=()) -> list:
+  """
+  依健康狀態與連線延遲排序 cfg.json 中的 SFTP host, 健康且延遲最低的排在最前面
+  設定多個 host 時會先平行量測各 host 的連線延遲; 仍在 cooldown 中的 host 不會量測, 直接排在最後
+
+  Arguments:
+    exclude (iterable): 要排除的 "host:port", 例如本批已經失敗的 host
+
+  Returns:
+    list: [(host, port), ...]
+  """
+  hosts = [h for h in get_sftp_cfg()["hosts"] if endpoint(*h) not in exclude]
+  if len(hosts) > 1:
+    probe_timeout = get_sftp_failover_cfg()["probeTimeout"]
+    candidates = [h for h in hosts if is_healthy(*h)]
+    with ThreadPoolExecutor(max_workers=len(candidates) or 1, thread_name_prefix="sftp-probe") as pool:
+      futures = {pool.submit(probe_latency, host, port, probe_timeout): (host, port) for host, port in candidates}
+      wait(futures)
+    for future, (host, port) in futures.items():
+      latency_ms = future.result()
+      if latency_ms is None:
+        mark_host(host, port, error="probe failed")
+      else:
+        mark_host(host, port, latency_ms)
+
+  health = get_host_health()
+  def sort_key(item):
+    idx, (host, port) = item
+    latency_ms = (health.get(endpoint(host, port)) or {}).get("latencyMs")
+    return (not is_healthy(host, port), latency_ms if latency_ms is not None else float("inf"), idx)
+  ranked = [h for _, h in sorted(enumerate(hosts), key=sort_key)]
+
+  if len(ranked) > 1:
+    summary = ", ".join(
+      f"{endpoint(*h)} {(health.get(endpoint(*h)) or {}).get('latencyMs') or 0:.1f}ms{'' if is_healthy(*h) else ' (cooldown)'}"
+      for h in ranked
+    )
+    write_log(f"SFTP hosts ranked: {summary}", "info")
+  return ranked
@@ -1,32 +1,68 @@
-import os, re
-import paramiko
+import os, re, time, socket, threading
+from concurrent.futures import ThreadPoolExecutor
 from stat import S_ISREG
-from modules.cfg import get_sftp_cfg, get_sinf_dl_path, get_sinf_target_path
+from modules.archive import restore_lot
+from modules.cfg import get_sftp_cfg, get_sinf_dl_path, get_sinf_target_path, get_wo_dl_path
+from modules.concurrency import get_limit
+from modules.deadline import PipelineCancelled
+from modules.integrity import DigestWriter, IntegrityError, check_written, read_manifest, update_manifest
 from modules.log import write_log
+from modules.sftp_hosts import endpoint, mark_host, rank_hosts
 
 
 class SftpConnection:
-  def __init__(self, host: str, port: int, user: str, pwd: str):
+  def __init__(self, host: str, port: int, user: str, pwd: str, timeout: float | None = None, transport_cfg: dict | None = None):
     self.host = host
     self.port = port
     self.user = user
     self.pwd = pwd
+    self.timeout = timeout
+    self.transport_cfg = transport_cfg or {}  #傳輸設定, 見 modules.cfg.get_sftp_transport_cfg()
     self.sftp = None
     self.transport = None
 
 
   def connect(self):
     """建立 SFTP 連線"""
+    #延遲載入 paramiko, 縮短程式啟動時間
+    import paramiko
     try:
-      self.transport = paramiko.Transport((self.host, self.port))
+      #連線與每次讀取都設定逾時, SFTP 停止回應時會拋出 socket.timeout 而不是無限等待
+      sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+      #依傳輸設定調整 window / 封包大小、壓縮與加密演算法的優先順序, 未設定的部分使用 paramiko 預設值
+      transport_kwargs = {}
+      if self.transport_cfg.get("windowSize"):
+        transport_kwargs["default_window_size"] = self.transport_cfg["windowSize"]
+      if self.transport_cfg.get("maxPacketSize"):
+        transport_kwargs["default_max_packet_size"] = self.transport_cfg["maxPacketSize"]
+      self.transport = paramiko.Transport(sock, **transport_kwargs)
+      self.transport.use_compression(self.transport_cfg.get("compression", False))
+      if self.transport_cfg.get("ciphers"):
+        options = self.transport.get_security_options()
+        supported = list(options.ciphers)
+        preferred = [c for c in self.transport_cfg["ciphers"] if c in supported]
+        options.ciphers = preferred + [c for c in supported if c not in preferred]
       self.transport.connect(username=self.user, password=self.pwd)
       self.sftp = paramiko.SFTPClient.from_transport(self.transport)
-      write_log("SFTP connection established", "success")
+      self.sftp.get_channel().settimeout(self.timeout)
+      write_log(f"SFTP connection established: {self.host}:{self.port}", "success")
     except Exception as e:
       write_log(f"Failed to connect to SFTP server: {e}", "error")
       return "ConnectionError"
 
 
+  def open_channel(self) -> "SftpConnection":
+    """
+    在同一條連線上開啟另一個 SFTP channel, 用於平行下載
+    回傳的物件只擁有 channel, 關閉時不會中斷原本的連線
+    """
+    import paramiko
+    channel = SftpConnection(self.host, self.port, self.user, self.pwd, self.timeout, self.transport_cfg)
+    channel.sftp = paramiko.SFTPClient.from_transport(self.transport)
+    channel.sftp.get_channel().settimeout(self.timeout)
+    return channel
+
+
   def close(self):
     """關閉 SFTP 連線"""
     if self.sftp:
@@ -52,23 +88,179 @@ class SftpConnection:
       raise Exception("SFTP connection not established")
 
 
-  def get(self, remote_path, local_path):
+  def get(self, remote_path, local_path, callback=None, cancel_check=None) -> dict:
     """
     下載遠端檔案到本地
-    此為二次包裝 paramiko.SFTPClient.get()
+    與 paramiko.SFTPClient.get() 相同, 但會另外計算寫入本地檔案所花的時間 (用來區分 SFTP 慢還是本地 / QNAP 寫入慢),
+    並在寫入時計算 SHA-256; 寫入的大小與遠端不一致時拋出 IntegrityError, 不會留下檔案
+
+    Arguments:
+      remote_path (str): 遠端檔案路徑
+      local_path (str): 本地檔案路徑
+      callback (function): 傳輸進度回呼, 參數為 (已傳輸 bytes, 檔案總 bytes), 與 paramiko 相同
+      cancel_check (function): 每收到一段資料時呼叫, 已取消或逾時時應拋出例外, 傳輸會停止且不會留下暫存檔
+
+    Returns:
+      dict: 包含以下內容:
+        - writeSeconds (float): 寫入本地檔案所花的秒數
+        - bytes (int): 下載的 bytes
+        - sha256 (str): 下載內容的 SHA-256 (hex)
     """
-    if self.sftp:
-      self.sftp.get(remote_path, local_path)
-    else:
+    if not self.sftp:
       raise Exception("SFTP connection not established")
+    #先寫入 .part 暫存檔, 完成後才改名, 中斷時不會留下不完整的 SINF map
+    part_path = f"{local_path}.part"
+    on_chunk = callback
+    if cancel_check:
+      def on_chunk(curr, size):
+        cancel_check()
+        if callback:
+          callback(curr, size)
+    try:
+      with open(part_path, "wb") as f:
+        writer = DigestWriter(f)
+        size = self.sftp.getfo(
+          remote_path, writer, on_chunk,
+          prefetch=self.transport_cfg.get("prefetch", True),
+          max_concurrent_prefetch_requests=self.transport_cfg.get("maxPrefetchRequests")
+        )
+      #與 paramiko.SFTPClient.get() 相同, 檢查下載的大小是否與遠端一致; 另外確認經過 SHA-256 計算與寫入磁碟的大小也相同
+      remote_size = self.sftp.stat(remote_path).st_size
+      digest = writer.digest()
+      if size != remote_size or digest["bytes"] != remote_size:
+        raise IntegrityError(f"size mismatch in get!  {size} (hashed {digest['bytes']}) != {remote_size}")
+      check_written(part_path, digest)
+      os.replace(part_path, local_path)
+    except BaseException:
+      try:
+        os.remove(part_path)
+      except OSError:
+        pass
+      raise
+    return {"writeSeconds": writer.seconds, **digest}
+
+
+#閒置中的 SFTP 連線, 僅在 keep alive 模式 (例如常駐服務) 下使用
+_idle_sftp = []
+_idle_lock = threading.Lock()
+_keep_alive = False
+
+
+def set_sftp_keep_alive(enabled: bool):
+  """
+  設定是否保留 SFTP 連線供下次使用
+  GUI 單次執行時不需要保留; 常駐服務 (modules.service) 會啟用, 省去每批重新建立連線的時間
+  """
+  global _keep_alive
+  _keep_alive = enabled
+  if not enabled:
+    with _idle_lock:
+      while _idle_sftp:
+        _idle_sftp.pop().close()
+
 
+def acquire_sftp(exclude=()) -> SftpConnection:
+  """
+  取得 SFTP 連線, 如果有仍在連線中的閒置連線則直接使用, 否則依 modules.sftp_hosts 的排序建立新連線
+  最快的 host 連線失敗時會改用下一個 host; 全部失敗時回傳未連線的 SftpConnection (sftp 屬性為 None)
+
+  Arguments:
+    exclude (iterable): 不使用的 "host:port", 例如傳輸停滯而要切換掉的 host
+  """
+  with _idle_lock:
+    while _idle_sftp:
+      sftp = _idle_sftp.pop()
+      if sftp.transport and sftp.transport.is_active() and endpoint(sftp.host, sftp.port) not in exclude:
+        return sftp
+      sftp.close()
+  sftp_cfg = get_sftp_cfg()
+  sftp = None
+  for host, port in rank_hosts(exclude):
+    sftp = SftpConnection(host, port, sftp_cfg["user"], sftp_cfg["pwd"], sftp_cfg["timeout"], sftp_cfg["transport"])
+    if sftp.connect() != "ConnectionError":
+      mark_host(host, port)
+      return sftp
+    mark_host(host, port, error="connect failed")
+  return sftp or SftpConnection(sftp_cfg["host"], sftp_cfg["port"], sftp_cfg["user"], sftp_cfg["pwd"], sftp_cfg["timeout"], sftp_cfg["transport"])
+
+
+def release_sftp(sftp: SftpConnection, reusable=True):
+  """
+  歸還 SFTP 連線; keep alive 模式下保留仍在連線中的連線, 否則關閉
+
+  Arguments:
+    sftp (SftpConnection): 要歸還的連線
+    reusable (bool): 連線過程中是否正常, 發生錯誤的連線一律關閉
+  """
+  if _keep_alive and reusable and sftp.transport and sftp.transport.is_active():
+    with _idle_lock:
+      _idle_sftp.append(sftp)
+  else:
+    sftp.close()
 
-def download_sinf_map(lot_id: str) -> str:
+
+def is_same_file(local_file: str, file_attr) -> bool:
+  """
+  檢查本地檔案是否與遠端檔案相同 (大小與修改時間皆一致)
+
+  Arguments:
+    local_file (str): 本地檔案路徑
+    file_attr (paramiko.SFTPAttributes): 遠端檔案屬性, 來自 listdir_attr()
+  """
+  if file_attr.st_mtime is None:
+    return False
+  try:
+    st = os.stat(local_file)
+  except OSError:
+    return False
+  return st.st_size == file_attr.st_size and int(st.st_mtime) == int(file_attr.st_mtime)
+
+
+def new_transfer_stats() -> dict:
+  """
+  建立 SFTP 傳輸統計的初始內容, 由 download_sinf_map() 填入
+
+  Returns:
+    dict: 包含以下內容:
+      - listSeconds (float): listdir_attr() 所花的秒數
+      - fileCnt (int): 實際下載的檔案數量
+      - skippedCnt (int): 本地已有相同檔案而略過的數量
+      - bytes (int): 下載的總 bytes
+      - seconds (float): 下載實際經過的秒數 (平行下載時不是各檔案秒數的總和)
+      - writeSeconds (float): 各檔案寫入本地檔案所花的秒數總和
+      - mbPerSec (float): 平均下載速度 (MB/s)
+      - files (list): 每個檔案的 {"name", "bytes", "seconds", "writeSeconds", "sha256"}
+      - hosts (list): 下載時使用的 SFTP host ("host:port"), 中途切換 host 時會有多筆
+  """
+  return {"hosts": [], "listSeconds": 0.0, "fileCnt": 0, "skippedCnt": 0, "bytes": 0, "seconds": 0.0, "writeSeconds": 0.0, "mbPerSec": 0.0, "files": []}
+
+
+def format_transfer_stats(stats: dict) -> str:
+  """將傳輸統計轉成一行文字, 用於 log 與 GUI"""
+  slowest = max(stats["files"], key=lambda f: f["seconds"], default=None)
+  text = (
+    f"{' -> '.join(stats['hosts']) or 'SFTP'}: listdir {stats['listSeconds']:.3f}s, downloaded {stats['fileCnt']} files "
+    f"({stats['bytes'] / 1024 / 1024:.2f} MB) in {stats['seconds']:.2f}s, {stats['mbPerSec']:.2f} MB/s, "
+    f"local write {stats['writeSeconds']:.2f}s, skipped {stats['skippedCnt']} unchanged"
+  )
+  if slowest:
+    text += f", slowest {slowest['name']} {slowest['seconds']:.3f}s"
+  return text
+
+
+def download_sinf_map(lot_id: str, progress_cb=None, stats: dict | None = None, on_file=None, cancel_check=None) -> str:
   """
   依照 lot_id 從 SFTP server 下載對應的 SINF map file
+  會在同一條連線上開啟多個 SFTP channel 平行下載, channel 數量由 modules.concurrency 依吞吐量與錯誤率自動調整
 
   Arguments:
     lot_id (str): 貨批號碼, 例如 "AADZHS000"
+    progress_cb (function): 下載進度回呼, 參數為 (已下載 bytes, 需下載的總 bytes)
+    stats (dict): 傳輸統計, 由 new_transfer_stats() 建立, 會在下載過程中更新
+    on_file (function): 檔案可以讀取時的回呼, 參數為 (檔名, sha256); 依檔名順序呼叫, 前面的檔案還在下載時會等待其完成,
+      讓轉檔 (modules.stream) 可以在下載期間依序處理已完成的檔案; sha256 為下載時計算的值, 沒有變動而略過的檔案為 SHA256SUMS 中的記錄 (沒有記錄時為 None)
+    cancel_check (function): 每次嘗試、每個檔案開始前與每收到一段資料時呼叫, 已取消或逾時時應拋出 PipelineCancelled;
+      呼叫端不再等待 (例如超過期限) 時, 下載的 thread 會在下一個檢查點停止, 不會繼續寫入 dl_path
 
   Returns:
     str: 下載成功, 會回傳下載的資料夾路徑 (dl_path)
@@ -77,51 +269,204 @@ def download_sinf_map(lot_id: str) -> str:
     "SinfDownloadError": 下載失敗, 其他錯誤
   """
 
+  sftp = None
+  reusable = True
+  pool = None
+  channels = []
+  failed_hosts = set()
+
+  def failover(reason: str) -> bool:
+    """
+    將目前的 host 標記為異常, 關閉其連線並改用下一個 host; 沒有其他 host 可用時 (例如只設定一個 host) 重新連線到原本的 host
+    重新連線也失敗時 sftp 會設為 None, 由呼叫端計入嘗試次數後再以 reconnect() 重試
+
+    Returns:
+      bool: 是否已取得可用的連線
+    """
+    nonlocal sftp
+    old_host = endpoint(sftp.host, sftp.port)
+    mark_host(sftp.host, sftp.port, error=reason)
+    failed_hosts.add(old_host)
+    for channel in channels:
+      channel.close()
+    channels.clear()
+    release_sftp(sftp, reusable=False)
+    sftp = acquire_sftp(exclude=failed_hosts)
+    if sftp.sftp is None:
+      sftp = None
+      return reconnect(f"{reason} on {old_host}")
+    write_log(f"SFTP failover: {old_host} -> {endpoint(sftp.host, sftp.port)}", "warning")
+    if stats is not None:
+      stats["hosts"].append(endpoint(sftp.host, sftp.port))
+    return True
+
+  def reconnect(reason: str) -> bool:
+    """沒有其他 host 可以切換時, 依排序重新連線到設定的 host (包含剛失敗的 host), 回傳是否成功"""
+    nonlocal sftp
+    failed_hosts.clear()
+    sftp = acquire_sftp()
+    if sftp.sftp is None:
+      sftp = None
+      write_log(f"SFTP reconnect failed ({reason})", "warning")
+      return False
+    write_log(f"SFTP reconnected to {endpoint(sftp.host, sftp.port)} ({reason})", "warning")
+    if stats is not None:
+      stats["hosts"].append(endpoint(sftp.host, sftp.port))
+    return True
+
   try:
     folder_name = f"APC_{lot_id}"
 
-    #1. 建立 SFTP 連線
-    sftp_cfg = get_sftp_cfg()
-    sftp_addr = sftp_cfg["host"]
-    sftp_port = sftp_cfg["port"]
-    sftp_user = sftp_cfg["user"]
-    sftp_pwd = sftp_cfg["pwd"]
-    sftp = SftpConnection(sftp_addr, sftp_port, sftp_user, sftp_pwd)
-    sftp.connect()
-
-    #2. 列出遠端資料夾下的目標檔案
-    try:
-      target_path = get_sinf_target_path()
-      remote_folder = os.path.join(target_path, folder_name)
-      file_attrs = sftp.listdir_attr(remote_folder)
-    except (IOError, FileNotFoundError, OSError) as e:
-      #如果 lot_id 對應的資料夾中沒有 SINF file, 回傳 SinfNotFoundError
-      write_log(f"Remote folder not found: {remote_folder}", "warning")
-      return "SinfNotFoundError"
+    #1. 建立 SFTP 連線 (keep alive 模式下會沿用閒置中的連線), 設定多個 host 時會選擇延遲最低且正常的 host
+    sftp = acquire_sftp()
+    if stats is not None:
+      stats["hosts"].append(endpoint(sftp.host, sftp.port))
+
+    #2. 列出遠端資料夾下的目標檔案, 逾時 (host 停止回應) 時改用其他 host 或重新連線, 最多嘗試 3 次
+    target_path = get_sinf_target_path()
+    remote_folder = os.path.join(target_path, folder_name)
+    list_attempt = 0
+    while True:
+      if list_attempt == 3:
+        return "DownloadTooManyTimes"
+      if sftp is None and not reconnect("listdir retry"):
+        list_attempt += 1
+        continue
+      try:
+        t0 = time.perf_counter()
+        file_attrs = sftp.listdir_attr(remote_folder)
+        if stats is not None:
+          stats["listSeconds"] += time.perf_counter() - t0
+        break
+      except TimeoutError:
+        list_attempt += 1
+        write_log(f"Listing {remote_folder} timed out (Attempt {list_attempt})", "warning")
+        failover("listdir timed out")
+      except (IOError, FileNotFoundError, OSError) as e:
+        #如果 lot_id 對應的資料夾中沒有 SINF file, 回傳 SinfNotFoundError
+        write_log(f"Remote folder not found: {remote_folder}", "warning")
+        return "SinfNotFoundError"
 
     #3. 只處理 {lot_id}.nn 的檔案 (例如 AADZHS000.01, AADZHS000.09)
     valid_pattern = re.compile(rf"^{lot_id}\.\d{{2}}$")
-    valid_attrs = [f for f in file_attrs if valid_pattern.match(f.filename)]
+    valid_attrs = sorted((f for f in file_attrs if valid_pattern.match(f.filename)), key=lambda f: f.filename)
 
-    #4: 組裝下載資料夾路徑, 並建立資料夾 APC_{lot_id}
+    #4: 組裝下載資料夾路徑, 並建立資料夾 APC_{lot_id}; 已封存的 lot 先解壓縮, 沒有變動的檔案就不需要重新下載
     dl_path = get_sinf_dl_path(lot_id, folder_name)
+    restore_lot(lot_id)
     os.makedirs(dl_path, exist_ok=True)
 
-    #5. 開始下載
+    #5. 開始下載, 每個下載 thread 各自開啟一個 SFTP channel
+    limiter = get_limit("sftp")
+    pool = ThreadPoolExecutor(max_workers=limiter.max, thread_name_prefix="sinf-dl")
+    thread_local = threading.local()
+    progress_lock = threading.Lock()
+    stalled = threading.Event()  #本次嘗試是否有傳輸逾時 (停滯)
     download_attempt = 0  #記錄嘗試下載次數
     downloaded_files = [] #記錄已下載的檔案
-
+    ready_files = {}      #已可讀取的檔案與其 sha256, 跨多次嘗試保留
+    file_order = [f.filename for f in valid_attrs if S_ISREG(f.st_mode)]
+    emitted_cnt = 0
+
+    def emit_ready(filename: str, sha256: str | None):
+      """記錄檔案已可讀取, 並依檔名順序將前面都已完成的檔案交給 on_file"""
+      nonlocal emitted_cnt
+      ready_files[filename] = sha256
+      while on_file and emitted_cnt < len(file_order) and file_order[emitted_cnt] in ready_files:
+        on_file(file_order[emitted_cnt], ready_files[file_order[emitted_cnt]])
+        emitted_cnt += 1
+
+    def fetch(file_attr, total_bytes: int, progress: dict) -> tuple | None:
+      """下載單一檔案, 回傳 (檔案屬性, 秒數, SftpConnection.get() 的結果); 傳輸失敗或大小不一致時回傳 None, 由下一次嘗試重新下載"""
+      import paramiko
+      with limiter.slot():
+        if cancel_check:
+          cancel_check()
+        #切換 host 後, 需在新的連線上重新開啟 channel
+        if getattr(thread_local, "parent", None) is not sftp:
+          thread_local.sftp = sftp.open_channel()
+          thread_local.parent = sftp
+          with progress_lock:
+            channels.append(thread_local.sftp)
+        remote_file = os.path.join(remote_folder, file_attr.filename)
+        local_file = os.path.join(dl_path, file_attr.filename)
+        callback = None
+        if progress_cb:
+          def callback(curr, size):
+            with progress_lock:
+              progress[file_attr.filename] = curr
+              progress_cb(sum(progress.values()), total_bytes)
+        t0 = time.perf_counter()
+        try:
+          transfer = thread_local.sftp.get(remote_file, local_file, callback, cancel_check)
+        except (OSError, EOFError, paramiko.SSHException) as e:
+          if isinstance(e, TimeoutError):
+            stalled.set()
+          limiter.record(0, ok=False)
+          write_log(f"Download SINF file {file_attr.filename} failed: {e}", "warning")
+          return None
+        seconds = time.perf_counter() - t0
+        limiter.record(file_attr.st_size or 0)
+      #保留遠端的修改時間, 供下次比對是否有變更
+      if file_attr.st_mtime is not None:
+        os.utime(local_file, (file_attr.st_atime or file_attr.st_mtime, file_attr.st_mtime))
+      write_log(f"Downloaded SINF file: {file_attr.filename}, {file_attr.st_size or 0} bytes in {seconds:.3f}s", "debug")
+      return file_attr, seconds, transfer
+
+    digests = {}  #本次下載的檔案的 SHA-256, 完成後寫入 lot 資料夾的 SHA256SUMS (路徑相對於 lot 資料夾, 可用 sha256sum -c 檢查)
+    known_digests = read_manifest(get_wo_dl_path(lot_id)) if on_file else {}  #之前下載時記錄的 SHA-256, 略過的檔案交給 on_file 時使用
     #最多嘗試下載 3 次
     while download_attempt < 3:
+      if cancel_check:
+        cancel_check()
       downloaded_files.clear()  #清空已下載檔案列表
 
+      #上一次嘗試後重新連線失敗, 本次先重新連線; 仍失敗時計入嘗試次數
+      if sftp is None and not reconnect("download retry"):
+        download_attempt += 1
+        write_log(f"SFTP unavailable, retrying... (Attempt {download_attempt})", "warning")
+        continue
+
+      #本地已有相同大小與修改時間的檔案 (例如已被預先下載), 不需要重新下載
+      pending_attrs = []
       for file_attr in valid_attrs:
         if S_ISREG(file_attr.st_mode):
-          remote_file = os.path.join(remote_folder, file_attr.filename)
-          local_file = os.path.join(dl_path, file_attr.filename)
-          sftp.get(remote_file, local_file)
-          downloaded_files.append(file_attr.filename)
-          write_log(f"Downloaded SINF file: {file_attr.filename}", "debug")
+          if is_same_file(os.path.join(dl_path, file_attr.filename), file_attr):
+            downloaded_files.append(file_attr.filename)
+            emit_ready(file_attr.filename, known_digests.get(f"{folder_name}/{file_attr.filename}"))
+            if stats is not None:
+              stats["skippedCnt"] += 1
+            write_log(f"Skipped unchanged SINF file: {file_attr.filename}", "debug")
+          else:
+            pending_attrs.append(file_attr)
+
+      total_bytes = sum(f.st_size or 0 for f in pending_attrs)
+      progress = {}
+      stalled.clear()
+      t0 = time.perf_counter()
+      futures = [pool.submit(fetch, file_attr, total_bytes, progress) for file_attr in pending_attrs]
+      for future in futures:
+        result = future.result()
+        if result is None:
+          continue
+        file_attr, seconds, transfer = result
+        downloaded_files.append(file_attr.filename)
+        digests[f"{folder_name}/{file_attr.filename}"] = transfer["sha256"]
+        emit_ready(file_attr.filename, transfer["sha256"])
+        if stats is not None:
+          stats["fileCnt"] += 1
+          stats["bytes"] += transfer["bytes"]
+          stats["writeSeconds"] += transfer["writeSeconds"]
+          stats["files"].append({
+            "name": file_attr.filename, "bytes": transfer["bytes"], "seconds": seconds,
+            "writeSeconds": transfer["writeSeconds"], "sha256": transfer["sha256"]
+          })
+      if stats is not None:
+        stats["seconds"] += time.perf_counter() - t0
+
+      #傳輸停滯或連線中斷時, 改用其他 SFTP host (只有一個 host 時重新連線) 繼續下載, 並計入嘗試次數; 已下載的檔案大小與修改時間相同, 不會重新下載
+      if len(downloaded_files) != len(valid_attrs) and (stalled.is_set() or not sftp.transport.is_active()):
+        failover("transfer stalled" if stalled.is_set() else "connection lost")
 
       #檢查下載的檔案數量是否與 SFTP 上的檔案數量一致
       if len(downloaded_files) == len(valid_attrs):
@@ -135,23 +480,42 @@ def download_sinf_map(lot_id: str) -> str:
     if download_attempt == 3:
       return "DownloadTooManyTimes"
 
-    #6-2. 如果下載成功, 回傳 None 並關閉 SFTP 連線
+    #6-2. 如果下載成功, 記錄各檔案下載時計算的 SHA-256 (沒有變動而略過的檔案保留原本的記錄), 並回傳下載路徑
+    if digests:
+      update_manifest(get_wo_dl_path(lot_id), digests)
     write_log("Download SINF map file completed successfully", "success")
-    #關閉 SFTP 連線
-    sftp.close()
+    if stats is not None:
+      stats["mbPerSec"] = stats["bytes"] / 1024 / 1024 / stats["seconds"] if stats["seconds"] else 0.0
+      write_log(f"SFTP transfer: {format_transfer_stats(stats)}", "info")
     return dl_path
 
+  except PipelineCancelled:
+    #使用者取消、超過期限或 on_file 發現有問題的 wafer, 由呼叫端處理, 不視為下載失敗
+    raise
+
   except Exception as e:
+    reusable = False
     write_log(f"Download SINF failed: {e}", "error")
     return "SinfDownloadError"
 
+  finally:
+    #等待下載中的檔案結束 (取消時會由 progress_cb 中止), 關閉平行下載的 channel 後再歸還連線
+    if pool:
+      pool.shutdown(wait=True, cancel_futures=True)
+    for channel in channels:
+      channel.close()
+    #關閉或歸還 SFTP 連線
+    if sftp:
+      release_sftp(sftp, reusable)
+
 
-def get_sinf_info(sinf_path: str) -> dict | str:
+def get_sinf_info(sinf_path: str, file_name: str | None = None) -> dict | str:
   """
   從 SINF map 檔案中讀取 XDIES 與 YDIES 的數值
 
   Arguments:
     sinf_path (str): SINF map 檔案的路徑
+    file_name (str): 要讀取的檔名, 未指定時讀取資料夾下的第一個檔案
 
   Returns:
     dict: 成功讀取 SINF map, 回傳一個字典, 包含以下內容:
@@ -163,7 +527,7 @@ def get_sinf_info(sinf_path: str) -> dict | str:
 
   try:
     #取得 sinf_path 資料夾下的第一個檔案
-    files = [f for f in os.listdir(sinf_path) if os.path.isfile(os.path.join(sinf_path, f))]
+    files = [file_name] if file_name else [f for f in os.listdir(sinf_path) if os.path.isfile(os.path.join(sinf_path, f))]
     if not files:
       return "SinfNotFoundError"
     sinf_file = os.path.join(sinf_path, files[0])
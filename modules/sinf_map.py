@@ -0,0 +1,167 @@
+import os, mmap, threading
+from array import array
+from contextlib import contextmanager
+
+
+#str.split() / str.strip() 視為空白的 ASCII 字元
+WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+
+class SinfMap:
+  """
+  以 mmap 讀取已下載到本機的 SINF map 檔案, 不會將整個檔案讀成字串
+  表頭欄位與 RowData 以 byte 搜尋定位, 只記錄每行 RowData 內容在檔案中的起訖位置 (第一次開啟時掃描);
+  需要 row data 時以 with 開啟, 取得指向 mmap 的 memoryview 列表, 離開 with 時即解除 mmap
+  (Windows 上被 mmap 的檔案無法覆寫或刪除, 因此不會在兩次使用之間保持開啟)
+
+  使用方式:
+    sinf_map = SinfMap(path)
+    with sinf_map as rows:
+      wafer_id = sinf_map.header("WAFER")
+      for row in rows: ...
+
+  Arguments:
+    path (str): SINF map 檔案路徑
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    #每行 RowData 內容 (不含 "RowData:" 與前後空白) 在檔案中的位置: [start0, end0, start1, end1, ...]
+    self.spans = None
+    self._stat = None
+    self._mm = None
+    self._view = None
+    self._rows = None
+    self._opened = 0
+    self._lock = threading.Lock()
+
+
+  def __len__(self) -> int:
+    if self.spans is None:
+      with self:
+        pass
+    return len(self.spans) // 2
+
+
+  def __enter__(self) -> list:
+    with self._lock:
+      if self._opened == 0:
+        self._open()
+      self._opened += 1
+      return self._rows
+
+
+  def __exit__(self, *exc):
+    with self._lock:
+      self._opened -= 1
+      if self._opened == 0:
+        self._close()
+
+
+  def _open(self):
+    st = os.stat(self.path)
+    stat = (st.st_size, st.st_mtime_ns)
+    #掃描後檔案被重新下載, 記錄的位置已不可信
+    if self._stat is not None and self._stat != stat:
+      raise ValueError(f"SINF map file changed after it was read: {self.path}")
+    with open(self.path, "rb") as f:
+      #空檔案無法 mmap, 會拋出 ValueError
+      self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      if self.spans is None:
+        self.spans = self._scan_rows()
+        self._stat = stat
+      self._view = memoryview(self._mm)
+      self._rows = [self._view[self.spans[i]:self.spans[i + 1]] for i in range(0, len(self.spans), 2)]
+    except BaseException:
+      self._close()
+      raise
+
+
+  def _close(self):
+    #先釋放所有 memoryview, mmap 才能關閉; 之後仍持有 row 的程式再讀取會拋出 ValueError
+    for row in self._rows or []:
+      row.release()
+    if self._view is not None:
+      self._view.release()
+    if self._mm is not None:
+      self._mm.close()
+    self._rows = self._view = self._mm = None
+
+
+  def _find_line(self, prefix: bytes, pos: int = 0) -> int:
+    """由 pos 開始尋找下一個以 prefix 開頭的行, 回傳行首位置, 找不到時回傳 -1"""
+    idx = pos
+    while True:
+      idx = self._mm.find(prefix, idx)
+      if idx <= 0 or self._mm[idx - 1] in b"\r\n":
+        return idx
+      idx += 1
+
+
+  def _line_end(self, pos: int) -> int:
+    end = self._mm.find(b"\n", pos)
+    return len(self._mm) if end < 0 else end
+
+
+  def _field(self, start: int) -> tuple:
+    """
+    取得 start 所在行第一個 ":" 之後到下一個 ":" (或行尾) 之間、去除前後空白的位置, 與 line.split(":")[1].strip() 相同
+
+    Returns:
+      tuple: (開始位置, 結束位置, 行尾位置)
+    """
+    end = self._line_end(start)
+    colon = self._mm.find(b":", start, end)
+    if colon < 0:
+      raise ValueError(f"Missing ':' at byte {start} of {self.path}")
+    begin = colon + 1
+    stop = self._mm.find(b":", begin, end)
+    stop = end if stop < 0 else stop
+    while begin < stop and self._mm[begin] in WHITESPACE:
+      begin += 1
+    while stop > begin and self._mm[stop - 1] in WHITESPACE:
+      stop -= 1
+    return begin, stop, end
+
+
+  def _scan_rows(self) -> array:
+    spans = array("q")
+    idx = self._find_line(b"RowData")
+    while idx >= 0:
+      begin, stop, end = self._field(idx)
+      spans.extend((begin, stop))
+      idx = self._find_line(b"RowData", end)
+    return spans
+
+
+  def header(self, key: str) -> str:
+    """
+    取得第一個以 key 開頭的表頭欄位內容, 需在 with 之內呼叫
+
+    Arguments:
+      key (str): 欄位名稱, 例如 "WAFER", "LOT", "ROWCT", "COLCT"
+
+    Returns:
+      str: 欄位內容, 找不到欄位時拋出 KeyError
+    """
+    idx = self._find_line(key.encode("ascii"))
+    if idx < 0:
+      raise KeyError(f"{key} not found in {self.path}")
+    begin, stop, _ = self._field(idx)
+    return self._mm[begin:stop].decode("utf-8", "replace")
+
+
+@contextmanager
+def open_rows(row_data_list):
+  """
+  取得 row data 的 bytes-like 列表: SinfMap 會在 with 期間 mmap, 字串列表 (例如測試資料) 則轉為 bytes
+
+  Arguments:
+    row_data_list (SinfMap | list): SinfMap 或 RowData 字串列表
+  """
+  if isinstance(row_data_list, SinfMap):
+    with row_data_list as rows:
+      yield rows
+  else:
+    yield [row.encode("utf-8") if isinstance(row, str) else row for row in row_data_list]
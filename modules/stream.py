@@ -0,0 +1,265 @@
+import os, queue, threading
+from modules.cfg import get_export_path
+from modules.integrity import DigestWriter, check_written, remember
+from modules.log import write_log
+from modules.sinf import get_sinf_info
+from modules.xml import Map, compare_row_cnt, generate_xml, get_info_from_sinf, get_wafer_letter, handle_row_data
+
+
+#queue 的結束標記
+_END = object()
+
+
+class _Stopped(Exception):
+  """StreamingExport 已被關閉, 各階段的 thread 收到後直接結束"""
+
+
+class StreamingExport:
+  """
+  以有界 queue 串接的分段轉檔, 讓 SINF map 下載、轉置、比對與寫入 XML 同時進行, 整批的時間接近最慢的階段而不是各階段的總和:
+    fetch: download_sinf_map() 依檔名順序在每個檔案下載完成時呼叫 feed()
+    transcode: get_info_from_sinf() 與 handle_row_data()
+    verify: 以 compare_row_cnt() 逐片比對轉置前後的數量
+    serialize: generate_xml() 後依序寫入 XML 暫存檔, commit() 時才改名為正式檔名
+  transcode 與 verify 只需要 SINF map, 下載期間即可開始; serialize 需要 WO file 的 target device, set_target_device() 後才開始,
+  die size 與最小刻號則取自第一個檔案 (檔名最小), 與 Pipeline 取得的值不同時應改用 prepare_export() 整批轉檔.
+  fetch 與 transcode 之間只傳遞檔名 (檔案已在磁碟上), 其餘 queue 的大小為 queue_size, 轉檔中的 wafer 約為 2 * queue_size 片, 不會保留整批的 row data
+
+  使用方式:
+    stream = StreamingExport(lot_id, dl_path, queue_size).start()
+    download_sinf_map(lot_id, on_file=lambda filename, sha256: stream.feed(filename))
+    stream.set_target_device(target_device)  #可在下載期間由其他 thread 呼叫
+    stream.end_feed()
+    result = stream.wait()
+    xml_path = stream.commit()
+    stream.close()
+
+  Arguments:
+    lot_id (str): 貨批號碼
+    dl_path (str): SINF map 的下載資料夾
+    queue_size (int): transcode → verify 與 verify → serialize 之間 queue 的大小 (wafer 片數)
+  """
+
+  def __init__(self, lot_id: str, dl_path: str, queue_size: int):
+    self.lot_id = lot_id
+    self.dl_path = dl_path
+    self.names = []  #已交給 transcode 的檔名, 依檔名順序
+    self.files = queue.Queue()
+    self.transcoded = queue.Queue(maxsize=queue_size)
+    self.verified = queue.Queue(maxsize=queue_size)
+    self.target_device = None
+    self.target_device_ready = threading.Event()
+    self.context = None  #serialize 使用的 (target device, die size X, die size Y, 最小刻號)
+    self.stopped = threading.Event()
+    self.done = threading.Event()
+    self.error = None
+    self.fallback = False  #遇到無法分段處理的資料 (例如重複的 wafer ID) 時為 True, 需改用 prepare_export() 整批轉檔
+    self.part_path = rf"{get_export_path()}\{lot_id}.xml.part"
+    self.lot_no = None
+    self.compare_result = None
+    self.digest = None  #XML 暫存檔的 bytes 與 sha256, 寫入時計算
+    self.threads = [
+      threading.Thread(target=self._run_stage, args=(self._transcode,), name=f"stream-transcode-{lot_id}", daemon=True),
+      threading.Thread(target=self._run_stage, args=(self._verify,), name=f"stream-verify-{lot_id}", daemon=True),
+      threading.Thread(target=self._run_stage, args=(self._serialize,), name=f"stream-serialize-{lot_id}", daemon=True)
+    ]
+
+
+  def start(self) -> "StreamingExport":
+    for thread in self.threads:
+      thread.start()
+    return self
+
+
+  def feed(self, filename: str):
+    """fetch: 檔案已下載完成, 可以開始轉置; 需依檔名順序呼叫"""
+    self.names.append(filename)
+    self.files.put(filename)
+
+
+  def end_feed(self):
+    """fetch: 全部檔案都已下載"""
+    self.files.put(_END)
+
+
+  def set_target_device(self, target_device: str):
+    """取得 WO file 的 target device 後呼叫, serialize 才開始生成 XML; 只有第一次呼叫有效"""
+    if not self.target_device_ready.is_set():
+      self.target_device = target_device
+      self.target_device_ready.set()
+
+
+  def wait(self) -> dict | str | None:
+    """
+    等待全部階段完成
+
+    Returns:
+      dict: 包含 lotNo 與 compareResult (內容與 compare_row_cnt() 相同, 為整批的合計)
+      str: 失敗時的 error key, 例如 "SinfReadError", "CompareRowDataError" 或 "ExportXmlError"
+      None: 需改用 prepare_export() 整批轉檔 (fallback 為 True)
+    """
+    for thread in self.threads:
+      thread.join()
+    if self.error:
+      return self.error
+    if self.fallback:
+      return None
+    return {"lotNo": self.lot_no, "compareResult": self.compare_result}
+
+
+  def commit(self) -> str:
+    """
+    比對通過後, 將 XML 暫存檔改名為 {xml_export_dir}\\{lot_no}.xml
+
+    Returns:
+      str: XML file path, 失敗時回傳 "ExportXmlError"
+    """
+    try:
+      xml_path = rf"{get_export_path()}\{self.lot_no}.xml"
+      os.replace(self.part_path, xml_path)
+      remember(xml_path, self.digest)
+      write_log(f"Export to XML successfully, lot ID: {self.lot_id}", "success")
+      return xml_path
+    except Exception as e:
+      write_log(f"Error exporting XML for lot {self.lot_id}: {e}", "error")
+      return "ExportXmlError"
+
+
+  def close(self):
+    """停止尚未結束的階段, 並移除未 commit 的 XML 暫存檔; 可重複呼叫"""
+    self.stopped.set()
+    if self.done.is_set() or not any(thread.is_alive() for thread in self.threads):
+      self._remove_part()
+    else:
+      #serialize 可能仍在寫入, 結束後再移除
+      threading.Thread(target=self._remove_part_after_join, daemon=True).start()
+
+
+  def _remove_part_after_join(self):
+    for thread in self.threads:
+      thread.join()
+    self._remove_part()
+
+
+  def _remove_part(self):
+    try:
+      os.remove(self.part_path)
+    except OSError:
+      pass
+
+
+  def _get(self, q: queue.Queue):
+    while True:
+      try:
+        return q.get(timeout=0.1)
+      except queue.Empty:
+        if self.stopped.is_set():
+          raise _Stopped()
+
+
+  def _put(self, q: queue.Queue, item):
+    while True:
+      try:
+        q.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        if self.stopped.is_set():
+          raise _Stopped()
+
+
+  def _run_stage(self, stage):
+    try:
+      stage()
+    except _Stopped:
+      pass
+    except Exception as e:
+      #其他階段會在下一次存取 queue 時停止
+      write_log(f"Streaming export of lot {self.lot_id} failed in {stage.__name__.strip('_')}: {e}", "error")
+      self.error = self.error or {"_transcode": "SinfReadError", "_verify": "CompareRowDataError"}.get(stage.__name__, "ExportXmlError")
+      self.stopped.set()
+
+
+  def _transcode(self):
+    while (filename := self._get(self.files)) is not _END:
+      number = filename.split(".")[-1]
+      sinf_info = get_info_from_sinf(self.dl_path, self.lot_id, number)
+      if sinf_info == "SinfReadError":
+        raise ValueError(f"Failed to read {filename}")
+      processed_row_data = handle_row_data(sinf_info["rowDataList"], sinf_info["waferId"])
+      self._put(self.transcoded, (filename, sinf_info, processed_row_data))
+    self._put(self.transcoded, _END)
+
+
+  def _verify(self):
+    mismatched_ids = {}
+    total_bef = {}
+    total_aft = {}
+    sym_bef = {}
+    wafer_ids = set()
+    while (item := self._get(self.transcoded)) is not _END:
+      filename, sinf_info, processed_row_data = item
+      wafer_id = sinf_info["waferId"]
+      #prepare_export() 以 wafer ID 為 key, 重複時只比對最後一片; 此情況改為整批轉檔, 以維持相同的結果
+      if wafer_id in wafer_ids:
+        self.fallback = True
+        self.stopped.set()
+        raise _Stopped()
+      wafer_ids.add(wafer_id)
+      result = compare_row_cnt({wafer_id: sinf_info["rowDataList"]}, {wafer_id: processed_row_data["rowDataResult"]})
+      if isinstance(result, str):
+        raise ValueError(f"Failed to compare row data of wafer {wafer_id}")
+      #與 compare_row_cnt() 比對整批的結果相同: 數量加總, 符號依第一次出現的順序合併
+      for code in result["totalBef"]:
+        mismatched_ids.setdefault(code, []).extend(result["mismatchedIds"][code])
+        total_bef[code] = total_bef.get(code, 0) + result["totalBef"][code]
+        total_aft[code] = total_aft.get(code, 0) + result["totalAft"][code]
+        symbols = sym_bef.setdefault(code, {})
+        if result["symBef"][code]:
+          symbols.update(dict.fromkeys(result["symBef"][code].split(", ")))
+      self._put(self.verified, (filename, sinf_info, processed_row_data))
+    self.compare_result = {
+      "mismatchedIds": mismatched_ids, "totalBef": total_bef, "totalAft": total_aft,
+      "symBef": {code: ", ".join(symbols) for code, symbols in sym_bef.items()}
+    }
+    self._put(self.verified, _END)
+
+
+  def _serialize(self):
+    from lxml import etree
+
+    while not self.target_device_ready.wait(0.1):
+      if self.stopped.is_set():
+        raise _Stopped()
+    os.makedirs(get_export_path(), exist_ok=True)
+    with open(self.part_path, "wb") as part_file:
+      #寫入時同時計算 SHA-256, 上傳與備份時以此比對 (modules.integrity)
+      xml_file = DigestWriter(part_file)
+      xml_file.write(b'<?xml version="1.0" ?>\n')
+      map_cnt = 0
+      while (item := self._get(self.verified)) is not _END:
+        filename, sinf_info, processed_row_data = item
+        if self.context is None:
+          #檔案依檔名順序送達, 第一個檔案即為最小刻號
+          die_size = get_sinf_info(self.dl_path, filename)
+          if isinstance(die_size, str):
+            raise ValueError(f"Failed to read die size from {filename}")
+          self.context = (self.target_device, die_size["dieSizeX"], die_size["dieSizeY"], get_wafer_letter([filename]))
+        target_device, die_size_x, die_size_y, wafer_letter = self.context
+        map_inst = Map(target_device, die_size_x, die_size_y, processed_row_data["rowDataResult"],
+                        sinf_info["waferId"], sinf_info["rowCt"], sinf_info["colCt"], sinf_info["lot"], processed_row_data["binCounts"])
+        map_inst.set_lot_no(wafer_letter)
+        #放在暫時的 Maps 元素中輸出, 縮排與 export_xml() 一次輸出整個 Maps 時相同
+        maps_el = etree.Element("Maps")
+        maps_el.append(generate_xml(map_inst))
+        xml_bytes = etree.tostring(maps_el, encoding="utf-8", pretty_print=True, xml_declaration=False)
+        if map_cnt == 0:
+          xml_file.write(xml_bytes[:xml_bytes.index(b"\n") + 1])
+        xml_file.write(xml_bytes[xml_bytes.index(b"\n") + 1:xml_bytes.rindex(b"</Maps>")])
+        self.lot_no = map_inst.lot_no
+        map_cnt += 1
+      if map_cnt == 0:
+        raise ValueError("No SINF map file to export")
+      xml_file.write(b"</Maps>\n")
+    self.digest = xml_file.digest()
+    check_written(self.part_path, self.digest)
+    self.done.set()
@@ -1,15 +1,80 @@
-import os, shutil
-from modules.cfg import get_export_path, get_upload_path, get_xml_bak_path
+import os
+from concurrent.futures import ThreadPoolExecutor
+from modules.archive import compress_file
+from modules.cfg import get_archive_cfg, get_export_path, get_upload_path, get_xml_bak_path
+from modules.concurrency import get_limit
+from modules.integrity import IntegrityError, copy_verified, file_digest
 from modules.log import write_log
 from modules.xml import rm_export_folder
 
 
-def upload_xml(xml_path: str) -> str | None:
+def copy_atomic(src_path: str, dst_path: str, cancel_check=None, expected: dict | None = None) -> dict:
+  """
+  先複製為 {dst_path}.part, 完成後才改名為 dst_path, 避免 AWMS 讀到不完整的 XML
+  複製時同時計算 SHA-256, 與 expected (匯出時記錄的 SHA-256) 不一致時重新複製, 不需要再從 share 讀回檔案比對
+  改名前會呼叫 cancel_check(), 已取消 (例如超過期限) 時會拋出例外並移除暫存檔, 不會寫入目的地
+
+  Arguments:
+    src_path (str): 來源檔案路徑
+    dst_path (str): 目的檔案路徑
+    cancel_check (function): 改名前呼叫的檢查函式
+    expected (dict): 來源檔案的 bytes 與 sha256, 未指定時以 file_digest() 取得
+
+  Returns:
+    dict: 複製的 bytes 與 sha256
+  """
+  return copy_verified(src_path, dst_path, expected or file_digest(src_path), cancel_check)
+
+
+def copy_to_share(src_path: str, dst_path: str, cancel_check=None, expected: dict | None = None) -> dict:
+  """
+  與 copy_atomic() 相同, 但寫入 share 的並行數量由 modules.concurrency 依吞吐量與錯誤率自動調整
+  """
+  limiter = get_limit("upload")
+  with limiter.slot():
+    try:
+      digest = copy_atomic(src_path, dst_path, cancel_check, expected)
+    except OSError:
+      limiter.record(0, ok=False)
+      raise
+    limiter.record(digest["bytes"])
+    write_log(f"Copied {os.path.basename(dst_path)} ({digest['bytes']} bytes, sha256 {digest['sha256']}) verified", "debug")
+    return digest
+
+
+def backup_xml(xml_path: str, xml_bak_path: str):
+  """
+  複製 XML 到備份資料夾; cfg.json 的 archive_enabled 為 true 時, 先在匯出資料夾壓縮,
+  再將壓縮檔 (例如 AADZHS000A.xml.gz, 可用 modules.archive.open_backup() 讀取) 寫入備份資料夾, 減少寫入 share 的資料量
+
+  壓縮時讀取的 XML 需與匯出時的 SHA-256 相同, 壓縮檔則以壓縮時計算的 SHA-256 驗證複製結果
+
+  Arguments:
+    xml_path (str): XML 檔案匯出的路徑
+    xml_bak_path (str): 備份資料夾路徑
+  """
+  xml_filename = os.path.basename(xml_path)
+  archive_cfg = get_archive_cfg()
+  if not archive_cfg["enabled"]:
+    copy_to_share(xml_path, rf"{xml_bak_path}/{xml_filename}")
+    return
+  compression = archive_cfg["compression"]
+  #壓縮檔留在匯出資料夾, 上傳完成後隨匯出資料夾一起移除
+  packed_path = f"{xml_path}.{compression}"
+  digests = compress_file(xml_path, packed_path, compression)
+  if digests["source"] != file_digest(xml_path):
+    raise IntegrityError(f"{xml_path} changed since it was exported, sha256 {digests['source']['sha256'][:16]}")
+  copy_to_share(packed_path, rf"{xml_bak_path}/{xml_filename}.{compression}", expected=digests["packed"])
+
+
+def upload_xml(xml_path: str, cancel_check=None) -> str | None:
   """
   上傳 XML 檔案到 AWMS 的指定路徑
+  上傳的並行數量 (modules.concurrency) 大於 1 時, 備份會與上傳同時進行
 
   Arguments:
     xml_path (str): XML 檔案匯出的路徑
+    cancel_check (function): 寫入上傳與備份路徑前呼叫, 已取消時應拋出例外
 
   Returns:
     None: 如果上傳成功, 則回傳上傳後的 XML 完整路徑
@@ -31,16 +96,23 @@ def upload_xml(xml_path: str) -> str | None:
     #XML 檔案的路徑
     xml_filename = os.path.basename(xml_path)
 
-    #複製 XML 檔案到上傳資料夾路徑
-    dst_path = os.path.join(upload_path, rf"{xml_filename}")
-    with open(xml_path, "rb") as src, open(dst_path, "wb") as dst:
-      dst.write(src.read())
-
-    #上傳完成後, 複製一份 XML map 到備份資料夾
-    xml_bak_path = get_xml_bak_path()
     #確保備份資料夾存在
+    xml_bak_path = get_xml_bak_path()
     os.makedirs(xml_bak_path, exist_ok=True)
-    shutil.copy(xml_path, rf"{xml_bak_path}/{xml_filename}")
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="xml-bak") as pool:
+      #可以同時寫入兩個 share 時, 備份與上傳同時進行
+      backup = None
+      if get_limit("upload").limit > 1:
+        backup = pool.submit(backup_xml, xml_path, xml_bak_path)
+      #複製 XML 檔案到上傳資料夾路徑
+      dst_path = os.path.join(upload_path, rf"{xml_filename}")
+      copy_to_share(xml_path, dst_path, cancel_check)
+      #上傳完成後, 複製一份 XML map 到備份資料夾
+      if backup:
+        backup.result()
+      else:
+        backup_xml(xml_path, xml_bak_path)
     write_log(f"Copy XML backup to: {xml_bak_path}", "info")
     #移除 XML 匯出資料夾
     rm_export_folder()
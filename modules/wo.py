@@ -1,10 +1,169 @@
-import os, shutil
-import pandas as pd
+import os, shutil, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime
-from modules.cfg import get_wo_dl_path, get_wo_month_cnt, get_wo_target_path
+from modules.cfg import get_wo_cache_mb, get_wo_dl_path, get_wo_month_cnt, get_wo_target_path
+from modules.concurrency import get_limit
 from modules.log import write_log
 
 
+#記錄已讀過的 WO file 中各 LOT NO 所在的檔案, key 為 lot_id, value 為 (csv 路徑, 修改時間, 記錄當時的 _wo_folders_signature())
+#同一張工單通常包含多批, 常駐服務處理下一批時可以略過遍歷 B2B folder; 依最近使用的順序排列, 超過 WO_LOCATIONS_MAX 筆時由最久沒有使用的開始移除
+_wo_locations = OrderedDict()
+_wo_locations_lock = threading.Lock()
+WO_LOCATIONS_MAX = 20000
+
+#已讀取的 WO file (WoTable), key 為檔案路徑, 依最近使用的順序排列, 總量超過 wo_cache_mb 時由最久沒有使用的開始移除
+_wo_tables = OrderedDict()
+_wo_tables_lock = threading.Lock()
+
+
+class WoTable:
+  """
+  已讀取的 WO file 與 LOT NO 的索引
+
+  Arguments:
+    df (DataFrame): pd.read_csv() 讀取的 WO file
+    stat (os.stat_result): 讀取前的檔案狀態, 大小或修改時間改變時快取即失效
+  """
+
+  def __init__(self, df, stat: os.stat_result):
+    self.df = df
+    self.key = (stat.st_size, stat.st_mtime_ns)
+    self.mtime = stat.st_mtime
+    #LOT NO 對應的 row 位置, 重複時取第一筆 (與 df[...].iloc[0] 相同); 沒有 LOT NO 欄位時為空
+    self.lot_index = {}
+    if "LOT NO" in df.columns:
+      for pos, lot_no in enumerate(df["LOT NO"].astype(str).str.strip()):
+        self.lot_index.setdefault(lot_no, pos)
+    self.nbytes = int(df.memory_usage(deep=True).sum()) + sum(len(lot_no) + 100 for lot_no in self.lot_index)
+
+
+  def find_row(self, lot_id: str):
+    """
+    Returns:
+      Series: LOT NO 與 lot_id 相符的第一筆 row, 沒有時回傳 None
+    """
+    pos = self.lot_index.get(lot_id)
+    return None if pos is None else self.df.iloc[pos]
+
+
+def _cache_table(path: str, table: WoTable):
+  """將 WoTable 放入快取, 並依 wo_cache_mb 移除最久沒有使用的項目"""
+  max_bytes = get_wo_cache_mb() * 1024 * 1024
+  with _wo_tables_lock:
+    _wo_tables.pop(path, None)
+    if table.nbytes > max_bytes:
+      return
+    _wo_tables[path] = table
+    #來源與複製後的檔案共用同一個 WoTable, 只計算一次
+    sizes = lambda: sum({id(cached): cached.nbytes for cached in _wo_tables.values()}.values())
+    while sizes() > max_bytes:
+      _wo_tables.popitem(last=False)
+
+
+def read_wo_table(csv_path: str) -> WoTable:
+  """
+  讀取 WO file, 檔案大小與修改時間與快取中的相同時直接回傳快取, 不會讀取檔案內容 (只取得檔案狀態)
+  讀取失敗時拋出例外
+
+  Arguments:
+    csv_path (str): WO file 路徑
+
+  Returns:
+    WoTable: 讀取的 WO file 與 LOT NO 的索引, 呼叫端不可修改其中的 DataFrame
+  """
+  import pandas as pd
+
+  stat = os.stat(csv_path)
+  with _wo_tables_lock:
+    table = _wo_tables.get(csv_path)
+    if table and table.key == (stat.st_size, stat.st_mtime_ns):
+      _wo_tables.move_to_end(csv_path)
+      return table
+  table = WoTable(pd.read_csv(csv_path, sep="\t", on_bad_lines="skip"), stat)
+  _cache_table(csv_path, table)
+  return table
+
+
+def _wo_folders_signature() -> tuple:
+  """
+  取得最近幾個月 WO 資料夾的修改時間, 資料夾中新增或刪除 WO file、或進入新的月份時會改變
+  只取得資料夾狀態, 不會列出內容
+
+  Returns:
+    tuple: ((資料夾路徑, 修改時間 ns), ...), 資料夾不存在時修改時間為 None
+  """
+  target_path = get_wo_target_path()
+  signature = []
+  for month in getLatestMonths(get_wo_month_cnt()):
+    folder_path = rf"{target_path}\{month}"
+    try:
+      signature.append((folder_path, os.stat(folder_path).st_mtime_ns))
+    except OSError:
+      signature.append((folder_path, None))
+  return tuple(signature)
+
+
+def _find_location(lot_id: str, signature: tuple) -> str | None:
+  """
+  查詢 lot_id 之前所在的 WO file; WO 資料夾有變動 (可能有較新的 WO file) 或 WO file 本身有變動時視為失效並移除
+
+  Returns:
+    str: WO file 路徑, 沒有記錄或已失效時回傳 None
+  """
+  with _wo_locations_lock:
+    located = _wo_locations.get(lot_id)
+  if not located:
+    return None
+  csv_path, mtime, located_signature = located
+  try:
+    if located_signature == signature and os.path.getmtime(csv_path) == mtime:
+      with _wo_locations_lock:
+        if lot_id in _wo_locations:
+          _wo_locations.move_to_end(lot_id)
+      return csv_path
+  except OSError:
+    pass
+  with _wo_locations_lock:
+    _wo_locations.pop(lot_id, None)
+  return None
+
+
+def _remember_locations(csv_path: str, table: WoTable, signature: tuple):
+  """記錄 WO file 包含的所有 LOT NO; 同一次遍歷中先讀到的 (較新的月份) 優先, 舊的遍歷留下的記錄則直接覆蓋"""
+  with _wo_locations_lock:
+    for lot_no in table.lot_index:
+      located = _wo_locations.get(lot_no)
+      if located and located[2] == signature:
+        continue
+      _wo_locations[lot_no] = (csv_path, table.mtime, signature)
+      _wo_locations.move_to_end(lot_no)
+    while len(_wo_locations) > WO_LOCATIONS_MAX:
+      _wo_locations.popitem(last=False)
+
+
+def copy_wo_file(csv_path: str, dl_path: str) -> str:
+  """
+  複製 WO file 到 dl_path, 並將來源的快取同時用於複製後的檔案, get_wo_info() 讀取複製後的檔案時不需要再次讀取
+
+  Returns:
+    str: 複製後的檔案路徑
+  """
+  download_full_path = os.path.join(dl_path, os.path.basename(csv_path))
+  shutil.copy2(csv_path, download_full_path)
+  with _wo_tables_lock:
+    table = _wo_tables.get(csv_path)
+  if table:
+    #copy2 保留修改時間, 大小與修改時間都相同時表示複製期間來源沒有變動
+    stat = os.stat(download_full_path)
+    if (stat.st_size, stat.st_mtime_ns) == table.key:
+      _cache_table(download_full_path, table)
+  write_log(f"Downloaded WO file: {download_full_path}", "info")
+  return download_full_path
+
+
 def getLatestMonths(num=2) -> list:
   """
   取得最近 num 個月的月份字串列表
@@ -37,6 +196,44 @@ def getLatestMonths(num=2) -> list:
   return result
 
 
+def read_csvs(csv_paths: list, read_func):
+  """
+  平行讀取多個 WO file, thread 數量由 modules.concurrency 依 share 的吞吐量與錯誤率自動調整
+  結果依 csv_paths 的順序產生, 呼叫端可以在找到所需的資料後停止, 尚未開始讀取的檔案會被略過
+
+  Arguments:
+    csv_paths (list): WO file 路徑列表
+    read_func (function): 讀取單一檔案的函式, 參數為檔案路徑, 例如 lambda path: pd.read_csv(path)
+
+  Yields:
+    tuple: (csv_path, read_func() 的結果); 讀取失敗時結果為例外物件
+  """
+  limiter = get_limit("wo")
+  stopped = threading.Event()
+
+  def read(csv_path: str):
+    with limiter.slot():
+      if stopped.is_set():
+        return None
+      try:
+        size = os.path.getsize(csv_path)
+        result = read_func(csv_path)
+      except Exception as e:
+        limiter.record(0, ok=False)
+        return e
+      limiter.record(size)
+      return result
+
+  pool = ThreadPoolExecutor(max_workers=limiter.max, thread_name_prefix="wo-scan")
+  try:
+    futures = [pool.submit(read, csv_path) for csv_path in csv_paths]
+    for csv_path, future in zip(csv_paths, futures):
+      yield csv_path, future.result()
+  finally:
+    stopped.set()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
 def download_wo_file(lot_id: str) -> str:
   """
   遍歷 B2B folder 上的工單 (WO file) 資料夾內容,
@@ -53,6 +250,18 @@ def download_wo_file(lot_id: str) -> str:
   """
 
   try:
+    #先檢查之前讀過的 WO file, 如果 WO 資料夾與檔案都沒有變動就直接複製
+    signature = _wo_folders_signature()
+    csv_path = _find_location(lot_id, signature)
+    if csv_path:
+      dl_path = get_wo_dl_path(lot_id)
+      os.makedirs(dl_path, exist_ok=True)
+      try:
+        return copy_wo_file(csv_path, dl_path)
+      except OSError:
+        with _wo_locations_lock:
+          _wo_locations.pop(lot_id, None)
+
     month_cnt = get_wo_month_cnt()
     monthStrs = getLatestMonths(month_cnt)
 
@@ -72,27 +281,22 @@ def download_wo_file(lot_id: str) -> str:
       if not csv_fs:
         continue
 
-      #3. 遍歷所有 WO 檔案, 讀取裡面的 LOT NO 欄位值
-      for csv_f in csv_fs:
-        csv_path = os.path.join(folder_path, csv_f)
-        #取得 dataframe
-        try:
-          df = pd.read_csv(csv_path, sep="\t", on_bad_lines="skip")
-        except Exception as e:
-          write_log(f"Read CSV file {csv_f} failed: {e}", "error")
-          return "WoReadError"
-        #檢查 LOT NO 欄位是否存在, 不存在則跳過
-        if "LOT NO" not in df.columns:
-          continue
-        #檢查是否有 LOT NO 欄位值與 lot_id 一致的 WO 檔案, 不一致則跳過
-        match_rows = df[df["LOT NO"].astype(str).str.strip() == lot_id]
-        if match_rows.empty:
-          continue
-        #找到符合的 csv, 將其下載複製到 dl_path
-        download_full_path = os.path.join(dl_path, csv_f)
-        shutil.copy2(csv_path, download_full_path)
-        write_log(f"Downloaded WO file: {download_full_path}", "info")
-        return download_full_path
+      #3. 遍歷所有 WO 檔案, 讀取裡面的 LOT NO 欄位值 (已讀過且沒有變動的檔案直接使用快取)
+      csv_paths = [os.path.join(folder_path, csv_f) for csv_f in csv_fs]
+      with closing(read_csvs(csv_paths, read_wo_table)) as results:
+        for csv_path, table in results:
+          csv_f = os.path.basename(csv_path)
+          #取得 WoTable
+          if isinstance(table, Exception):
+            write_log(f"Read CSV file {csv_f} failed: {table}", "error")
+            return "WoReadError"
+          #記錄此檔案包含的所有 LOT NO, 供之後的 lot 直接查詢; 沒有 LOT NO 欄位時索引為空
+          _remember_locations(csv_path, table, signature)
+          #檢查是否有 LOT NO 欄位值與 lot_id 一致的 WO 檔案, 不一致則跳過
+          if lot_id not in table.lot_index:
+            continue
+          #找到符合的 csv, 將其下載複製到 dl_path
+          return copy_wo_file(csv_path, dl_path)
       #若此月份資料夾沒找到符合的 WO file, 繼續往前一個月檢查
     #若所有月份資料夾都沒找到
     return "WoNotFoundError"
@@ -101,6 +305,68 @@ def download_wo_file(lot_id: str) -> str:
     write_log(f"Download WO failed: {e}", "error")
 
 
+def find_wo_quantities(lot_ids: list) -> dict | str:
+  """
+  查詢多批 lot 在 WO file 中的 QUANTITY, 不會複製 WO file; 讀取的 WO file 會放入快取 (read_wo_table()), 之後下載同一張工單的 lot 時不需要再次讀取
+  會先查看之前讀過的 WO file, 其餘 lot 再依照 download_wo_file() 相同的順序遍歷 B2B folder, 全部找到即停止
+
+  Arguments:
+    lot_ids (list): 貨批號碼列表, 例如 ["AADZHS000", "AADZHS001"]
+
+  Returns:
+    dict: key 為 lot_id, value 為 QUANTITY (int); QUANTITY 不是整數時為 "WoReadError", 沒有找到的 lot 不會出現在結果中
+    "WoReadError": 讀取 WO 檔案 (.csv) 失敗
+  """
+  remaining = set(lot_ids)
+  quantities = {}
+
+  def read_quantities(csv_paths: list):
+    with closing(read_csvs(csv_paths, read_wo_table)) as results:
+      for csv_path, table in results:
+        if isinstance(table, Exception):
+          raise table
+        collect_quantities(csv_path, table)
+        if not remaining:
+          break
+
+  def collect_quantities(csv_path: str, table: WoTable):
+    _remember_locations(csv_path, table, signature)
+    if "QUANTITY" not in table.df.columns:
+      return
+    for lot_no in [lot_no for lot_no in remaining if lot_no in table.lot_index]:
+      remaining.discard(lot_no)
+      quantity = table.find_row(lot_no)["QUANTITY"]
+      try:
+        quantities[lot_no] = int(quantity)
+      except (TypeError, ValueError):
+        quantities[lot_no] = "WoReadError"
+
+  try:
+    #1. 之前讀過且 WO 資料夾與檔案都沒有變動的 WO file
+    signature = _wo_folders_signature()
+    known_paths = []
+    for lot_id in lot_ids:
+      csv_path = _find_location(lot_id, signature)
+      if csv_path and csv_path not in known_paths:
+        known_paths.append(csv_path)
+    read_quantities(known_paths)
+
+    #2. 遍歷 B2B folder 上最近幾個月的 WO file
+    for month in getLatestMonths(get_wo_month_cnt()):
+      if not remaining:
+        break
+      folder_path = rf"{get_wo_target_path()}\{month}"
+      if not os.path.exists(folder_path):
+        continue
+      csv_paths = [os.path.join(folder_path, csv_f) for csv_f in os.listdir(folder_path) if csv_f.lower().endswith(".csv")]
+      read_quantities([csv_path for csv_path in csv_paths if csv_path not in known_paths])
+    return quantities
+
+  except Exception as e:
+    write_log(f"Find WO quantities failed: {e}", "error")
+    return "WoReadError"
+
+
 def get_wo_info(wo_path: str, lot_id: str) -> dict | str:
   """
   讀取 WO file, 組成 Target Device 字串內容, 回傳 targetDevice 與 quantity 值
@@ -115,25 +381,21 @@ def get_wo_info(wo_path: str, lot_id: str) -> dict | str:
       - quantity (int): 片數, 例如 22
     "WoReadError": 讀取 WO 檔案 (.csv) 失敗
   """
-  #取得 dataframe
+  #取得 WoTable, 已讀過且沒有變動的 WO file 直接使用快取
   try:
-    df = pd.read_csv(wo_path, sep="\t", on_bad_lines="skip")
+    table = read_wo_table(wo_path)
   except Exception as e:
     write_log(f"Read CSV file {wo_path} failed: {e}", "error")
     return "WoReadError"
 
   #取得 OUTPUT P/N, MASK, SUFFIX 欄位的值
   try:
-    try:
-      #依 LOT NO 欄位找到對應的 row
-      match_rows = df[df["LOT NO"].astype(str).str.strip() == lot_id]
-      if match_rows.empty:
-        ve = ValueError(f"LOT NO {lot_id} not found in file")
-        write_log(ve, "error")
-        raise ve
-      row = match_rows.iloc[0]
-    except Exception:
-      raise ValueError(ve)
+    #依 LOT NO 的索引找到對應的 row
+    row = table.find_row(lot_id)
+    if row is None:
+      ve = ValueError(f"LOT NO {lot_id} not found in file")
+      write_log(ve, "error")
+      raise ve
 
     try:
       output_p_n = str(row.get("OUTPUT P/N", "")).strip()
@@ -1,15 +1,17 @@
-import os
-from PyQt5.QtCore import QThread, pyqtSignal
+import time, queue
+import multiprocessing as mp
+from datetime import datetime
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+from modules.cfg import get_cfg, get_ui_cfg
+from modules.deadline import RunControl
 from modules.log import write_log
-from modules.cfg import get_export_path, get_sinf_dl_path, get_upload_path, get_xml_bak_path
-from modules.sinf import download_sinf_map, get_sinf_info
-from modules.upload import upload_xml
-from modules.wo import download_wo_file, get_wo_info
-from modules.xml import compare_row_cnt, export_xml, prepare_export
+from modules.pipeline import Pipeline, run_in_child
+from modules.probe import describe_probe, probe_lots
+from modules.service import connect_service
 
 
 class Worker(QThread):
-  """使用 QThread 執行長時間運行的操作, 避免阻塞 GUI 主執行緒"""
+  """使用 QThread 執行長時間運行的操作, 避免阻塞 GUI 主執行緒; 實際流程見 modules.pipeline.Pipeline"""
   progress = pyqtSignal(int)
   message = pyqtSignal(str, str, bool)  #status, msg, skip_log
   log_text = pyqtSignal(str)
@@ -20,223 +22,232 @@ class Worker(QThread):
   def __init__(self, lot_id):
     super().__init__()
     self.lot_id = lot_id
+    self.control = RunControl()
 
 
-  def get_error_msg(self, key: str, custom_info=None) -> str:
-    """
-    根據 error 的 key 取得對應的 message 內容
+  def cancel(self):
+    """要求取消目前的處理流程, 可從 GUI 主執行緒呼叫; 流程會在下一個檢查點停止並發出 message 與 finished"""
+    self.control.cancel()
+
+
+  def run(self):
+    pipeline = Pipeline(self.lot_id, self.control)
+    pipeline.progress.connect(self.progress.emit)
+    pipeline.message.connect(self.message.emit)
+    pipeline.log_text.connect(self.log_text.emit)
+    pipeline.finished.connect(self.finished.emit)
+    pipeline.result.connect(self.result.emit)
+    pipeline.run()
 
-    Arguments:
-      key (str): error key, 例如 "ConnectionError", "SinfNotFoundError" 等
-      custom_info (str | dict, optional): 自訂訊息內容, 例如 Lot ID 或 SINF map 檔案名稱
+
+  def dispatch(self, msg: dict) -> bool:
+    """
+    將 modules.pipeline.connect_pipeline() 格式的訊息轉為 signal 發出
 
     Returns:
-      str: 對應的 error message 內容, 如果沒有對應的 key, 則回傳 "Unknown error occurred"
+      bool: 收到 {"type": "done"} 時回傳 True, 表示這批 lot 已處理完畢
     """
-    if key == "NumberMismatchError":
-      if isinstance(custom_info, dict):
-        return f"SINF map file count {custom_info['sinf']} does not match WO QUANTITY value {custom_info['wo']}"
-      else:
-        return f"SINF map file count does not match WO QUANTITY value"
-    elif key == "RowDataMismatchError":
-      if isinstance(custom_info, dict):
-        f"Row data wafer ID {custom_info['waferId']} mismatched, '{custom_info['symBef']}' count is: {custom_info['cntBef']}, and '{custom_info['symAft']}' count is {custom_info['cntAft']}"
-    else:
-      error_messages = {
-        "ConnectionError": "Failed to connect to SFTP server",
-        "SinfNotFoundError": f"Lot ID '{custom_info}' SINF map not found from FTP",
-        "DownloadTooManyTimes": f"Failed to download {custom_info} file after 3 attempts",
-        "SinfDownloadError": "Failed to download SINF map file",
-        "SinfReadError": "Failed to read SINF map file",
-        "WoReadError": "Failed to read .csv (WO file)",
-        "WoNotFoundError": f"Lot ID '{custom_info}' WO file not found from B2B folder",
-        "RemoveExportError": f"Failed to remove existed export folder",
-        "CompareRowDataError": f"Failed to compare row data for lot ID '{custom_info}'",
-        "ExportXmlError": f"Failed to export XML file for lot ID '{custom_info}'",
-        "XmlNotFoundError": f"XML file for lot ID '{custom_info}' not found in export folder",
-        "UploadError": f"Error uploading XML to AWMS for lot '{custom_info}'"
-      }
-      return error_messages.get(key, f"Unknown error occurred: {key}")
+    match msg["type"]:
+      case "progress":
+        self.progress.emit(msg["value"])
+      case "log":
+        self.log_text.emit(msg["text"])
+      case "message":
+        #執行端已寫過 log, 在此略過避免重複記錄
+        self.message.emit(msg["status"], msg["msg"], True)
+      case "finished":
+        self.finished.emit()
+      case "result":
+        self.result.emit(msg["record"])
+      case "done":
+        return True
+    return False
+
+
+class ServiceWorker(Worker):
+  """
+  Worker 的 thin client 版本: 將 lot 交給常駐服務 (modules.service) 執行, 並轉發服務回傳的進度與訊息
+  signal 與 Worker 相同, 可以直接替換; 無法連線到服務時, 會改在本程序中執行
+  """
+
+  conn = None
+
+
+  def cancel(self):
+    super().cancel()
+    #在服務中執行時, 將取消要求轉送給服務
+    if self.conn:
+      try:
+        self.conn.send({"type": "cancel"})
+      except (EOFError, OSError):
+        pass
 
 
   def run(self):
-    """
-    1. 取得 Lot ID, 並檢查 Lot ID 是否為空
-    2. 如果 Lot ID 不為空, 開始處理
-    3. 下載 SINF map 檔案, 取得 dieSizeX 與 dieSizeY
-    4. 下載工單 (WO file), 取得 targetDevice 與 quantity
-    5. 比對 SINF map 的檔案數量與 WO 所記錄的 quantity 是否一致
-    6. 將 map 輸出成 XML 格式
-    7. 將 XML 檔案上傳到 AWMS MapIN 路徑
-    8. 如果有任何錯誤, 使用 QMessageBox 顯示警告訊息
-    9. 如果成功, 印出相關資訊, 並使用 QMessageBox 顯示成功訊息
-    """
+    conn = connect_service()
+    if conn is None:
+      write_log("Service unavailable, running in-process", "warning")
+      super().run()
+      return
+
+    self.conn = conn
     try:
-      write_log("=" * 60, "info")
-
-      lot_id = self.lot_id
-      self.progress.emit(0)
-      self.log_text.emit(f"Processing lot ID: {lot_id}")
-
-      #Lot ID 不為空, 開始處理
-      if lot_id and len(lot_id) != 0:
-        write_log(f"Processing Lot ID: {lot_id}")
-        self.progress.emit(10)
-
-      ################################################################################
-      #1. 下載 SINF map 檔案, 取得 die_size_x 與 die_size_y
-      sinf_result = download_sinf_map(lot_id)
-      self.progress.emit(23)
-
-      #如果在 SFTP server 沒有找到 lot_id 所對應的 SINF map 檔案
-      if sinf_result == "SinfNotFoundError":
-        self.message.emit("warning", self.get_error_msg(sinf_result, lot_id), False)
-        return
-      #如果在 SFTP server 下載 SINF map 檔案失敗超過 3 次
-      elif sinf_result == "DownloadTooManyTimes":
-        self.message.emit("warning", self.get_error_msg(sinf_result, "SINF map"), False)
-        return
-      #如果在 SFTP server 下載 SINF map 檔案遇到其他失敗
-      elif sinf_result == "SinfDownloadError":
-        self.message.emit("warning", self.get_error_msg(sinf_result), False)
-        return
-
-      #如果成功下載 SINF map 檔案, sinf_result 會是其下載路徑
-      if sinf_result != None and sinf_result.strip() != "":
-        self.log_text.emit(f"SINF map download path: {sinf_result}")
-        sinf_info = get_sinf_info(sinf_result)
-        #如果是字串, 代表讀取 SINF map 檔案失敗
-        if isinstance(sinf_info, str):
-          self.message.emit("warning", self.get_error_msg(sinf_info), False)
-          return
-        #如果是 dict, 代表成功讀取 SINF map, 取得 dieSizeX 與 dieSizeY
-        elif isinstance(sinf_info, dict):
-          die_size_x = sinf_info.get("dieSizeX")
-          die_size_y = sinf_info.get("dieSizeY")
-          die_size_msg = f"Die Size X: {die_size_x}, Die Size Y: {die_size_y}"
-          self.log_text.emit(die_size_msg)
-          write_log(die_size_msg)
-          self.progress.emit(37)
-
-      ################################################################################
-      #2. 下載工單 (WO file), 取得 target_device 與 quantity
-      wo_result = download_wo_file(lot_id)
-
-      #如果讀取 WO 檔案 (.csv) 失敗
-      if wo_result == "WoReadError":
-        self.message.emit("warning", self.get_error_msg(wo_result), False)
-        return
-      #如果在 B2B folder 沒有找到符合的 WO 檔案
-      elif wo_result == "WoNotFoundError":
-        self.message.emit("warning", self.get_error_msg(wo_result, lot_id), False)
-        return
-      #如果成功下載 WO 檔案, wo_result 會是其下載路徑
-      elif wo_result and wo_result.strip() != "":
-        self.log_text.emit(f"WO file download path: {wo_result}")
-        wo_info = get_wo_info(wo_result, lot_id)
-        #如果是字串, 代表讀取 WO file 失敗
-        if isinstance(wo_info, str):
-          self.message.emit("warning", self.get_error_msg(wo_info), False)
-          return
-        #如果是 dict, 代表成功讀取 WO file, 取得 targetDevice 與 quantity
-        elif isinstance(wo_info, dict):
-          target_device = wo_info.get("targetDevice")
-          quantity = wo_info.get("quantity")
-          wo_info_msg = f"Target device: {target_device}, Quantity: {quantity}"
-          self.log_text.emit(wo_info_msg)
-          write_log(wo_info_msg)
-          self.progress.emit(52)
-
-      ################################################################################
-      #3. 比對 SINF map 的檔案數量與 WO 所記錄的 quantity 是否一致
-      sinf_dl_path = get_sinf_dl_path(lot_id, f"APC_{lot_id}")
-      sinf_file_cnt = len(os.listdir(sinf_dl_path))
-      if sinf_file_cnt != quantity:
-        self.message.emit("warning", self.get_error_msg("NumberMismatchError", {"sinf": sinf_file_cnt, "wo": quantity}), False)
-        return
-      self.log_text.emit(f"SINF map file count: {sinf_file_cnt}, WO QUANTITY: {quantity}")
-      self.progress.emit(65)
-
-      ################################################################################
-      #4. 如果數量一致, 開始生成 XML 元素
-      prepare_result = prepare_export(lot_id, target_device, die_size_x, die_size_y)
-      if isinstance(prepare_result, str):
-        self.message.emit("warning", self.get_error_msg(prepare_result, lot_id), False)
-        return
-      if isinstance(prepare_result, dict):
-        maps_el = prepare_result["mapsEl"]
-        lot_no = prepare_result["lotNo"]
-        row_data_bef = prepare_result["rowDataBef"]
-        row_data_aft = prepare_result["rowDataAft"]
-      self.progress.emit(75)
-
-      ################################################################################
-      #5. 比對轉置前後的 row data 數量
-      compare_result = compare_row_cnt(row_data_bef, row_data_aft)
-      if isinstance(compare_result, str):
-        self.message.emit("warning", self.get_error_msg(compare_result, lot_id), False)
-        return
-      if isinstance(compare_result, dict):
-        total_bef_f = compare_result["totalBefF"]
-        total_aft_f = compare_result["totalAftF"]
-        total_bef_1 = compare_result["totalBef1"]
-        total_aft_1 = compare_result["totalAft1"]
-        total_bef_x = compare_result["totalBefX"]
-        total_aft_x = compare_result["totalAftX"]
-        compare_logs = [
-          f"Comparing row data:",
-          f"'__' count is: {total_bef_f}, 'F' count is {total_aft_f};",
-          f"'00' count is: {total_bef_1}, '1' count is {total_aft_1};",
-        ]
-        sym_bef_X = compare_result['symBefX']
-        if total_bef_x != 0 or total_aft_x != 0:
-          compare_logs.append(f"'{sym_bef_X}' count is: {total_bef_x}, 'X' count is {total_aft_x};")
-          self.log_text.emit(" ".join(compare_logs))
-
-        err_infos = None
-        if len(compare_result["mismatchedIdF"]):
-          err_infos = { "waferId": compare_result["mismatchedIdF"], "cntBef": total_bef_f, "cntAft": total_aft_f, "symBef": "__", "symAft": "F" }
-        elif len(compare_result["mismatchedId1"]):
-          err_infos = { "waferId": compare_result["mismatchedId1"], "cntBef": total_bef_1, "cntAft": total_aft_1, "symBef": "00", "symAft": "1" }
-        elif len(compare_result["mismatchedIdX"]):
-          err_infos = { "waferId": compare_result["mismatchedIdX"], "cntBef": total_bef_x, "cntAft": total_aft_x, "symBef": sym_bef_X, "symAft": "X" }
-        if isinstance(err_infos, dict) and err_infos:
-          self.message.emit("warning", self.get_error_msg("RowDataMismatchError", err_infos), False)
-          return
-        self.log_text.emit(f"Compare row data successfully")
-        self.progress.emit(85)
-
-      ################################################################################
-      #6. 開始輸出 XML 檔案
-      export_result = export_xml(lot_id, maps_el, lot_no)
-      if export_result == "ExportXmlError":
-        self.message.emit("warning", self.get_error_msg(export_result, lot_id), False)
-        return
-      else:
-        xml_path = export_result
-        self.log_text.emit(f"Generated map XML file path: {xml_path}")
-        self.progress.emit(93)
-
-      ################################################################################
-      #7. 將 XML 檔案上傳到 AWMS MapIN 路徑
-      upload_result = upload_xml(xml_path)
-
-      #如果找不到匯出的 XML 檔案, 或者上傳至 AWMS 時發生錯誤
-      if upload_result == "XmlNotFoundError" or upload_result == "UploadError":
-        self.message.emit("warning", self.get_error_msg(upload_result, lot_id), False)
-        return
-      self.progress.emit(98)
-      self.log_text.emit(f"Copied map XML file to path: {get_xml_bak_path()}")
-      self.log_text.emit(f"Uploaded map XML file path: {upload_result}")
-
-      ################################################################################
-      #8. 顯示成功訊息
-      self.message.emit("success", f"Success! Processed lot ID: {lot_id}", False)
-      self.progress.emit(100)
-      self.log_text.emit(f"Success! 🎉")
+      conn.send({"type": "run", "lotId": self.lot_id})
+      while not self.dispatch(conn.recv()):
+        pass
+    except (EOFError, OSError) as e:
+      write_log(f"Lost connection to service: {e}", "error")
+      self.message.emit("error", "Lost connection to background service", False)
       self.finished.emit()
+    finally:
+      self.conn = None
+      conn.close()
+
+
+class ProcessWorker(Worker):
+  """
+  Worker 的子 process 版本: 在獨立的 process 中執行 Pipeline, 並透過 queue 轉發進度、log 與結果
+  轉檔等 CPU 密集的工作不會佔用 GUI process 的 GIL, signal 與 Worker 相同, 可以直接替換
+  取消後子 process 超過 CANCEL_GRACE_SEC 秒仍未結束時, 會直接終止子 process
+  """
+  CANCEL_GRACE_SEC = 10
+
+
+  def __init__(self, lot_id):
+    super().__init__(lot_id)
+    self.ctx = mp.get_context("spawn")
+    self.cancel_event = self.ctx.Event()
+    self.cancel_time = None
+
+
+  def cancel(self):
+    self.cancel_event.set()
+    self.cancel_time = time.monotonic()
+
+
+  def run(self):
+    msg_queue = self.ctx.Queue()
+    #子 process 會重新讀取 cfg.json, 在此傳入目前的設定讓兩邊保持一致
+    proc = self.ctx.Process(target=run_in_child, args=(self.lot_id, msg_queue, dict(get_cfg()), self.cancel_event), daemon=True)
+    proc.start()
+    try:
+      while True:
+        try:
+          msg = msg_queue.get(timeout=0.5)
+        except queue.Empty:
+          if proc.is_alive() and self.cancel_time and time.monotonic() - self.cancel_time > self.CANCEL_GRACE_SEC:
+            proc.terminate()
+            write_log(f"Pipeline process did not stop within {self.CANCEL_GRACE_SEC}s after cancel, terminated", "warning")
+            self.message.emit("warning", "Cancelled by user, pipeline process terminated", False)
+            self.finished.emit()
+            break
+          if proc.is_alive():
+            continue
+          #子 process 已結束但沒有送出 done, 表示異常終止
+          write_log(f"Pipeline process exited unexpectedly, exit code: {proc.exitcode}", "error")
+          self.message.emit("error", "Pipeline process exited unexpectedly", False)
+          self.finished.emit()
+          break
+        if self.dispatch(msg):
+          break
+    finally:
+      proc.join()
+
+
+class ProbeWorker(Worker):
+  """
+  在背景檢查多批 lot 是否可以開始處理 (modules.probe.probe_lots), 不會下載任何檔案
+  每批的結果以 log_text 顯示, 最後以 message 顯示總結, signal 與 Worker 相同
+  """
+
+  def __init__(self, lot_ids: list):
+    super().__init__(" ".join(lot_ids))
+    self.lot_ids = lot_ids
+
+
+  def run(self):
+    self.log_text.emit(f"Checking {len(self.lot_ids)} lots...")
+    probe_result = probe_lots(self.lot_ids)
+    if probe_result == "ConnectionError":
+      self.message.emit("error", "Failed to connect to SFTP server", False)
+    elif probe_result == "WoReadError":
+      self.message.emit("error", "Failed to read .csv (WO file)", False)
+    else:
+      for item in probe_result["lots"]:
+        self.log_text.emit(describe_probe(item))
+      self.result.emit(probe_result)
+      not_ready = [item["lotId"] for item in probe_result["lots"] if item["status"] != "Ready"]
+      summary = f"{len(self.lot_ids) - len(not_ready)} / {len(self.lot_ids)} lots ready ({probe_result['seconds']:.1f}s)"
+      if not_ready:
+        self.message.emit("warning", f"{summary}, not ready: {', '.join(not_ready)}", False)
+      else:
+        self.message.emit("success", summary, False)
+    self.finished.emit()
+
+
+class SignalBatcher(QObject):
+  """
+  介於 Worker 與 MainWidget 之間的 signal 合併層, 需在 GUI 主執行緒中建立
+  進度只保留最新的值, log 文字先暫存並記下收到的時間, 每隔 flushIntervalMs 毫秒一次送出;
+  message 與 finished 會先送出暫存內容再轉發, 讓訊息框出現前畫面已是最新狀態
+  """
+  progress = pyqtSignal(int)
+  log_lines = pyqtSignal(list)  #[(datetime, str), ...]
+  message = pyqtSignal(str, str, bool)
+  finished = pyqtSignal()
+
+
+  def __init__(self, parent=None):
+    super().__init__(parent)
+    self.pending_progress = None
+    self.pending_logs = []
+    #只有在有暫存內容時才啟動 timer, 閒置時不佔用 event loop
+    self.timer = QTimer(self)
+    self.timer.setSingleShot(True)
+    self.timer.setInterval(get_ui_cfg()["flushIntervalMs"])
+    self.timer.timeout.connect(self.flush)
+
+
+  def attach(self, worker: Worker):
+    """將 worker 的 signal 接到此合併層"""
+    worker.progress.connect(self.on_progress)
+    worker.log_text.connect(self.on_log_text)
+    worker.message.connect(self.on_message)
+    worker.finished.connect(self.on_finished)
+
+
+  def schedule(self):
+    if not self.timer.isActive():
+      self.timer.start()
+
+
+  def on_progress(self, num: int):
+    self.pending_progress = num
+    self.schedule()
+
+
+  def on_log_text(self, text: str):
+    self.pending_logs.append((datetime.now(), text))
+    self.schedule()
+
+
+  def on_message(self, status: str, msg: str, skip_log: bool):
+    self.flush()
+    self.message.emit(status, msg, skip_log)
+
+
+  def on_finished(self):
+    self.flush()
+    self.finished.emit()
+
+
+  def flush(self):
+    """立即送出暫存的進度與 log"""
+    self.timer.stop()
+    if self.pending_logs:
+      lines, self.pending_logs = self.pending_logs, []
+      self.log_lines.emit(lines)
+    if self.pending_progress is not None:
+      num, self.pending_progress = self.pending_progress, None
+      self.progress.emit(num)
 
-    except Exception as e:
-      self.message.emit("error", self.get_error_msg(e), False)
-      self.progress.emit(0)
-      self.finished.emit()
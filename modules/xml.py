@@ -1,8 +1,9 @@
-import os, shutil
-from lxml import etree
+import os, shutil, threading
 from datetime import datetime
-from modules.cfg import get_export_path, get_sinf_dl_path
+from modules.cfg import get_bin_map_cfg, get_export_path, get_sinf_dl_path, get_wo_dl_path
+from modules.integrity import DigestWriter, check_written, read_manifest, remember
 from modules.log import write_log
+from modules.sinf_map import WHITESPACE, SinfMap, open_rows
 
 
 class Map:
@@ -20,9 +21,7 @@ class Map:
     row_ct: str,
     col_ct: str,
     lot: str,
-    cnt_f: int,
-    cnt_1: int,
-    cnt_x: int
+    bin_counts: dict
   ):
     self.target_device = target_device
     self.die_size_x = die_size_x
@@ -32,9 +31,7 @@ class Map:
     self.row_ct = row_ct
     self.col_ct = col_ct
     self.lot = lot
-    self.cnt_f = str(cnt_f)
-    self.cnt_1 = str(cnt_1)
-    self.cnt_x = str(cnt_x)
+    self.bin_counts = bin_counts  #key 為 Bin code, value 為數量
     self.substrate_id = self.get_substrate_id()
     self.curr_time = datetime.now().strftime("%Y%m%d%H%M%S%f")[:-4]
 
@@ -76,6 +73,67 @@ class Map:
     return checksum
 
 
+class BinTable:
+  """
+  cfg.json 的 bin_symbols / bin_default / bins 編譯後的對照表, handle_row_data() 轉置與 compare_row_cnt() 比對共用
+  2 碼的符號編譯為 65536 格的 numpy 查表 (第 1 碼 * 256 + 第 2 碼 → Bin code), 整片 wafer 一次查表, 轉置速度與對照的數量無關;
+  不規則格式的 RowData 與比對時則以 dict 查詢
+
+  Arguments:
+    bin_map_cfg (dict): get_bin_map_cfg() 的結果
+  """
+
+  def __init__(self, bin_map_cfg: dict):
+    import numpy as np
+
+    self.symbols = bin_map_cfg["symbols"]
+    self.default = bin_map_cfg["default"]
+    self.null_bin = bin_map_cfg["nullBin"]
+    self.bins = bin_map_cfg["bins"]
+    self.codes = [item["code"] for item in self.bins]
+    self.lut = np.full(65536, ord(self.default), dtype=np.uint8)
+    for symbol, code in self.symbols.items():
+      raw = symbol.encode("utf-8")
+      if len(raw) == 2:
+        self.lut[raw[0] * 256 + raw[1]] = ord(code)
+
+  def transcode(self, symbol: str) -> str:
+    """取得單一符號的 Bin code"""
+    return self.symbols.get(symbol, self.default)
+
+
+#編譯後的 BinTable, 由 load_bin_table() 在程式啟動時建立
+_bin_table = None
+_bin_table_lock = threading.Lock()
+
+
+def load_bin_table() -> BinTable:
+  """
+  檢查並編譯 cfg.json 的 bin 設定, 在程式啟動時 (GUI、常駐服務、離線轉檔) 呼叫一次
+  設定有誤時拋出 ValueError, 讓入口顯示設定錯誤, 而不是在轉檔途中才失敗
+  """
+  global _bin_table
+  table = BinTable(get_bin_map_cfg())
+  with _bin_table_lock:
+    _bin_table = table
+  return table
+
+
+def get_bin_table() -> BinTable:
+  """
+  取得 load_bin_table() 編譯後的 BinTable, 不會重新檢查設定
+  尚未編譯時 (例如以 spawn 啟動的子 process, 設定已在父 process 檢查過) 才編譯一次
+  """
+  global _bin_table
+  table = _bin_table
+  if table is None:
+    with _bin_table_lock:
+      if _bin_table is None:
+        _bin_table = BinTable(get_bin_map_cfg())
+      table = _bin_table
+  return table
+
+
 def rm_export_folder():
   """移除 export 資料夾"""
 
@@ -91,6 +149,7 @@ def rm_export_folder():
 def get_info_from_sinf(dl_path, lot_id, number) -> dict | str:
   """
   從 SINF map 檔案中取得 waferId, lot, rowDataList, rowCt, colCt
+  檔案以 mmap 讀取 (modules.sinf_map), RowData 不會轉為字串, 需要時再以 with 開啟 rowDataList 取得指向檔案內容的 memoryview
 
   Arguments:
     dl_path (str): SINF map 檔案的下載資料夾路徑
@@ -101,7 +160,7 @@ def get_info_from_sinf(dl_path, lot_id, number) -> dict | str:
     dict: 包含 waferId, lot, rowDataList, rowCt, colCt 的字典
       - waferId (str): Wafer ID
       - lot (str): Lot ID
-      - rowDataList (list): RowData 的內容
+      - rowDataList (SinfMap): RowData 的內容
       - rowCt (str): map 行數
       - colCt (str): map 欄數
     str: 如果讀取失敗則回傳 "SinfReadError"
@@ -109,25 +168,19 @@ def get_info_from_sinf(dl_path, lot_id, number) -> dict | str:
 
   try:
     sinf_path = os.path.join(dl_path, f"{lot_id}.{number}")
-    with open(sinf_path, "r") as file:
-      lines = file.readlines()
-      #讀取 WAFER 欄位 (wafer ID)
-      wafer_id = [line.split(":")[1].strip() for line in lines if line.startswith("WAFER")][0]
-      #讀取 LOT 欄位 (lot ID)
-      lot = [line.split(":")[1].strip() for line in lines if line.startswith("LOT")][0]
-      #讀取 RowData 欄位 (RowData 就是 map, 有多行)
-      row_data_list = [line.split(":")[1].strip() for line in lines if line.startswith("RowData")]
-      #讀取 ROWCT 欄位 (map 行數)
-      row_ct = [line.split(":")[1].strip() for line in lines if line.startswith("ROWCT")][0]
-      #讀取 COLCT 欄位 (map 欄數)
-      col_ct = [line.split(":")[1].strip() for line in lines if line.startswith("COLCT")][0]
-
+    sinf_map = SinfMap(sinf_path)
+    with sinf_map:
       return {
-        "waferId": wafer_id,
-        "lot": lot,
-        "rowDataList": row_data_list,
-        "rowCt": row_ct,
-        "colCt": col_ct
+        #讀取 WAFER 欄位 (wafer ID)
+        "waferId": sinf_map.header("WAFER"),
+        #讀取 LOT 欄位 (lot ID)
+        "lot": sinf_map.header("LOT"),
+        #RowData 欄位 (RowData 就是 map, 有多行), 開啟時已記錄每行的位置
+        "rowDataList": sinf_map,
+        #讀取 ROWCT 欄位 (map 行數)
+        "rowCt": sinf_map.header("ROWCT"),
+        #讀取 COLCT 欄位 (map 欄數)
+        "colCt": sinf_map.header("COLCT")
       }
 
   except Exception as e:
@@ -135,79 +188,248 @@ def get_info_from_sinf(dl_path, lot_id, number) -> dict | str:
     return "SinfReadError"
 
 
-def handle_row_data(row_data_list: list, wafer_id: str) -> dict:
+def validate_sinf(dl_path, file_name) -> dict | None:
+  """
+  檢查單片 SINF map 的表頭與 RowData: WAFER、LOT、ROWCT、COLCT 欄位需存在, ROWCT 與 COLCT 需為正整數,
+  RowData 的行數需等於 ROWCT, 每行的符號數量需等於 COLCT; 不會轉置, 檔案下載完成時即可呼叫
+
+  Arguments:
+    dl_path (str): SINF map 檔案的下載資料夾路徑
+    file_name (str): SINF map 檔案名稱, 例如 "AADZHS000.01"
+
+  Returns:
+    None: 檢查通過
+    dict: 第一個錯誤, 包含以下內容:
+      - file (str): SINF map 檔案名稱
+      - waferId (str): WAFER 欄位, 讀不到時為檔案的副檔名
+      - reason (str): 錯誤原因
+  """
+  wafer_id = file_name.split(".")[-1]
+
+  def invalid(reason: str) -> dict:
+    write_log(f"Invalid SINF map file {file_name}, wafer {wafer_id}: {reason}", "error")
+    return {"file": file_name, "waferId": wafer_id, "reason": reason}
+
+  try:
+    sinf_map = SinfMap(os.path.join(dl_path, file_name))
+    with sinf_map as rows:
+      headers = {}
+      for key in ("WAFER", "LOT", "ROWCT", "COLCT"):
+        try:
+          headers[key] = sinf_map.header(key)
+        except KeyError:
+          return invalid(f"missing {key} header")
+        if not headers[key]:
+          return invalid(f"empty {key} header")
+      wafer_id = headers["WAFER"]
+      counts = {}
+      for key in ("ROWCT", "COLCT"):
+        if not headers[key].isdigit() or int(headers[key]) <= 0:
+          return invalid(f"{key} '{headers[key]}' is not a positive integer")
+        counts[key] = int(headers[key])
+      if len(rows) != counts["ROWCT"]:
+        return invalid(f"{len(rows)} RowData rows, ROWCT is {counts['ROWCT']}")
+      for y, row in enumerate(rows):
+        col_cnt = len(bytes(row).split())
+        if col_cnt != counts["COLCT"]:
+          return invalid(f"RowData #{y} has {col_cnt} columns, COLCT is {counts['COLCT']}")
+    return None
+  except Exception as e:
+    return invalid(f"unreadable: {e}")
+
+
+#已通過 validate_sinf() 的 SINF map, key 為檔案路徑, value 為檢查時的 sha256 (下載時計算); 最多保留 _VALIDATED_MAX 筆, 超過時移除最舊的
+_validated = {}
+_validated_lock = threading.Lock()
+_VALIDATED_MAX = 4096
+
+
+def mark_validated(path: str, sha256: str | None):
+  """記錄下載時已通過 validate_sinf() 的檔案, prepare_export() 看到 SHA256SUMS 中相同的 sha256 時不需要再檢查; sha256 為 None 時不記錄"""
+  if not sha256:
+    return
+  with _validated_lock:
+    _validated.pop(path, None)
+    _validated[path] = sha256
+    while len(_validated) > _VALIDATED_MAX:
+      del _validated[next(iter(_validated))]
+
+
+def is_validated(path: str, sha256: str | None) -> bool:
+  """檔案是否已通過 validate_sinf() 且內容 (sha256) 沒有變動"""
+  with _validated_lock:
+    return bool(sha256) and _validated.get(path) == sha256
+
+
+#判斷 byte 是否為空白的對照表, 以 numpy.frombuffer(..., dtype=bool) 使用
+_WHITESPACE_MASK = bytes(1 if i in WHITESPACE else 0 for i in range(256))
+
+
+def _join_rows(rows):
+  """
+  將一片 wafer 的 RowData 串接為一個 numpy array (uint8), 每行之間補一個空白
+  直接由 memoryview 複製到 array, 不會產生每一行的字串; 串接後只需對整片 wafer 做一次向量運算
+
+  Arguments:
+    rows (list): bytes-like 的 RowData 列表, 例如指向 mmap 的 memoryview
+  """
+  import numpy as np
+
+  parts = []
+  for row in rows:
+    parts.append(np.frombuffer(row, dtype=np.uint8))
+    parts.append(np.frombuffer(b" ", dtype=np.uint8))
+  return np.concatenate(parts[:-1]) if parts else np.empty(0, dtype=np.uint8)
+
+
+def _split_symbols(data):
+  """
+  SINF 的 RowData 通常每個符號都是 2 碼並以一個空白分隔 (例如 "__ 00 OT"),
+  此時回傳每個符號第 1 碼與第 2 碼的 numpy view (不複製資料); 其他格式 (符號長度不一、多個空白或空行) 回傳 None
+
+  Arguments:
+    data (numpy.ndarray): _join_rows() 的結果
+  """
+  import numpy as np
+
+  if len(data) % 3 != 2:
+    return None
+  first, second, sep = data[0::3], data[1::3], data[2::3]
+  is_space = np.frombuffer(_WHITESPACE_MASK, dtype=bool)
+  if (sep != ord(" ")).any() or is_space[first].any() or is_space[second].any():
+    return None
+  return first, second
+
+
+def _transcode_items(row_data: str, table: BinTable, counts: dict) -> str:
   """
-  處理 RowData 的內容, 轉置為客製格式
+  逐一轉置單行 RowData 的符號, 用於 _split_symbols() 無法處理的格式
 
   Arguments:
-    row_data_list (list): RowData 的內容
+    row_data (str): 單行 RowData
+    table (BinTable): 符號與 Bin code 的對照表
+    counts (dict): 各 Bin code 的數量, 會累加此行的結果
+
+  Returns:
+    str: 轉置後的字串
+  """
+  new_row = ""
+  for item in row_data.split():
+    code = table.transcode(item)
+    new_row += code
+    counts[code] += 1
+  return new_row
+
+
+def _decode_row(row) -> str:
+  return bytes(row).decode("utf-8", "replace")
+
+
+def handle_row_data(row_data_list, wafer_id: str) -> dict:
+  """
+  處理 RowData 的內容, 依 cfg.json 的 bin_symbols 轉置為客製格式 (預設 "__" 轉置為 "F", "00" 轉置為 "1", 其他為 "X")
+
+  Arguments:
+    row_data_list (SinfMap | list): RowData 的內容, get_info_from_sinf() 的 rowDataList 或字串列表
     wafer_id (str): Wafer 編號, 僅打印用
 
   Returns:
     dict: 包含處理後的結果
     - rowDataResult (list): 處理後的 RowData 列表
-    - cntF (int): "F" 的計數
-    - cnt1 (int): "1" 的計數
-    - cntX (int): "X" 的計數
+    - binCounts (dict): 各 Bin code 的數量, 依 cfg.json 的 bins 順序
   """
 
+  import numpy as np
+
+  table = get_bin_table()
   result = []
-  cnt_f = 0
-  cnt_1 = 0
-  cnt_x = 0
+  counts = dict.fromkeys(table.codes, 0)
 
   write_log(f"Start transfer wafer ID {wafer_id} data...", "debug")
 
-  for y, row_data in enumerate(row_data_list):
-    items = row_data.strip().split()
-    new_row = ""
-    for x, item in enumerate(items):
-      # print(f"SINF data ({x}, {y}): {item}")  #for debugging
-      new_item = "X"
-      match item:
-        #如果是 Null die ("__"), 轉置為 Fail
-        case "__":
-          new_item = "F"
-          cnt_f += 1
-        #如果是 "00", 轉置為 Pass
-        case "00":
-          new_item = "1"
-          cnt_1 += 1
-        #其他
-        case _:
-          new_item = "X"
-          cnt_x += 1
-      # print(f"New data ({x}, {y}): {new_item}")  #for debugging
-      new_row += new_item
-    result.append(new_row)
-    write_log(f"Comparing row data #{y}, original data from SINF file: {row_data}, new data: {new_row}", "debug")
+  with open_rows(row_data_list) as rows:
+    symbols = _split_symbols(_join_rows(rows))
+    if symbols is not None:
+      #整片 wafer 一次查表轉置, 再以 bincount 計算各 Bin 的數量
+      first, second = symbols
+      new_items = table.lut[first.astype(np.uint16) * 256 + second]
+      bin_cnts = np.bincount(new_items, minlength=256)
+      for code in counts:
+        counts[code] = int(bin_cnts[ord(code)])
+      #再依每行的符號數量切回各行
+      new_text = new_items.tobytes().decode("ascii")
+      pos = 0
+      for row_data in rows:
+        size = (len(row_data) + 1) // 3
+        result.append(new_text[pos:pos + size])
+        pos += size
+    else:
+      for row_data in rows:
+        result.append(_transcode_items(_decode_row(row_data), table, counts))
+
+    for y, row_data in enumerate(rows):
+      write_log(f"Comparing row data #{y}, original data from SINF file: {_decode_row(row_data)}, new data: {result[y]}", "debug")
 
   return {
     "rowDataResult": result,
-    "cntF": cnt_f,
-    "cnt1": cnt_1,
-    "cntX": cnt_x
+    "binCounts": counts
   }
 
 
+def _count_before(rows, table: BinTable) -> tuple:
+  """
+  計算一片 wafer 轉置前 RowData 各 Bin code 應有的數量
+  先統計每種符號的出現次數, 再依對照表換算為 Bin code, 與 handle_row_data() 逐一查表轉置的算法不同, 作為轉置結果的獨立驗證
+
+  Arguments:
+    rows (list): bytes-like 的 RowData 列表
+    table (BinTable): 符號與 Bin code 的對照表
+
+  Returns:
+    tuple: (各 Bin code 的數量 (dict), 各 Bin code 對應的符號列表 (dict, 依第一次出現的順序, 不重複))
+  """
+  import numpy as np
+
+  counts = dict.fromkeys(table.codes, 0)
+  symbols_by_code = {code: [] for code in table.codes}
+  data = _join_rows(rows)
+  symbols = _split_symbols(data)
+  if symbols is not None:
+    first, second = symbols
+    codes = first.astype(np.uint16) * 256 + second
+    uniq, first_idx, uniq_cnts = np.unique(codes, return_index=True, return_counts=True)
+    histogram = {
+      bytes((int(uniq[i]) >> 8, int(uniq[i]) & 0xFF)).decode("utf-8", "replace"): int(uniq_cnts[i]) for i in np.argsort(first_idx)
+    }
+  else:
+    histogram = {}
+    for item in data.tobytes().decode("utf-8", "replace").split():
+      histogram[item] = histogram.get(item, 0) + 1
+
+  for symbol, cnt in histogram.items():
+    code = table.transcode(symbol)
+    counts[code] += cnt
+    symbols_by_code[code].append(symbol)
+  return counts, symbols_by_code
+
+
 def compare_row_cnt(before: dict, after: dict) -> dict | str:
   """
-  比對每一片 wafer 轉置前後的 Null, Pass (tested), Untested 數量
-  其中代表意義為:
+  比對每一片 wafer 轉置前後各 Bin code 的數量, 對照表見 cfg.json 的 bin_symbols, 預設的意義為:
   - Null: 那個座標是空的, 沒得測; 轉置前為 "__", 轉置後應該為 "F"
   - Pass (tested): 已測過; 轉置前為 "00", 轉置後應該為 "1"
   - Untested: 不該被測的, 要被 skip 的; 轉置前為 "__" 或 "00" 以外的內容, 例如 "OT" 或 "DF", 轉置後應該為 "X"
 
   Arguments:
-    before (dict): 轉置前 (擷取自 SINF map 時) 的 row data, key 為 wafer ID, value 為 row data 內容
+    before (dict): 轉置前 (擷取自 SINF map 時) 的 row data, key 為 wafer ID, value 為 row data 內容 (SinfMap 或字串列表)
     after (dict): 表示轉置後 (準備要匯入 XML 時) 的 row data, key 為 wafer ID, value 為 row data 內容
 
   Returns:
-    - dict: 為比對結果的字典, 包含以下內容:
-      1. mismatchedIdF (list), mismatchedId1 (list), mismatchedIdX (list): F, 1, X 前後數量不匹配的 wafer ID
-      2. totalBefF (int), totalBef1 (int), totalBefX (int): 轉置前的 F, 1, X 總數量 (整批)
-      3. totalAftF (int), totalAft1 (int), totalAftX (int): 轉置後的 F, 1, X 總數量 (整批)
-      4. symBefX: X 轉置前的符號 (整批); p.s. F 固定為 "__", 1 固定為 "00", 在此無須列出
+    - dict: 為比對結果的字典, 以下內容的 key 皆為 Bin code (依 cfg.json 的 bins 順序):
+      1. mismatchedIds (dict): 前後數量不匹配的 wafer ID 列表
+      2. totalBef (dict): 轉置前的數量 (整批)
+      3. totalAft (dict): 轉置後的數量 (整批)
+      4. symBef (dict): 轉置前的符號 (整批, 以 ", " 串接), 例如 {"F": "__", "1": "00", "X": "OT, DF"}
     - str: 如果失敗則回傳 error key, 例如 "CompareRowDataError"
   """
 
@@ -216,53 +438,28 @@ def compare_row_cnt(before: dict, after: dict) -> dict | str:
     if len(before.items()) != len(after.items()):
       raise ValueError("Row data count from SINF is not equal to row data count from transferred XML map")
 
-    #遍歷 row data 內容, 檢查 F, 1, X 數量是否前後一致
-    total_bef_f = 0
-    total_aft_f = 0
-    total_bef_1 = 0
-    total_aft_1 = 0
-    total_bef_x = 0
-    total_aft_x = 0
-    mismatched_ids_f = []
-    mismatched_ids_1 = []
-    mismatched_ids_x = []
+    #遍歷 row data 內容, 檢查各 Bin code 的數量是否前後一致
+    table = get_bin_table()
+    total_bef = dict.fromkeys(table.codes, 0)
+    total_aft = dict.fromkeys(table.codes, 0)
+    mismatched_ids = {code: [] for code in table.codes}
+    sym_bef = {code: {} for code in table.codes}  #以 dict 保留第一次出現的順序
     for wafer_id, row_data_list in before.items():
-      cnt_bef_f = 0
-      cnt_aft_f = 0
-      cnt_bef_1 = 0
-      cnt_aft_1 = 0
-      cnt_bef_x = 0
-      cnt_aft_x = 0
-      sym_bef_x = []
-      for idx, row_data in enumerate(row_data_list):
-        cnt_bef_f += row_data.count("__")
-        cnt_aft_f += after[wafer_id][idx].count("F")
-        cnt_bef_1 += row_data.count("00")
-        cnt_aft_1 += after[wafer_id][idx].count("1")
-        items_bef_x = [item for item in row_data.strip().split() if item not in ("__", "00")]
-        cnt_bef_x += len(items_bef_x)
-        cnt_aft_x += after[wafer_id][idx].count("X")
-        sym_bef_x += items_bef_x
-
-      total_bef_f += cnt_bef_f
-      total_aft_f += cnt_aft_f
-      total_bef_1 += cnt_bef_1
-      total_aft_1 += cnt_aft_1
-      total_bef_x += cnt_bef_x
-      total_aft_x += cnt_aft_x
-      sym_bef_x = ", ".join(sorted(set(sym_bef_x), key=sym_bef_x.index))
-      if not cnt_bef_f == cnt_aft_f:
-        mismatched_ids_f.append(wafer_id)
-      if not cnt_bef_1 == cnt_aft_1:
-        mismatched_ids_1.append(wafer_id)
-      if not cnt_bef_x == cnt_aft_x:
-        mismatched_ids_x.append(wafer_id)
-    result= {
-      "mismatchedIdF": mismatched_ids_f, "totalBefF": total_bef_f, "totalAftF": total_aft_f,
-      "mismatchedId1": mismatched_ids_1, "totalBef1": total_bef_1, "totalAft1": total_aft_1,
-      "mismatchedIdX": mismatched_ids_x, "totalBefX": total_bef_x, "totalAftX": total_aft_x, "symBefX": sym_bef_x
+      with open_rows(row_data_list) as rows:
+        cnt_bef, symbols_by_code = _count_before(rows, table)
+        after_text = "".join(after[wafer_id][:len(rows)])
+
+      for code in table.codes:
+        cnt_aft = after_text.count(code)
+        total_bef[code] += cnt_bef[code]
+        total_aft[code] += cnt_aft
+        sym_bef[code].update(dict.fromkeys(symbols_by_code[code]))
+        if cnt_bef[code] != cnt_aft:
+          mismatched_ids[code].append(wafer_id)
+    return {
+      "mismatchedIds": mismatched_ids, "totalBef": total_bef, "totalAft": total_aft,
+      "symBef": {code: ", ".join(symbols) for code, symbols in sym_bef.items()}
     }
-    return result
   except Exception as e:
     write_log(f"Error occurred comparing row data: {e}", "error")
     return "CompareRowDataError"
@@ -279,6 +476,11 @@ def generate_xml(map: Map):
     Element: Map 為根元素的 XML 內容
   """
 
+  #延遲載入 lxml, 縮短程式啟動時間
+  from lxml import etree
+
+  table = get_bin_table()
+
   #Map 元素
   map_el = etree.Element("Map")
   map_el.set("xmlns", "http://www.semi.org")
@@ -296,7 +498,7 @@ def generate_xml(map: Map):
   device_el.set("DeviceSizeX", str(map.die_size_x))
   device_el.set("DeviceSizeY", str(map.die_size_y))
   device_el.set("FrameId", "")
-  device_el.set("NullBin", "F")
+  device_el.set("NullBin", table.null_bin)
   device_el.set("ProductId", map.target_device)
   device_el.set("SupplierName", "AMKOR")
   device_el.set("Rows", map.row_ct)
@@ -315,26 +517,13 @@ def generate_xml(map: Map):
   ref_device_el.set("RefDevicePosX", "")
   ref_device_el.set("RefDevicePosY", "")
 
-  #Bin 1 元素
-  bin_el_1 = etree.SubElement(device_el, "Bin")
-  bin_el_1.set("BinCode", "1")
-  bin_el_1.set("BinQuality", "Pass")
-  bin_el_1.set("BinDescription", "Normal Pass")
-  bin_el_1.set("BinCount", map.cnt_1)
-
-  #Bin X 元素
-  bin_el_x = etree.SubElement(device_el, "Bin")
-  bin_el_x.set("BinCode", "X")
-  bin_el_x.set("BinQuality", "Fail")
-  bin_el_x.set("BinDescription", "Normal Fail")
-  bin_el_x.set("BinCount", map.cnt_x)
-
-  #Bin F 元素
-  bin_el_x = etree.SubElement(device_el, "Bin")
-  bin_el_x.set("BinCode", "F")
-  bin_el_x.set("BinQuality", "NULL")
-  bin_el_x.set("BinDescription", "NULL")
-  bin_el_x.set("BinCount", map.cnt_f)
+  #Bin 元素, 依 cfg.json 的 bins 順序
+  for item in table.bins:
+    bin_el = etree.SubElement(device_el, "Bin")
+    bin_el.set("BinCode", item["code"])
+    bin_el.set("BinQuality", item["quality"])
+    bin_el.set("BinDescription", item["description"])
+    bin_el.set("BinCount", str(map.bin_counts.get(item["code"], 0)))
 
   #Data 元素
   data_el = etree.SubElement(device_el, "Data")
@@ -349,7 +538,33 @@ def generate_xml(map: Map):
   return map_el
 
 
-def prepare_export(lot_id, target_device, die_size_x, die_size_y) -> dict | str:
+def get_wafer_letter(files: list) -> str:
+  """
+  取得最小刻號, 規則為取每批第一片 wafer id, 再轉換為英文字母
+  例如: #2~#25, 取 #2 轉為英文字母 "B"
+
+  Arguments:
+    files (list): SINF map 檔名列表, 例如 ["AADZHS000.02", "AADZHS000.03"]
+  """
+  min_id = min(int(file.split(".")[-1]) for file in files)
+  return chr(ord("A") + min_id - 1)
+
+
+def restamp_create_date(maps_el):
+  """
+  將 XML 中每片 wafer 的 CreateDate 與 LastModified 改為目前時間, 用於預先轉檔 (modules.prefetch) 的結果,
+  讓 XML 記錄的是 Execute 的時間而不是預先轉檔的時間
+
+  Arguments:
+    maps_el (etree.Element): prepare_export() 產生的 Maps 元素
+  """
+  curr_time = datetime.now().strftime("%Y%m%d%H%M%S%f")[:-4]
+  for device_el in maps_el.iter("Device"):
+    device_el.set("CreateDate", curr_time)
+    device_el.set("LastModified", curr_time)
+
+
+def prepare_export(lot_id, target_device, die_size_x, die_size_y, cancel_check=None, dl_path=None, on_invalid=None) -> dict | str:
   """
   匯出前的材料準備
 
@@ -358,33 +573,45 @@ def prepare_export(lot_id, target_device, die_size_x, die_size_y) -> dict | str:
     target_device (str): 讀取 WO 資訊組成, 例如 "ACIPCD0K0BA111"
     die_size_x (float): 從 SINF map 中取得
     die_size_y (float): 從 SINF map 中取得
+    cancel_check (function): 每片 wafer 轉檔前呼叫, 已取消時應拋出例外以停止轉檔
+    dl_path (str): SINF map 所在的資料夾, 未指定時為 dl_basic_dir 中的 APC_{lot_id} (離線轉檔時指定其他資料夾)
+    on_invalid (function): 有問題的 wafer 的回呼, 參數為 validate_sinf() 的結果 (包含 file, waferId, reason)
 
   Returns:
     - dict: 如果匯出成功, 則回傳包含以下內容的字典:
       - mapsEl (etree.Element): 包含 Maps 的 XML element
       - lotNo (str): f"{lot_id}{wafer_letter}"
-      - rowDataBef (dict): 資料轉置前的 row data, key 為 wafer ID, value 為 row data 值
+      - rowDataBef (dict): 資料轉置前的 row data, key 為 wafer ID, value 為 SinfMap (比對時才再 mmap 讀取)
       - rowDataAft (dict): 資料轉置後的 row data, key 為 wafer ID, value 為 row data 值
-    - str: 如果失敗則回傳 error key, 例如 "SinfReadError" 或 "ExportXmlError"
+    - str: 如果失敗則回傳 error key, 例如 "SinfInvalidError" (表頭或行列數有誤, 有問題的 wafer 與原因會交給 on_invalid), "SinfReadError" 或 "ExportXmlError"
   """
 
+  from lxml import etree
+
   try:
     #生成 XML 根元素 Maps
     maps_el = etree.Element("Maps")
 
-    #遍歷 SINF map 的下載資料夾
-    dl_path = get_sinf_dl_path(lot_id, f"APC_{lot_id}")
+    #遍歷 SINF map 的下載資料夾; 下載時已逐片檢查過的檔案以 SHA256SUMS 的 sha256 確認沒有變動 (離線轉檔指定的資料夾沒有此記錄)
+    folder_name = f"APC_{lot_id}"
+    digests = {} if dl_path else read_manifest(get_wo_dl_path(lot_id))
+    dl_path = dl_path or get_sinf_dl_path(lot_id, folder_name)
 
-    #取得最小刻號, 規則為取每批第一片 wafer id, 再轉換為英文字母
-    #例如: #2~#25, 取 #2 轉為英文字母 "B"
-    wafer_ids = [int(file.split(".")[-1]) for file in os.listdir(dl_path)]
-    wafer_ids.sort()
-    min_id = wafer_ids[0]
-    wafer_letter = chr(ord("A") + int(min_id) - 1)
+    wafer_letter = get_wafer_letter(os.listdir(dl_path))
 
     row_data_bef = {}
     row_data_aft = {}
-    for file in os.listdir(dl_path):
+    #依檔名排序, 確保 XML 中 Map 的順序與檔案系統的列舉順序無關
+    for file in sorted(os.listdir(dl_path)):
+      if cancel_check:
+        cancel_check()
+      #先檢查表頭與 RowData 的行列數, 有問題的 wafer 不需轉置其餘檔案即可結束
+      if not is_validated(os.path.join(dl_path, file), digests.get(f"{folder_name}/{file}")):
+        invalid = validate_sinf(dl_path, file)
+        if invalid:
+          if on_invalid:
+            on_invalid(invalid)
+          return "SinfInvalidError"
       #取得單片 SINF map 檔案資訊
       number = file.split(".")[-1]  #取得副檔名作為 number
       sinf_info = get_info_from_sinf(dl_path, lot_id, number)
@@ -399,13 +626,10 @@ def prepare_export(lot_id, target_device, die_size_x, die_size_y) -> dict | str:
       #客製化處理 RowData 內容
       processed_row_data = handle_row_data(row_data_list, wafer_id)
       row_data_result = processed_row_data["rowDataResult"]
-      cnt_f = processed_row_data["cntF"]
-      cnt_1 = processed_row_data["cnt1"]
-      cnt_x = processed_row_data["cntX"]
 
       #創建 Map 實例, 將 SINF map 資訊存進此實例中
       map_inst = Map(target_device, die_size_x, die_size_y, row_data_result,
-                      wafer_id, row_ct, col_ct, lot, cnt_f, cnt_1, cnt_x)
+                      wafer_id, row_ct, col_ct, lot, processed_row_data["binCounts"])
       map_inst.set_lot_no(wafer_letter)
 
       #生成 XML 內容
@@ -439,6 +663,8 @@ def export_xml(lot_id, maps_el, lot_no) -> str:
     - str: 如果失敗則回傳 error key, 例如 "ExportXmlError"
   """
 
+  from lxml import etree
+
   try:
     #取得匯出資料夾路徑
     export_path = get_export_path()
@@ -448,12 +674,15 @@ def export_xml(lot_id, maps_el, lot_no) -> str:
     xml_path = rf"{export_path}\{lot_no}.xml"
     #產生 XML 並保留 CDATA
     xml_bytes = etree.tostring(maps_el, encoding="utf-8", pretty_print=True, xml_declaration=False)
-    #將 XML 內容寫入檔案
+    #將 XML 內容寫入檔案, 同時計算 SHA-256, 上傳與備份時以此比對 (modules.integrity)
     with open(xml_path, "wb") as xml_file:
-      xml_file.write(b'<?xml version="1.0" ?>\n')
-      xml_file.write(xml_bytes)
-      write_log(f"Export to XML successfully, lot ID: {lot_id}", "success")
-      return xml_path
+      writer = DigestWriter(xml_file)
+      writer.write(b'<?xml version="1.0" ?>\n')
+      writer.write(xml_bytes)
+    check_written(xml_path, writer.digest())
+    remember(xml_path, writer.digest())
+    write_log(f"Export to XML successfully, lot ID: {lot_id}", "success")
+    return xml_path
 
   except Exception as e:
     write_log(f"Error exporting XML for lot {lot_id}: {e}", "error")
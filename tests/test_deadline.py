@@ -0,0 +1,38 @@
+import threading, unittest
+from bench.sandbox import sandbox_cfg
+from modules.deadline import PipelineCancelled, RunControl
+
+
+class AbandonedCallTest(unittest.TestCase):
+
+  def test_timed_out_call_is_tracked_until_the_thread_stops(self):
+    with sandbox_cfg(stage_timeout_sec={"sinf": 0.2}):
+      control = RunControl()
+    stopped = threading.Event()
+
+    def download():
+      #與 download_sinf_map() 相同, 每段資料都呼叫檢查點, 逾時後停止
+      while True:
+        try:
+          control.check()
+        except PipelineCancelled:
+          stopped.set()
+          raise
+        threading.Event().wait(0.05)
+
+    with self.assertRaises(PipelineCancelled) as ctx:
+      control.call("sinf", download)
+    self.assertEqual(ctx.exception.reason, "StageTimeout")
+    self.assertEqual(len(control.abandoned), 1)
+    self.assertTrue(control.wait_abandoned(timeout=5))
+    self.assertTrue(stopped.is_set())
+
+  def test_completed_call_is_not_tracked(self):
+    control = RunControl()
+    self.assertEqual(control.call("convert", lambda: 42), 42)
+    self.assertEqual(control.abandoned, [])
+    self.assertTrue(control.wait_abandoned(timeout=0))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,55 @@
+import tempfile, unittest
+from types import SimpleNamespace
+from stat import S_IFDIR
+from unittest import mock
+from bench.sandbox import sandbox_cfg
+from modules import prefetch
+
+
+class FakeSftp:
+  """只提供 poll_once() 用到的 listdir_attr(), 遠端只有一個 APC_ 資料夾"""
+
+  def __init__(self, lot_id: str, mtime: float):
+    self.sftp = object()
+    self.folder = SimpleNamespace(filename=f"APC_{lot_id}", st_mode=S_IFDIR, st_mtime=mtime)
+
+  def listdir_attr(self, path: str) -> list:
+    if path.endswith(self.folder.filename):
+      return [SimpleNamespace(filename="LOT.01", st_size=100)]
+    return [self.folder]
+
+
+class PollOnceTest(unittest.TestCase):
+
+  def poll_twice(self, results: list) -> tuple:
+    """以相同的遠端資料夾 (修改時間不變) 輪詢兩次, 回傳 (prefetch_lot 的呼叫次數, watcher)"""
+    lot_id = "TEST00000"
+    sftp = FakeSftp(lot_id, prefetch.time.time())
+    with tempfile.TemporaryDirectory() as root, sandbox_cfg(root, prefetch_max_age_hours=1), \
+         mock.patch.object(prefetch, "acquire_sftp", return_value=sftp), \
+         mock.patch.object(prefetch, "release_sftp"), \
+         mock.patch.object(prefetch, "write_log"), \
+         mock.patch.object(prefetch, "prefetch_lot", side_effect=results) as prefetch_lot:
+      watcher = prefetch.PrefetchWatcher()
+      watcher.poll_once()
+      watcher.poll_once()
+      prefetch.mark_consumed(lot_id)
+    return prefetch_lot.call_count, watcher
+
+  def test_download_in_progress_is_retried(self):
+    call_count, watcher = self.poll_twice(["DownloadInProgress", None])
+    self.assertEqual(call_count, 2)
+    self.assertIn("APC_TEST00000", watcher.seen)
+
+  def test_wo_not_found_is_retried(self):
+    call_count, _ = self.poll_twice(["WoNotFoundError", None])
+    self.assertEqual(call_count, 2)
+
+  def test_final_result_is_not_retried(self):
+    call_count, watcher = self.poll_twice([None])
+    self.assertEqual(call_count, 1)
+    self.assertIn("APC_TEST00000", watcher.seen)
+
+
+if __name__ == "__main__":
+  unittest.main()